@@ -5,6 +5,12 @@ from sqlalchemy.ext.asyncio import async_engine_from_config
 from app.core.database import Base
 from sqlalchemy import pool
 from app.projects.models import Project, ProviderConfig  # noqa: F401
+from app.payments.models import (  # noqa: F401
+    IdempotencyKey,
+    Transaction,
+    PaymentAttempt,
+    WebhookEvent,
+)
 from app.core.config import settings
 from alembic import context
 
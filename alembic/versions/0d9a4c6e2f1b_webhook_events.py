@@ -0,0 +1,53 @@
+"""webhook events
+
+Revision ID: 0d9a4c6e2f1b
+Revises: b52e07c9a1d3
+Create Date: 2026-10-18 15:31:12.684205
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0d9a4c6e2f1b"
+down_revision: Union[str, Sequence[str], None] = "b52e07c9a1d3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "webhook_events",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("project_id", sa.UUID(), nullable=False),
+        sa.Column("provider_name", sa.String(length=255), nullable=False),
+        sa.Column("event_id", sa.String(length=255), nullable=False),
+        sa.Column("provider_payment_id", sa.String(length=255), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("occurred_at", sa.DateTime(), nullable=False),
+        sa.Column("received_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "provider_name", "event_id", name="uq_webhook_events_provider_event"
+        ),
+    )
+    op.add_column(
+        "transactions", sa.Column("status_updated_at", sa.DateTime(), nullable=True)
+    )
+    op.create_index(
+        "ix_transactions_provider_payment",
+        "transactions",
+        ["provider_name", "provider_payment_id"],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_transactions_provider_payment", table_name="transactions")
+    op.drop_column("transactions", "status_updated_at")
+    op.drop_table("webhook_events")
@@ -0,0 +1,31 @@
+"""project charge timeout
+
+Revision ID: 349a64c2f4a4
+Revises: 4f8835e5277f
+Create Date: 2026-10-18 12:24:09.551873
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "349a64c2f4a4"
+down_revision: Union[str, Sequence[str], None] = "4f8835e5277f"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "projects", sa.Column("charge_timeout_ms", sa.Integer(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("projects", "charge_timeout_ms")
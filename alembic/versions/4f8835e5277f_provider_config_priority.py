@@ -0,0 +1,32 @@
+"""provider config priority
+
+Revision ID: 4f8835e5277f
+Revises: 796f7d637e69
+Create Date: 2026-10-18 11:02:47.118530
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4f8835e5277f"
+down_revision: Union[str, Sequence[str], None] = "796f7d637e69"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "provider_configs",
+        sa.Column("priority", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("provider_configs", "priority")
@@ -0,0 +1,36 @@
+"""project owner
+
+Revision ID: 5e0b9f2a7c14
+Revises: a81d5c3f6e07
+Create Date: 2026-10-18 17:48:53.612094
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5e0b9f2a7c14"
+down_revision: Union[str, Sequence[str], None] = "a81d5c3f6e07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # existing projects have no owner, only their API key works for them
+    op.add_column("projects", sa.Column("user_id", sa.Integer(), nullable=True))
+    op.create_index("ix_projects_user_id", "projects", ["user_id"])
+    op.create_foreign_key(
+        "projects_user_id_fkey", "projects", "users", ["user_id"], ["id"]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint("projects_user_id_fkey", "projects", type_="foreignkey")
+    op.drop_index("ix_projects_user_id", table_name="projects")
+    op.drop_column("projects", "user_id")
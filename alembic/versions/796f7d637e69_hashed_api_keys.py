@@ -0,0 +1,73 @@
+"""hashed api keys
+
+Revision ID: 796f7d637e69
+Revises: df85e8681079
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+
+import hashlib
+from secrets import token_urlsafe
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "796f7d637e69"
+down_revision: Union[str, Sequence[str], None] = "df85e8681079"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "projects", sa.Column("api_key_hash", sa.String(length=64), nullable=True)
+    )
+    op.add_column(
+        "projects", sa.Column("api_key_prefix", sa.String(length=8), nullable=True)
+    )
+
+    # backfill. projects created through the old code path have the raw key in an `api_key` column,
+    # which we hash in place. projects without one get a fresh random key that nobody knows, they have to be rotated.
+    bind = op.get_bind()
+    columns = {c["name"] for c in sa.inspect(bind).get_columns("projects")}
+    has_raw_key = "api_key" in columns
+    select_columns = "id, api_key" if has_raw_key else "id, NULL"
+    rows = bind.execute(sa.text(f"SELECT {select_columns} FROM projects")).fetchall()
+    updates = []
+    for project_id, raw_key in rows:
+        api_key = raw_key or token_urlsafe(32)
+        updates.append(
+            {
+                "id": project_id,
+                "api_key_hash": hashlib.sha256(api_key.encode()).hexdigest(),
+                "api_key_prefix": api_key[:8],
+            }
+        )
+    if updates:
+        bind.execute(
+            sa.text(
+                "UPDATE projects SET api_key_hash = :api_key_hash, api_key_prefix = :api_key_prefix WHERE id = :id"
+            ),
+            updates,
+        )
+
+    op.alter_column("projects", "api_key_hash", nullable=False)
+    op.alter_column("projects", "api_key_prefix", nullable=False)
+    op.create_index(
+        "ix_projects_api_key_hash", "projects", ["api_key_hash"], unique=True
+    )
+    if has_raw_key:
+        op.drop_column("projects", "api_key")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # the raw keys can't be recovered from their digests, so downgrading loses every key. the schema of the previous
+    # revision has no api_key column (databases that had one got it from outside the migrations), so none is re-added
+    op.drop_index("ix_projects_api_key_hash", table_name="projects")
+    op.drop_column("projects", "api_key_prefix")
+    op.drop_column("projects", "api_key_hash")
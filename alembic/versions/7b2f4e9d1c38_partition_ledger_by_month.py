@@ -0,0 +1,242 @@
+"""partition ledger by month
+
+Revision ID: 7b2f4e9d1c38
+Revises: c3e1a7b95d20
+Create Date: 2026-10-18 16:42:37.915042
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7b2f4e9d1c38"
+down_revision: Union[str, Sequence[str], None] = "c3e1a7b95d20"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# months of partitions created ahead of the current one, after that `python -m app.payments.maintenance` keeps
+# creating them
+MONTHS_AHEAD = 3
+
+
+def _create_monthly_partitions(table: str) -> None:
+    # one partition per month from the oldest row already in the old table (or this month) up to MONTHS_AHEAD from
+    # now, named <table>_y<year>m<month> like the maintenance command names them
+    op.execute(
+        f"""
+        DO $$
+        DECLARE
+            month date := date_trunc(
+                'month', coalesce((SELECT min(created_at) FROM {table}_unpartitioned), now())
+            );
+        BEGIN
+            WHILE month <= date_trunc('month', now()) + interval '{MONTHS_AHEAD} months' LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)',
+                    '{table}_' || to_char(month, '"y"YYYY"m"MM'),
+                    month,
+                    month + interval '1 month'
+                );
+                month := month + interval '1 month';
+            END LOOP;
+        END $$
+        """
+    )
+    # catches rows outside every monthly partition, so the ledger never fails to write because the maintenance
+    # command didn't run. the command moves them out into their month's partition when it creates it
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a table can't be turned into a partitioned one in place: the old tables are renamed, their indexes dropped
+    # (index names are unique per schema), the data copied into the new partitioned tables and the old ones dropped
+    op.rename_table("transactions", "transactions_unpartitioned")
+    op.rename_table("payment_attempts", "payment_attempts_unpartitioned")
+    op.execute(
+        "ALTER TABLE transactions_unpartitioned "
+        "RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey"
+    )
+    op.execute(
+        "ALTER TABLE payment_attempts_unpartitioned "
+        "RENAME CONSTRAINT payment_attempts_pkey TO payment_attempts_unpartitioned_pkey"
+    )
+    op.drop_index(
+        "ix_transactions_provider_payment", table_name="transactions_unpartitioned"
+    )
+    op.drop_index(
+        "ix_transactions_project_created", table_name="transactions_unpartitioned"
+    )
+    op.drop_index(
+        "ix_payment_attempts_transaction_id",
+        table_name="payment_attempts_unpartitioned",
+    )
+    op.drop_index(
+        "ix_payment_attempts_project_created",
+        table_name="payment_attempts_unpartitioned",
+    )
+
+    op.create_table(
+        "transactions",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("project_id", sa.UUID(), nullable=False),
+        sa.Column("amount", sa.Integer(), nullable=False),
+        sa.Column("currency", sa.String(length=3), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("provider_name", sa.String(length=255), nullable=True),
+        sa.Column("provider_payment_id", sa.String(length=255), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.Column("status_updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["project_id"],
+            ["projects.id"],
+        ),
+        sa.PrimaryKeyConstraint("id", "created_at"),
+        postgresql_partition_by="RANGE (created_at)",
+    )
+    op.create_table(
+        "payment_attempts",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("transaction_id", sa.UUID(), nullable=False),
+        sa.Column("project_id", sa.UUID(), nullable=False),
+        sa.Column("provider_name", sa.String(length=255), nullable=False),
+        sa.Column("succeeded", sa.Boolean(), nullable=False),
+        sa.Column("latency_ms", sa.Float(), nullable=False),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id", "created_at"),
+        postgresql_partition_by="RANGE (created_at)",
+    )
+    # created on the parents, postgres creates them on every partition
+    op.create_index(
+        "ix_transactions_provider_payment",
+        "transactions",
+        ["provider_name", "provider_payment_id"],
+    )
+    op.create_index(
+        "ix_transactions_project_created",
+        "transactions",
+        ["project_id", "created_at", "id"],
+    )
+    op.create_index(
+        "ix_transactions_created_brin",
+        "transactions",
+        ["created_at"],
+        postgresql_using="brin",
+    )
+    op.create_index(
+        "ix_payment_attempts_transaction_id", "payment_attempts", ["transaction_id"]
+    )
+    op.create_index(
+        "ix_payment_attempts_project_created",
+        "payment_attempts",
+        ["project_id", "created_at", "id"],
+    )
+    op.create_index(
+        "ix_payment_attempts_created_brin",
+        "payment_attempts",
+        ["created_at"],
+        postgresql_using="brin",
+    )
+    _create_monthly_partitions("transactions")
+    _create_monthly_partitions("payment_attempts")
+
+    op.execute(
+        "INSERT INTO transactions (id, project_id, amount, currency, status, provider_name, "
+        "provider_payment_id, created_at, updated_at, status_updated_at) "
+        "SELECT id, project_id, amount, currency, status, provider_name, provider_payment_id, "
+        "created_at, updated_at, status_updated_at FROM transactions_unpartitioned"
+    )
+    op.execute(
+        "INSERT INTO payment_attempts (id, transaction_id, project_id, provider_name, succeeded, "
+        "latency_ms, error, created_at) "
+        "SELECT id, transaction_id, project_id, provider_name, succeeded, latency_ms, error, "
+        "created_at FROM payment_attempts_unpartitioned"
+    )
+    op.drop_table("payment_attempts_unpartitioned")
+    op.drop_table("transactions_unpartitioned")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # back to plain tables, with the rows of the partitions that are still attached. archived partitions stay archived
+    op.rename_table("transactions", "transactions_partitioned")
+    op.rename_table("payment_attempts", "payment_attempts_partitioned")
+    for index, table in (
+        ("ix_transactions_provider_payment", "transactions_partitioned"),
+        ("ix_transactions_project_created", "transactions_partitioned"),
+        ("ix_transactions_created_brin", "transactions_partitioned"),
+        ("ix_payment_attempts_transaction_id", "payment_attempts_partitioned"),
+        ("ix_payment_attempts_project_created", "payment_attempts_partitioned"),
+        ("ix_payment_attempts_created_brin", "payment_attempts_partitioned"),
+    ):
+        op.drop_index(index, table_name=table)
+    op.execute(
+        "ALTER TABLE transactions_partitioned "
+        "RENAME CONSTRAINT transactions_pkey TO transactions_partitioned_pkey"
+    )
+    op.execute(
+        "ALTER TABLE payment_attempts_partitioned "
+        "RENAME CONSTRAINT payment_attempts_pkey TO payment_attempts_partitioned_pkey"
+    )
+
+    op.create_table(
+        "transactions",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("project_id", sa.UUID(), nullable=False),
+        sa.Column("amount", sa.Integer(), nullable=False),
+        sa.Column("currency", sa.String(length=3), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("provider_name", sa.String(length=255), nullable=True),
+        sa.Column("provider_payment_id", sa.String(length=255), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.Column("status_updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["project_id"],
+            ["projects.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "payment_attempts",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("transaction_id", sa.UUID(), nullable=False),
+        sa.Column("project_id", sa.UUID(), nullable=False),
+        sa.Column("provider_name", sa.String(length=255), nullable=False),
+        sa.Column("succeeded", sa.Boolean(), nullable=False),
+        sa.Column("latency_ms", sa.Float(), nullable=False),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute("INSERT INTO transactions SELECT * FROM transactions_partitioned")
+    op.execute(
+        "INSERT INTO payment_attempts SELECT * FROM payment_attempts_partitioned"
+    )
+    # dropping the parents drops their partitions
+    op.drop_table("payment_attempts_partitioned")
+    op.drop_table("transactions_partitioned")
+    op.create_index(
+        "ix_transactions_provider_payment",
+        "transactions",
+        ["provider_name", "provider_payment_id"],
+    )
+    op.create_index(
+        "ix_transactions_project_created",
+        "transactions",
+        ["project_id", "created_at", "id"],
+    )
+    op.create_index(
+        "ix_payment_attempts_transaction_id", "payment_attempts", ["transaction_id"]
+    )
+    op.create_index(
+        "ix_payment_attempts_project_created",
+        "payment_attempts",
+        ["project_id", "created_at", "id"],
+    )
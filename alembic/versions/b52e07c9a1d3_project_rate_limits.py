@@ -0,0 +1,35 @@
+"""project rate limits
+
+Revision ID: b52e07c9a1d3
+Revises: 4ca6ef389873
+Create Date: 2026-10-18 15:02:41.207318
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b52e07c9a1d3"
+down_revision: Union[str, Sequence[str], None] = "4ca6ef389873"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "projects", sa.Column("rate_limit_per_second", sa.Float(), nullable=True)
+    )
+    op.add_column(
+        "projects", sa.Column("rate_limit_burst", sa.Integer(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("projects", "rate_limit_burst")
+    op.drop_column("projects", "rate_limit_per_second")
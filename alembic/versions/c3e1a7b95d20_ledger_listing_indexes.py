@@ -0,0 +1,38 @@
+"""ledger listing indexes
+
+Revision ID: c3e1a7b95d20
+Revises: 0d9a4c6e2f1b
+Create Date: 2026-10-18 16:04:51.207316
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c3e1a7b95d20"
+down_revision: Union[str, Sequence[str], None] = "0d9a4c6e2f1b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_transactions_project_created",
+        "transactions",
+        ["project_id", "created_at", "id"],
+    )
+    op.create_index(
+        "ix_payment_attempts_project_created",
+        "payment_attempts",
+        ["project_id", "created_at", "id"],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_payment_attempts_project_created", table_name="payment_attempts")
+    op.drop_index("ix_transactions_project_created", table_name="transactions")
@@ -1,12 +1,172 @@
+from typing import Optional
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 
+# http client settings for a single payment provider
+class ProviderHTTPSettings(BaseModel):
+    base_url: str
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0  # seconds an idle connection is kept open
+    http2: bool = False  # needs the optional `h2` package
+    connect_timeout: float = 3.0
+    read_timeout: float = 10.0
+    write_timeout: float = 5.0
+    pool_timeout: float = (
+        2.0  # seconds to wait for a free connection from the client's pool
+    )
+
+
 # settings class to load env variables, like i used to make config.py file in django
 class Settings(BaseSettings):
     DATABASE_URL: str
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # prefix of the api routes, the routers are mounted at the root for now
+    API_V1_STR: str = ""
+    # bearer token for /metrics and /internal/*, which show every project's providers and traffic.
+    # those routes answer 404 while it isn't set
+    INTERNAL_API_TOKEN: Optional[str] = None
+
+    # in-process cache for API key -> project lookups
+    PROJECT_CACHE_MAXSIZE: int = 10_000
+    PROJECT_CACHE_TTL_SECONDS: float = 60.0
+    # how long unknown keys are remembered, so brute forcing keys doesn't reach the database
+    PROJECT_CACHE_NEGATIVE_TTL_SECONDS: float = 10.0
+
+    # API key index shared by the workers of a host through a memory mapped file, e.g. /dev/shm/payment-keys.idx.
+    # one worker rebuilds it every API_KEY_INDEX_REFRESH_SECONDS, the others pick up the new file within
+    # API_KEY_INDEX_CHECK_SECONDS. disabled when no path is set
+    API_KEY_INDEX_PATH: Optional[str] = None
+    API_KEY_INDEX_REFRESH_SECONDS: float = 30.0
+    API_KEY_INDEX_CHECK_SECONDS: float = 1.0
+
+    # caches for cookie authenticated dashboard routes
+    TOKEN_CACHE_MAXSIZE: int = 10_000  # verified JWTs, each one lives until its own exp
+    USER_CACHE_MAXSIZE: int = 10_000
+    # also how long a deactivated user can keep using a worker that cached them
+    USER_CACHE_TTL_SECONDS: float = 30.0
+
+    # argon2 hashing runs off the event loop, in a "thread" or "process" pool
+    PASSWORD_HASH_EXECUTOR: str = "thread"
+    PASSWORD_HASH_WORKERS: int = 4
+    # max hash/verify jobs waiting or running at once. past this, login answers 503 right away instead of queueing
+    PASSWORD_HASH_MAX_PENDING: int = 32
+
+    # database connection pool, sized per uvicorn worker
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0  # seconds to wait for a connection before giving up
+    DB_POOL_RECYCLE: int = 1800  # seconds, -1 disables recycling
+    # ping connections on checkout. turn it off if the network to the database is reliable and recycle is set
+    DB_POOL_PRE_PING: bool = True
+    # asyncpg prepared statement cache per connection, set it to 0 when running behind pgbouncer in transaction mode
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # connections opened at startup, defaults to DB_POOL_SIZE. 0 disables warmup
+    DB_POOL_WARMUP_CONNECTIONS: Optional[int] = None
+    # optional streaming replica, read only routes go to it while it answers and isn't lagging behind too much
+    DATABASE_REPLICA_URL: Optional[str] = None
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    DB_REPLICA_CHECK_INTERVAL_SECONDS: float = 2.0
+
+    # one long lived http client is created per provider. can be overridden as json, e.g.
+    # PROVIDER_HTTP='{"stripe": {"base_url": "https://api.stripe.com", "http2": true}}'
+    PROVIDER_HTTP: dict[str, ProviderHTTPSettings] = {
+        "stripe": ProviderHTTPSettings(base_url="https://api.stripe.com"),
+        "razorpay": ProviderHTTPSettings(base_url="https://api.razorpay.com"),
+    }
+
+    # compiled per project failover plans. changes are picked up on commit in this worker,
+    # the ttl bounds how long other workers can keep using an old plan
+    PLAN_CACHE_MAXSIZE: int = 10_000
+    PLAN_CACHE_TTL_SECONDS: float = 60.0
+
+    # provider health tracking and circuit breakers, per project and provider
+    ROUTER_WINDOW_SIZE: int = 100  # most recent calls the stats are computed over
+    ROUTER_MIN_SAMPLES: int = (
+        20  # calls needed before the error rate can trip the breaker
+    )
+    ROUTER_ERROR_RATE_THRESHOLD: float = 0.5
+    ROUTER_CONSECUTIVE_FAILURES: int = (
+        5  # trips the breaker regardless of the error rate
+    )
+    ROUTER_OPEN_SECONDS: float = (
+        30.0  # how long a tripped breaker stays open before letting a probe through
+    )
+    # providers whose p95 latency is above this are tried after the healthy ones
+    ROUTER_SLOW_P95_MS: float = 3000.0
+    # (project, provider) pairs tracked at once, the least recently used ones are forgotten past this
+    ROUTER_MAX_TRACKED: int = 10_000
+
+    # total time budget of a single charge, across every provider tried. clients can ask for less (or more,
+    # up to the max) with the X-Request-Timeout-Ms header, projects can have their own default
+    CHARGE_DEFAULT_TIMEOUT_MS: int = 20_000
+    CHARGE_MAX_TIMEOUT_MS: int = 60_000
+
+    # Idempotency-Key support on charges. completed responses are kept (and replayed) for the ttl
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 60 * 60
+    IDEMPOTENCY_CACHE_MAXSIZE: int = 10_000
+    IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS: float = 300.0
+    IDEMPOTENCY_CLEANUP_BATCH_SIZE: int = 1_000
+    # a key still in progress after this long belongs to a worker that died, and the next request takes it over.
+    # has to be longer than CHARGE_MAX_TIMEOUT_MS
+    IDEMPOTENCY_LEASE_SECONDS: float = 120.0
+
+    # write-behind buffer for the transaction and attempt ledger. flushed when it holds LEDGER_FLUSH_SIZE records
+    # or every LEDGER_FLUSH_INTERVAL_SECONDS. once LEDGER_BUFFER_SIZE records are waiting, charges wait for a flush
+    LEDGER_BUFFER_SIZE: int = 10_000
+    LEDGER_FLUSH_SIZE: int = 500
+    LEDGER_FLUSH_INTERVAL_SECONDS: float = 0.5
+    LEDGER_FLUSH_RETRIES: int = 3
+    LEDGER_USE_COPY: bool = True  # asyncpg COPY, otherwise multi-row INSERTs
+    # records that still can't be written after the retries are appended here as ndjson, one record per line
+    LEDGER_DEAD_LETTER_PATH: str = "ledger-dead-letter.ndjson"
+    # the ledger tables are partitioned by month, see app.payments.maintenance. partitions older than the retention
+    # are archived to gzipped csv files in LEDGER_ARCHIVE_DIR and dropped, no retention keeps everything
+    LEDGER_PARTITION_MONTHS_AHEAD: int = 3
+    LEDGER_RETENTION_MONTHS: Optional[int] = None
+    LEDGER_ARCHIVE_DIR: str = "ledger-archive"
+
+    # transaction exports stream from a server side cursor, this many rows per fetch. exports hold a connection
+    # for as long as they run, so only a few may run at once per worker
+    EXPORT_BATCH_SIZE: int = 1_000
+    EXPORT_MAX_CONCURRENT: int = 2
+
+    # batch charges: max charges per batch, charges in flight per batch, and calls in flight per provider per batch
+    BATCH_MAX_CHARGES: int = 5_000
+    BATCH_MAX_CONCURRENCY: int = 50
+    BATCH_PROVIDER_CONCURRENCY: int = 20
+
+    # hedged charges: if the provider being tried hasn't answered within this percentile of its recent latency,
+    # the next provider is tried in parallel. off unless enabled here or per request
+    CHARGE_HEDGING_ENABLED: bool = False
+    CHARGE_HEDGE_PERCENTILE: float = 0.95
+    CHARGE_HEDGE_MIN_DELAY_MS: float = 50.0
+    # used until a provider has ROUTER_MIN_SAMPLES calls recorded
+    CHARGE_HEDGE_DEFAULT_DELAY_MS: float = 2000.0
+    CHARGE_HEDGE_MAX_IN_FLIGHT: int = 2
+
+    # per API key token buckets, checked before the key is even looked up. projects can have their own limits
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_PER_SECOND: float = 50.0  # sustained requests per second
+    RATE_LIMIT_BURST: int = 100  # requests that can be made at once after being idle
+    RATE_LIMIT_SHARDS: int = 64
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+
+    # provider webhooks are verified and queued, then applied to transactions in batches by background workers.
+    # events of the same payment always go to the same worker, so they are applied in order
+    WEBHOOK_WORKERS: int = 4
+    # past this many queued events, webhooks get a 503 and the provider retries them later
+    WEBHOOK_QUEUE_SIZE: int = 20_000
+    WEBHOOK_BATCH_SIZE: int = 500
+    WEBHOOK_FLUSH_INTERVAL_SECONDS: float = 0.2
+    WEBHOOK_DEDUPE_CACHE_MAXSIZE: int = 100_000
+    WEBHOOK_DEDUPE_CACHE_TTL_SECONDS: float = 600.0
+    # an event can arrive before the ledger has written its transaction, it is tried again this many times
+    WEBHOOK_UNMATCHED_RETRIES: int = 3
+    WEBHOOK_RETRY_DELAY_SECONDS: float = 2.0
 
     class Config:
         env_file: str = ".env"
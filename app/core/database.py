@@ -1,15 +1,65 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+from sqlalchemy import Delete, Insert, Select, Update, event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings  # NOQA
+from .metrics import Counter, Gauge, Histogram
 
+logger = logging.getLogger(__name__)
 
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    pool_pre_ping=True,  # pool_pre_ping to check if connection is alive
-    connect_args={
-        "ssl": "require"
-    },  # we usually add ssl required in db url only, but asyncpg works in a bit different way
+T = TypeVar("T")
+
+pool_checkout_wait_seconds = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool, connecting included",
+)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    The default async queue pool, but recording how long each checkout waits for a connection.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_wait_seconds.observe(time.perf_counter() - start)
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    return create_async_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,  # pool_pre_ping to check if connection is alive
+        connect_args={
+            "ssl": "require",
+            # sqlalchemy's own prepared statement cache, and asyncpg's one underneath it
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        },  # we usually add ssl required in db url only, but asyncpg works in a bit different way
+    )
+
+
+engine = _create_engine(settings.DATABASE_URL)
+
+# optional streaming replica of the primary, read only sessions use it while it is healthy (see RoutingSession)
+replica_engine = (
+    _create_engine(settings.DATABASE_REPLICA_URL)
+    if settings.DATABASE_REPLICA_URL
+    else None
 )
 
 AsyncSessionLocal = sessionmaker(
@@ -19,4 +69,247 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False,
 )
 
+# same engines and pools, but connections used through them are in autocommit mode, so sessions that only read never
+# send BEGIN / ROLLBACK around their queries
+read_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+replica_read_engine = (
+    replica_engine.execution_options(isolation_level="AUTOCOMMIT")
+    if replica_engine is not None
+    else None
+)
+
+
+class ReplicaMonitor:
+    """
+    Decides whether the replica can be used: it must answer, be streaming from the primary, and be no more than
+    DB_REPLICA_MAX_LAG_SECONDS behind it. a background loop measures the lag, and any connection error marks the
+    replica down until the next successful check. until the first check passes, everything goes to the primary.
+    the replica's user needs pg_monitor (or pg_read_all_stats) to see the status of its wal receiver.
+    """
+
+    # replay lag in seconds, NULL when the replica isn't streaming. an idle primary sends no new wal, so a streaming
+    # replica that has replayed everything it received is up to date no matter how old its last replayed transaction
+    # is. one cut off from the primary has replayed everything too, but has no idea how far behind it is
+    LAG_QUERY = text(
+        "SELECT CASE "
+        "WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL "
+        "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    )
+
+    def __init__(self):
+        self.available = False
+        self.lag_seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def usable(self) -> bool:
+        return (
+            replica_engine is not None
+            and self.available
+            and self.lag_seconds is not None
+            and self.lag_seconds <= settings.DB_REPLICA_MAX_LAG_SECONDS
+        )
+
+    def mark_down(self, reason: object) -> None:
+        if self.available:
+            logger.warning(
+                "Read replica unavailable, reading from the primary: %s", reason
+            )
+        self.available = False
+
+    async def check(self) -> None:
+        try:
+            async with replica_engine.connect() as conn:
+                lag = (await conn.execute(self.LAG_QUERY)).scalar()
+        except Exception as exc:
+            self.mark_down(exc)
+            return
+        if lag is None:
+            self.lag_seconds = None
+            self.mark_down("not streaming from the primary")
+            return
+        self.lag_seconds = float(lag)
+        if self.lag_seconds > settings.DB_REPLICA_MAX_LAG_SECONDS:
+            logger.warning("Read replica is %.1fs behind the primary", self.lag_seconds)
+        self.available = True
+
+    def start(self) -> None:
+        if replica_engine is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(settings.DB_REPLICA_CHECK_INTERVAL_SECONDS)
+
+
+replica_monitor = ReplicaMonitor()
+
+db_replica_lag_seconds = Gauge(
+    "db_replica_lag_seconds",
+    "Last measured replay lag of the read replica, -1 while it is unavailable",
+    callback=lambda: (
+        replica_monitor.lag_seconds
+        if replica_monitor.available and replica_monitor.lag_seconds is not None
+        else -1.0
+    ),
+)
+db_replica_fallbacks = Counter(
+    "db_replica_fallbacks_total",
+    "Reads sent to the primary again because the replica failed or didn't have the row yet",
+)
+
+if replica_engine is not None:
+
+    @event.listens_for(replica_engine.sync_engine, "handle_error")
+    def _replica_error(context) -> None:
+        # don't wait for the next check to stop using a replica that went away
+        if context.is_disconnect or context.connection is None:
+            replica_monitor.mark_down(context.original_exception)
+
+
+class RoutingSession(Session):
+    """
+    Session sending reads to the replica, when there is a usable one, and everything else to the primary.
+
+    once a session has written, the rest of its reads go to the primary as well, so it always sees its own writes.
+    on_primary() forces the primary for reads that must not be stale.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            self._flushing
+            or isinstance(clause, (Insert, Update, Delete))
+            or not isinstance(clause, (Select, type(None)))
+        ):
+            self.info["wrote"] = True
+        if (
+            replica_read_engine is None
+            or self.info.get("wrote")
+            or self.info.get("primary")
+            or not replica_monitor.usable
+        ):
+            return read_engine.sync_engine
+        self.info["used_replica"] = True
+        return replica_read_engine.sync_engine
+
+
+ReadSessionLocal = sessionmaker(
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    autoflush=False,
+    bind=read_engine,
+    expire_on_commit=False,
+)
+
+
+@contextmanager
+def on_primary(db: AsyncSession) -> Iterator[None]:
+    """
+    Reads within the block go to the primary, even in a read only session.
+    """
+    previous = db.info.get("primary", False)
+    db.info["primary"] = True
+    try:
+        yield
+    finally:
+        db.info["primary"] = previous
+
+
+async def read_or_primary(db: AsyncSession, read: Callable[[], Awaitable[T]]) -> T:
+    """
+    Runs `read`, and runs it again on the primary if it went to the replica and either failed or found nothing.
+    for lookups whose result gets cached, or that must see rows created moments ago (new API keys, new users).
+    """
+    db.info.pop("used_replica", None)
+    try:
+        result = await read()
+    except (DBAPIError, OSError) as exc:
+        if not db.info.get("used_replica"):
+            raise
+        replica_monitor.mark_down(exc)
+        await db.rollback()
+        result = None
+    if result is None and db.info.get("used_replica"):
+        db_replica_fallbacks.inc()
+        with on_primary(db):
+            result = await read()
+    return result
+
+
 Base = declarative_base()
+
+
+def pool_status() -> dict:
+    """
+    Current state of the connection pool of this worker.
+    """
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        # overflow() goes negative while the pool hasn't opened all of its pool_size connections yet
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+    }
+
+
+def replica_status() -> Optional[dict]:
+    """
+    State of the read replica as this worker sees it, None if there is no replica.
+    """
+    if replica_engine is None:
+        return None
+    return {
+        "available": replica_monitor.available,
+        "lag_seconds": replica_monitor.lag_seconds,
+        "in_use": replica_monitor.usable,
+    }
+
+
+db_pool_checked_out = Gauge(
+    "db_pool_checked_out",
+    "Connections currently checked out of the pool",
+    callback=lambda: engine.pool.checkedout(),
+)
+db_pool_idle = Gauge(
+    "db_pool_idle",
+    "Idle connections in the pool",
+    callback=lambda: engine.pool.checkedin(),
+)
+db_pool_overflow = Gauge(
+    "db_pool_overflow",
+    "Connections open beyond pool_size",
+    callback=lambda: max(engine.pool.overflow(), 0),
+)
+
+
+async def warm_pool(connections: int) -> None:
+    """
+    Opens `connections` connections at once and puts them back in the pool, so the first requests don't pay for connecting.
+    """
+    if connections <= 0:
+        return
+    results = await asyncio.gather(
+        *(engine.connect().start() for _ in range(connections)),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for result in results:
+        if not isinstance(result, BaseException):
+            await result.close()
+    if errors:
+        # not fatal, the pool still connects lazily on demand
+        logger.warning(
+            "Could only warm %d of %d pool connections: %r",
+            connections - len(errors),
+            connections,
+            errors[0],
+        )
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, TypeVar
+from fastapi import Request
+
+T = TypeVar("T")
+
+
+class Deadline:
+    """
+    Point in time by which a request must be done. work done on its behalf only gets the remaining budget.
+    """
+
+    def __init__(self, timeout: float, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.timeout = timeout
+        self.expires_at = clock() + timeout
+
+    def remaining(self) -> float:
+        """
+        Seconds left, never negative.
+        """
+        return max(0.0, self.expires_at - self._clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class ClientDisconnected(Exception):
+    """
+    Raised when the client went away before its request was handled.
+    """
+
+
+async def run_until_disconnected(request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    Runs `awaitable`, cancelling it as soon as the client disconnects so it stops holding on to provider calls,
+    worker slots and db connections for a response nobody will read.
+    the request body must already have been read, which fastapi does for any body parameter.
+    """
+    task = asyncio.ensure_future(awaitable)
+
+    async def watch() -> None:
+        while True:
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                task.cancel()
+                return
+
+    watcher = asyncio.create_task(watch())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if task.cancelled() and watcher.done():
+            raise ClientDisconnected() from None
+        raise
+    finally:
+        watcher.cancel()
+        if not task.done():
+            # we are being cancelled ourselves
+            task.cancel()
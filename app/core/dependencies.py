@@ -1,50 +1,54 @@
-from typing import AsyncGenerator
-from fastapi import Depends, HTTPException, status, Header
+from secrets import compare_digest
+from typing import Optional
+from fastapi import Depends, HTTPException, Request, status, Header
 from sqlalchemy.ext.asyncio import AsyncSession
-from jose import jwt, JWTError
-from app.core.database import AsyncSessionLocal
+from jose import JWTError
+from app.core.database import read_or_primary
 from app.core import security
+from app.core.sessions import ReleaseSessionRoute, get_db, get_read_db, release_session  # noqa: F401
 from app.core.config import settings
 from app.users import crud as user_crud, models as user_models, schema as user_schemas
 from app.projects import crud as project_crud, models as project_models
+from app.projects.cache import project_cache
+from app.projects.index import api_key_index
+from app.projects.keys import hash_api_key
+from app.core.cache import MISSING
+from app.core.metrics import FAST_LATENCY_BUCKETS, Histogram
+from app.core.ratelimit import rate_limiter
 
 
 reusable_oauth2 = security.OAuth2PasswordBearerWithCookie(
     tokenUrl=f"{settings.API_V1_STR}/users/login/token"
 )
 
-
-async def get_db() -> AsyncGenerator[AsyncSession, None]:
-    """
-    Dependency that provides a database session for a single request.
-    """
-    db = AsyncSessionLocal()
-    try:
-        yield db
-    finally:
-        await db.close()
+dependency_seconds = Histogram(
+    "dependency_seconds",
+    "Time spent in the auth dependencies of a request",
+    buckets=FAST_LATENCY_BUCKETS,
+)
 
 
 async def get_current_user(
-    db: AsyncSession = Depends(get_db), token: str = Depends(reusable_oauth2)
+    db: AsyncSession = Depends(get_read_db), token: str = Depends(reusable_oauth2)
 ) -> user_models.User:
     """
     Dependency to get the current user from the authentication token.
     """
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
-        token_data = user_schemas.TokenData(**payload)
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Could not validate credentials",
+    with dependency_seconds.time(dependency="get_current_user"):
+        try:
+            payload = security.decode_token(token)
+            token_data = user_schemas.TokenData(username=payload.get("sub"))
+        except JWTError:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Could not validate credentials",
+            )
+        user = await user_crud.get_user_by_username_cached(
+            db, username=token_data.username
         )
-    user = await user_crud.get_user_by_username(db, username=token_data.username)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return user
 
 
 async def get_current_active_user(
@@ -59,16 +63,76 @@ async def get_current_active_user(
 
 
 async def get_project_from_api_key(
+    request: Request,
     api_key: str = Header(..., description="The API Key for your project"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ) -> project_models.Project:
     """
     Dependency to authenticate a request using a project's API key.
+    The key's rate limit is checked first, so requests over it never reach the cache or the database. keys that never
+    resolved to a project are limited together per client address, so made up keys can't each get a full bucket.
+    Lookups are served from the in-process project cache when possible, including unknown keys.
+    """
+    with dependency_seconds.time(dependency="get_project_from_api_key"):
+        api_key_hash = hash_api_key(api_key)
+        if settings.RATE_LIMIT_ENABLED:
+            client = request.client.host if request.client else None
+            rate_limit = rate_limiter.hit(api_key_hash, fallback=("unknown", client))
+            # RateLimitHeadersMiddleware puts it in the response headers
+            request.state.rate_limit = rate_limit
+            if not rate_limit.allowed:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Rate limit exceeded",
+                    headers={"Retry-After": str(rate_limit.retry_after)},
+                )
+        project = project_cache.get(api_key_hash)
+        index_miss = False
+        if project is MISSING:
+            # then the index shared by the workers of this host, and only then the database. a cached None is a key
+            # we already know to be invalid, that answers the request without either
+            project = api_key_index.get(api_key_hash)
+            index_miss = project is None
+        if index_miss:
+            # a key created moments ago may not be on the replica yet, and must not be cached as unknown
+            project = await read_or_primary(
+                db,
+                lambda: project_crud.get_project_by_api_key_hash(
+                    db=db, api_key_hash=api_key_hash
+                ),
+            )
+            # that was all the reading this session is for, hand the connection back before the handler runs
+            await release_session(db)
+            project_cache.set(
+                api_key_hash, project, group=project.id if project is not None else None
+            )
+        if not project:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Invalid API Key",
+            )
+        if settings.RATE_LIMIT_ENABLED:
+            # gives the key its own bucket, with the project's own limits. changes to them are picked up once the cached
+            # project expires
+            rate_limiter.configure(
+                api_key_hash, project.rate_limit_per_second, project.rate_limit_burst
+            )
+        return project
+
+
+async def require_internal_token(authorization: Optional[str] = Header(None)) -> None:
+    """
+    Dependency of the /metrics and /internal routes. lets through requests with INTERNAL_API_TOKEN as their bearer
+    token, and hides the routes entirely while no token is configured.
     """
-    project = await project_crud.get_project_by_api_key(db=db, api_key=api_key)
-    if not project:
+    if not settings.INTERNAL_API_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not compare_digest(
+        token.encode(), settings.INTERNAL_API_TOKEN.encode()
+    ):
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Invalid API Key",
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid internal token",
+            headers={"WWW-Authenticate": "Bearer"},
         )
-    return project
@@ -0,0 +1,48 @@
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.metrics import Counter, Histogram
+
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response, per route",
+)
+http_requests_total = Counter(
+    "http_requests_total", "Requests handled, per route and status code"
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the latency and status of every request, labelled with the route template (/payments/charge, not the
+    actual path) so the number of series stays bounded. requests that match no route are all counted as "unmatched".
+
+    plain ASGI rather than BaseHTTPMiddleware, which would add a task and a copy of the body to every request.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the router puts the matched route in the scope
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            http_request_duration_seconds.observe(
+                time.perf_counter() - start, method=method, route=path
+            )
+            http_requests_total.inc(method=method, route=path, status=str(status_code))
@@ -0,0 +1,243 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+
+# every metric created in the app registers itself here, so they can all be exported from one place
+REGISTRY: list["Metric"] = []
+
+# default latency buckets in seconds, from 1ms up to 10s
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# for things that usually take microseconds (cache hits, token checks), from 10us up to 1s
+FAST_LATENCY_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+
+def _label_key(labels: dict[str, str]) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted(labels.items()))
+
+
+class Metric:
+    type: str = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def expose(self) -> Iterator[str]:
+        """
+        The metric's samples in the prometheus text format, without the HELP and TYPE lines.
+        """
+        for key, value in self.snapshot().items():
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+    def snapshot(self) -> dict:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value, optionally split by labels.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> dict[tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down. can also be backed by a callback, which is read at export time.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        callback: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, description)
+        self._values: dict[tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def snapshot(self) -> dict[tuple, float]:
+        if self._callback is not None:
+            return {(): float(self._callback())}
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram(Metric):
+    """
+    Cumulative bucketed histogram, same model as prometheus histograms.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per bucket counts (+ one for +Inf), sum, count]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self) -> dict[tuple, dict]:
+        """
+        Returns cumulative bucket counts, sum and count per label set.
+        """
+        with self._lock:
+            result = {}
+            for key, (counts, total, count) in self._values.items():
+                cumulative = []
+                running = 0
+                for bucket_count in counts:
+                    running += bucket_count
+                    cumulative.append(running)
+                result[key] = {"buckets": cumulative, "sum": total, "count": count}
+            return result
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observes how long the block took, exceptions included.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def expose(self) -> Iterator[str]:
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for key, entry in self.snapshot().items():
+            for bound, count in zip(bounds, entry["buckets"]):
+                labels = _format_labels(key + (("le", bound),))
+                yield f"{self.name}_bucket{labels} {count}"
+            yield f"{self.name}_sum{_format_labels(key)} {_format_value(entry['sum'])}"
+            yield f"{self.name}_count{_format_labels(key)} {entry['count']}"
+
+    def as_dict(self, **labels: str) -> dict:
+        """
+        One label set of the histogram as a json friendly dict, with buckets keyed by their upper bound.
+        """
+        entry = self.snapshot().get(
+            _label_key(labels),
+            {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0},
+        )
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return {
+            "buckets": dict(zip(bounds, entry["buckets"])),
+            "sum": entry["sum"],
+            "count": entry["count"],
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: tuple) -> str:
+    if not key:
+        return ""
+    return (
+        "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in key) + "}"
+    )
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render_prometheus(registry: Optional[list[Metric]] = None) -> str:
+    """
+    Every registered metric in the prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for metric in REGISTRY if registry is None else registry:
+        try:
+            samples = list(metric.expose())
+        except Exception:
+            # a callback gauge whose source isn't available (e.g. no engine yet) shouldn't break the whole scrape
+            continue
+        description = metric.description.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {metric.name} {description}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,103 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Sequence
+from uuid import UUID
+from fastapi import HTTPException, Query, Response, status
+from sqlalchemy import Select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+
+# response header carrying the cursor of the next page, absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class PageParams:
+    """
+    Dependency with the limit and cursor query parameters of a keyset paginated listing.
+    """
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = Query(
+            None, description=f"The {NEXT_CURSOR_HEADER} header of the previous page"
+        ),
+    ):
+        self.limit = limit
+        self.cursor = cursor
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def _decode_value(value: Any, python_type: type) -> Any:
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is UUID:
+        return UUID(value)
+    return python_type(value)
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Opaque cursor for the sort key of the last row of a page.
+    """
+    payload = json.dumps([_encode_value(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence[InstrumentedAttribute]) -> tuple:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(payload)
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("wrong number of values")
+        return tuple(
+            _decode_value(value, column.type.python_type)
+            for value, column in zip(values, columns)
+        )
+    except (ValueError, TypeError) as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        ) from exc
+
+
+async def paginate(
+    db: AsyncSession,
+    query: Select,
+    columns: Sequence[InstrumentedAttribute],
+    page: PageParams,
+    descending: bool = False,
+) -> tuple[list, Optional[str]]:
+    """
+    Runs one page of `query` ordered by `columns`, which must be unique together (end them with the primary key).
+    returns the rows and the cursor of the next page, None on the last one.
+
+    keyset pagination: the cursor is the sort key of the last row returned, and the next page starts right after it
+    with a row value comparison, so every page is a range scan on the index of `columns` no matter how deep it is.
+    """
+    if page.cursor is not None:
+        key = tuple_(*columns)
+        after = tuple_(*decode_cursor(page.cursor, columns))
+        query = query.where(key < after if descending else key > after)
+    order = [column.desc() if descending else column.asc() for column in columns]
+    result = await db.execute(query.order_by(*order).limit(page.limit + 1))
+    rows = list(result.scalars())
+    if len(rows) <= page.limit:
+        return rows, None
+    rows = rows[: page.limit]
+    return rows, encode_cursor([getattr(rows[-1], column.key) for column in columns])
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -0,0 +1,115 @@
+"""
+Password hashing, with argon2 running off the event loop in a bounded pool. kept apart from security so the users
+crud can hash without importing the auth code that imports it.
+"""
+
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from fastapi import HTTPException, status
+from pwdlib import PasswordHash
+from app.core.config import settings
+from app.core.metrics import Counter, Gauge, Histogram
+
+password_hash = PasswordHash.recommended()
+
+password_hash_pending = Gauge(
+    "password_hash_pending",
+    "Password hash/verify jobs waiting for or running in the pool",
+)
+password_hash_seconds = Histogram(
+    "password_hash_seconds",
+    "Time spent hashing or verifying a password, queueing included",
+)
+password_hash_rejected = Counter(
+    "password_hash_rejected", "Password jobs rejected because the pool was saturated"
+)
+
+_hash_executor: Optional[Executor] = None
+_hash_pending = 0
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return password_hash.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password: str) -> str:
+    return password_hash.hash(password)
+
+
+def get_hash_executor() -> Executor:
+    """
+    Returns the pool argon2 jobs run in, creating it on first use.
+    """
+    global _hash_executor
+    if _hash_executor is None:
+        if settings.PASSWORD_HASH_EXECUTOR == "process":
+            _hash_executor = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS
+            )
+        else:
+            # argon2-cffi releases the GIL while hashing, so threads are usually enough
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                thread_name_prefix="password-hash",
+            )
+    return _hash_executor
+
+
+def shutdown_hash_executor() -> None:
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False, cancel_futures=True)
+        _hash_executor = None
+
+
+async def _run_hash_job(operation: str, func, *args):
+    """
+    Runs a hashing function in the pool, refusing with a 503 when too many jobs are already pending.
+    """
+    global _hash_pending
+    if _hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        password_hash_rejected.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    # counted only once the pool took the job: submit raises once the pool is shut down, and nothing would release it
+    future = get_hash_executor().submit(func, *args)
+    # only ever touched from the event loop, so no lock needed around the counter. the done callback below runs on
+    # the loop too, so it can't release the job before this counted it
+    _hash_pending += 1
+    password_hash_pending.set(_hash_pending)
+    # released when the job itself is done rather than when the caller stops waiting: a cancelled request leaves
+    # its job running in the pool, and it keeps counting until then
+    future.add_done_callback(
+        lambda _: loop.call_soon_threadsafe(_hash_job_done, operation, start)
+    )
+    return await asyncio.wrap_future(future)
+
+
+def _hash_job_done(operation: str, start: float) -> None:
+    global _hash_pending
+    _hash_pending -= 1
+    password_hash_pending.set(_hash_pending)
+    password_hash_seconds.observe(time.perf_counter() - start, operation=operation)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    verify_password, run in the hashing pool so it doesn't block the event loop.
+    """
+    return await _run_hash_job(
+        "verify", verify_password, plain_password, hashed_password
+    )
+
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    get_password_hash, run in the hashing pool so it doesn't block the event loop.
+    """
+    return await _run_hash_job("hash", get_password_hash, password)
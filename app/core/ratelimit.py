@@ -0,0 +1,190 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, Optional
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.config import settings
+from app.core.metrics import Counter
+
+rate_limited_requests = Counter(
+    "rate_limited_requests_total", "Requests rejected by the per API key rate limiter"
+)
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    # seconds until the bucket is full again
+    reset: int
+    # seconds until the next request would be allowed, 0 if this one was
+    retry_after: int
+
+    def headers(self) -> dict[str, str]:
+        """
+        The RateLimit-* headers describing this result.
+        """
+        return {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset),
+        }
+
+
+# what a bucket that never refills (a rate of 0) reports as its reset and retry-after
+NEVER_REFILLS_SECONDS = 24 * 60 * 60
+
+
+def _refill_seconds(tokens: float, rate: float) -> int:
+    if rate <= 0:
+        return NEVER_REFILLS_SECONDS if tokens > 0 else 0
+    return math.ceil(tokens / rate)
+
+
+class _Shard:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        # key -> [tokens, updated_at, rate, burst]
+        self.buckets: OrderedDict[Hashable, list] = OrderedDict()
+        self.lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Token bucket per key (the API key digest), refilled at `rate` tokens a second up to `burst`.
+
+    buckets are spread over shards with their own lock, so concurrent requests for different keys rarely wait on each other,
+    and a hit is a dict lookup plus some arithmetic. each shard keeps at most maxsize / shards buckets and evicts the least
+    recently used one, an evicted bucket simply starts full again.
+    a bucket remembers the limits it was last configured with, so the check can run before we even know which project
+    the key belongs to. a key only gets a bucket of its own once configure() was called for it, i.e. once it resolved
+    to a project. until then its hits go to the caller's fallback bucket, so requests with made up keys all share one
+    bucket instead of each starting with a full one. limits are per worker process, not global.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        shards: int = 64,
+        maxsize: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self._shards = [_Shard(max(maxsize // shards, 1)) for _ in range(shards)]
+        self._clock = clock
+
+    def _shard(self, key: Hashable) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _bucket(self, shard: _Shard, key: Hashable, now: float) -> list:
+        # with the shard's lock held
+        bucket = shard.buckets.get(key)
+        if bucket is None:
+            bucket = shard.buckets[key] = [self.burst, now, self.rate, self.burst]
+            if len(shard.buckets) > shard.maxsize:
+                shard.buckets.popitem(last=False)
+        else:
+            shard.buckets.move_to_end(key)
+        return bucket
+
+    def hit(
+        self, key: Hashable, cost: float = 1.0, fallback: Optional[Hashable] = None
+    ) -> RateLimitResult:
+        """
+        Takes `cost` tokens from the key's bucket if it has them. without a `fallback`, new keys start with a full
+        bucket at the default limits. with one, a key that has no bucket yet takes its tokens from the fallback's bucket.
+        """
+        shard = self._shard(key)
+        if fallback is not None:
+            with shard.lock:
+                known = key in shard.buckets
+            if not known:
+                key = fallback
+                shard = self._shard(key)
+        now = self._clock()
+        with shard.lock:
+            bucket = self._bucket(shard, key, now)
+            tokens, updated_at, rate, burst = bucket
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            bucket[0] = tokens
+            bucket[1] = now
+        if not allowed:
+            rate_limited_requests.inc()
+        return RateLimitResult(
+            allowed=allowed,
+            limit=burst,
+            remaining=int(tokens),
+            reset=_refill_seconds(burst - tokens, rate),
+            retry_after=0 if allowed else _refill_seconds(cost - tokens, rate),
+        )
+
+    def configure(
+        self, key: Hashable, rate: Optional[float], burst: Optional[int]
+    ) -> None:
+        """
+        Sets the limits of a key's bucket, creating it (full) if the key has none. None keeps the default, a rate of 0
+        means the bucket never refills. tokens already in the bucket are kept (up to the new burst).
+        """
+        rate = self.rate if rate is None else rate
+        burst = self.burst if burst is None else burst
+        shard = self._shard(key)
+        with shard.lock:
+            bucket = self._bucket(shard, key, self._clock())
+            if bucket[2] != rate or bucket[3] != burst:
+                bucket[0] = min(bucket[0], burst)
+                bucket[2] = rate
+                bucket[3] = burst
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "keys": sum(len(shard.buckets) for shard in self._shards),
+            "shards": len(self._shards),
+            "rejected": int(rate_limited_requests.snapshot().get((), 0)),
+        }
+
+
+rate_limiter = RateLimiter(
+    rate=settings.RATE_LIMIT_PER_SECOND,
+    burst=settings.RATE_LIMIT_BURST,
+    shards=settings.RATE_LIMIT_SHARDS,
+    maxsize=settings.RATE_LIMIT_MAX_KEYS,
+)
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Adds the RateLimit-* headers of the request's rate limit check to its response.
+
+    the check runs in a dependency, which can't put headers on responses the routes build themselves (raw and streaming
+    ones), so it leaves its result in the request state and the headers are added here, 429s included.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # created up front, copies of the scope made further down share this dict
+        state = scope.setdefault("state", {})
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                result = state.get("rate_limit")
+                if result is not None:
+                    headers = list(message.get("headers", []))
+                    for name, value in result.headers().items():
+                        headers.append((name.lower().encode(), value.encode()))
+                    message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
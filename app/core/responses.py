@@ -0,0 +1,56 @@
+from typing import Any, Generic, Mapping, Optional, TypeVar
+from fastapi.responses import JSONResponse, Response
+from pydantic import TypeAdapter
+
+# optional, responses fall back to the stdlib json encoder when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+T = TypeVar("T")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse encoding with orjson when it is available, the default response class of the app.
+    same output as JSONResponse (compact, utf-8, no ascii escaping), in a fraction of the time.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class Serializer(Generic[T]):
+    """
+    Prebuilt TypeAdapter for a response schema, turning ORM objects into json bytes in one go.
+
+    returning an ORM object from a route with a response_model makes FastAPI validate it into the model, dump the
+    model into a dict, and encode the dict as json. response() validates from attributes and dumps straight to bytes
+    in pydantic's core instead, and returns a ready Response, which FastAPI passes through untouched. the route keeps
+    its response_model for the docs. as the Response is returned as is, headers have to be set on it, not on an
+    injected Response.
+    """
+
+    def __init__(self, type_: type[T]):
+        self.adapter = TypeAdapter(type_)
+
+    def dump(self, value: Any) -> bytes:
+        return self.adapter.dump_json(
+            self.adapter.validate_python(value, from_attributes=True)
+        )
+
+    def response(
+        self,
+        value: Any,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> Response:
+        return Response(
+            content=self.dump(value),
+            status_code=status_code,
+            headers=headers,
+            media_type="application/json",
+        )
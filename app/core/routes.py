@@ -0,0 +1,95 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from app.core.dependencies import require_internal_token
+from app.core.database import pool_checkout_wait_seconds, pool_status, replica_status
+from app.core.metrics import render_prometheus
+from app.core.ratelimit import rate_limiter
+from app.core.security import token_cache
+from app.core.singleflight import singleflight_stats
+from app.payments.plans import plan_cache
+from app.payments.routing import provider_router
+from app.payments.webhooks import webhook_pipeline
+from app.projects.cache import project_cache
+from app.projects.index import api_key_index
+from app.users.cache import user_cache
+
+
+# only for operators and the prometheus scraper, see INTERNAL_API_TOKEN
+router = APIRouter(
+    prefix="/internal",
+    tags=["internal"],
+    dependencies=[Depends(require_internal_token)],
+)
+# served at the root, where prometheus looks by default
+metrics_router = APIRouter(
+    tags=["internal"], dependencies=[Depends(require_internal_token)]
+)
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """
+    Every metric of this worker in the prometheus text format.
+    """
+    return PlainTextResponse(
+        render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@router.get("/stats/cache")
+async def read_cache_stats():
+    """
+    Hit/miss/eviction counters of the in-process caches, for scraping.
+    """
+    return {
+        "project_cache": project_cache.stats(),
+        "api_key_index": api_key_index.stats(),
+        "token_cache": token_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "plan_cache": plan_cache.stats(),
+    }
+
+
+@router.get("/stats/singleflight")
+async def read_singleflight_stats():
+    """
+    How many crud reads ran their own query, and how many were collapsed into a concurrent identical one.
+    """
+    return singleflight_stats()
+
+
+@router.get("/stats/pool")
+async def read_pool_stats():
+    """
+    Connection pool occupancy of this worker, plus how long checkouts had to wait for a connection,
+    and whether reads currently go to the replica.
+    """
+    return {
+        **pool_status(),
+        "checkout_wait_seconds": pool_checkout_wait_seconds.as_dict(),
+        "replica": replica_status(),
+    }
+
+
+@router.get("/stats/providers")
+async def read_provider_stats():
+    """
+    Live health and breaker state of every provider, per project.
+    """
+    return provider_router.stats()
+
+
+@router.get("/stats/ratelimit")
+async def read_rate_limit_stats():
+    """
+    Rate limiter buckets in use in this worker and how many requests it rejected.
+    """
+    return rate_limiter.stats()
+
+
+@router.get("/stats/webhooks")
+async def read_webhook_stats():
+    """
+    Webhook events waiting in this worker's queues, and counts of what happened to the ones received so far.
+    """
+    return webhook_pipeline.stats()
@@ -1,27 +1,32 @@
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2
 from jose import JWTError, jwt
-from pwdlib import PasswordHash
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
+from app.core.cache import TTLCache, MISSING
+from app.core.metrics import FAST_LATENCY_BUCKETS, Histogram
+from app.core.passwords import verify_password_async
 from app.users import crud, schema
-from app.core.dependencies import get_db
+from app.core.database import read_or_primary
+from app.core.sessions import get_read_db
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel, OAuthFlowPassword
 
-password_hash = PasswordHash.recommended()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
+# token -> payload of JWTs whose signature has already been verified. each entry expires together with its token,
+# so a cached token can never outlive its exp.
+token_cache = TTLCache(maxsize=settings.TOKEN_CACHE_MAXSIZE, ttl=0)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return password_hash.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password: str) -> str:
-    return password_hash.hash(password)
+jwt_decode_seconds = Histogram(
+    "jwt_decode_seconds",
+    "Time spent verifying a JWT, by whether it was already verified before",
+    buckets=FAST_LATENCY_BUCKETS,
+)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -37,17 +42,43 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+def decode_token(token: str) -> dict:
+    """
+    Verifies a JWT and returns its payload, skipping the signature check for tokens we have already verified.
+    Raises JWTError for invalid or expired tokens, same as jwt.decode.
+    """
+    start = time.perf_counter()
+    payload = token_cache.get(token)
+    cached = payload is not MISSING
+    try:
+        if not cached:
+            payload = jwt.decode(
+                token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
+            )
+            exp = payload.get("exp")
+            if exp is not None:
+                token_cache.set(token, payload, ttl=exp - time.time())
+        return payload
+    finally:
+        jwt_decode_seconds.observe(
+            time.perf_counter() - start, cached="true" if cached else "false"
+        )
+
+
 async def authenticate_user(db: AsyncSession, username: str, password: str):
-    user = await crud.get_user_by_username(db, username=username)
+    # login right after signing up must not fail because the replica hasn't caught up yet
+    user = await read_or_primary(
+        db, lambda: crud.get_user_by_username(db, username=username)
+    )
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return None
     return user
 
 
 async def get_current_active_user(
-    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,16 +86,14 @@ async def get_current_active_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = schema.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = await crud.get_user_by_username(db, username=token_data.username)
+    user = await crud.get_user_by_username_cached(db, username=token_data.username)
     if user is None:
         raise credentials_exception
     if not user.is_active:
@@ -113,9 +142,7 @@ async def get_user_from_token(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
+        payload = decode_token(token)
         username: str = payload.get("sub")
         payload_type: str = payload.get("type")
         if username is None or payload_type != token_type:
@@ -124,7 +151,7 @@ async def get_user_from_token(
     except JWTError:
         raise credentials_exception
 
-    user = await crud.get_user_by_username(db, username=token_data.username)
+    user = await crud.get_user_by_username_cached(db, username=token_data.username)
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,81 @@
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Coroutine
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from app.core.database import AsyncSessionLocal, ReadSessionLocal
+from app.core.metrics import Histogram
+
+# waiting for a connection is db_pool_checkout_wait_seconds, this is how long requests keep their session
+db_session_seconds = Histogram(
+    "db_session_seconds", "Time from opening a request's session to releasing it"
+)
+
+
+async def release_session(db: AsyncSession) -> None:
+    """
+    Closes a request session, which gives its connection (if it ever got one) back to the pool. safe to call twice.
+    """
+    opened_at = db.info.pop("opened_at", None)
+    await db.close()
+    if opened_at is not None:
+        db_session_seconds.observe(time.perf_counter() - opened_at)
+
+
+@asynccontextmanager
+async def _request_session(
+    request: Request, session_factory: sessionmaker
+) -> AsyncIterator[AsyncSession]:
+    # a session doesn't check out a connection until its first statement, so requests answered from caches or
+    # rejected early never touch the pool
+    db = session_factory()
+    db.info["opened_at"] = time.perf_counter()
+    if not hasattr(request.state, "db_sessions"):
+        request.state.db_sessions = []
+    request.state.db_sessions.append(db)
+    try:
+        yield db
+    finally:
+        await release_session(db)
+
+
+async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency that provides a database session for a single request.
+    """
+    async with _request_session(request, AsyncSessionLocal) as db:
+        yield db
+
+
+async def get_read_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency that provides a session for requests that only read. it runs in autocommit mode, so no transaction is
+    ever opened, and it must not be used to write. its reads go to the read replica when one is configured and
+    healthy, see RoutingSession.
+    """
+    async with _request_session(request, ReadSessionLocal) as db:
+        yield db
+
+
+class ReleaseSessionRoute(APIRoute):
+    """
+    Route class releasing the request's sessions as soon as the handler returned (response built, not yet sent).
+
+    the teardown of get_db and get_read_db only runs after the whole response has gone out, so without this a
+    connection would stay checked out while a slow client reads the response. routers that use the session
+    dependencies should be created with route_class=ReleaseSessionRoute.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def handle_and_release(request: Request) -> Response:
+            try:
+                return await handler(request)
+            finally:
+                for db in getattr(request.state, "db_sessions", ()):
+                    await release_session(db)
+
+        return handle_and_release
@@ -0,0 +1,126 @@
+import asyncio
+import functools
+import inspect
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+from sqlalchemy import inspect as inspect_instance
+from sqlalchemy.orm import InstanceState, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from app.core.metrics import Counter
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+singleflight_calls = Counter(
+    "singleflight_calls_total",
+    "Coalesced crud reads, per function, by whether the call ran the query (leader) or waited for one (collapsed)",
+)
+
+# key -> future of the query in flight for it, shared by every decorated function
+_in_flight: dict[Hashable, asyncio.Future] = {}
+
+
+def _detached(value: Any) -> Any:
+    """
+    Copies of the ORM instances in a query result (one instance or a list of them), attached to no session.
+    only loaded columns are copied, relationships can't lazy load on a detached instance.
+    """
+    if isinstance(value, list):
+        return [_detached(item) for item in value]
+    state = inspect_instance(value, raiseerr=False)
+    if not isinstance(state, InstanceState):
+        return value
+    copy = state.mapper.class_manager.new_instance()
+    for column in state.mapper.column_attrs:
+        if column.key in state.dict:
+            set_committed_value(copy, column.key, state.dict[column.key])
+    make_transient_to_detached(copy)
+    return copy
+
+
+def singleflight(func: F) -> F:
+    """
+    Decorator for crud reads taking the session as an argument named db. concurrent calls with the same other
+    arguments share a single query: the first one runs it, the rest wait for its result or error. the session itself
+    isn't part of the key, only the database it reads from, so a cold cache hit by a burst of requests costs one query.
+
+    the first caller gets the instances its own session loaded, the others detached copies of them, taken before the
+    first caller could change them. a copy can be added to the caller's session like any detached instance.
+    sessions with unflushed changes never share, they may need to see them. neither do sessions that wrote or read
+    from the primary on purpose: they must see every commit made before the call, which a query already in flight
+    for someone else may not.
+    """
+    name = func.__qualname__
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs).arguments
+        db = arguments.pop("db")
+        if (
+            db.new
+            or db.dirty
+            or db.deleted
+            or db.info.get("primary")
+            or db.info.get("wrote")
+        ):
+            return await func(*args, **kwargs)
+        try:
+            # bound arguments, so get(db, x) and get(db=db, x=x) share too. only calls reading from the same database
+            # share a query
+            key = (func, db.bind, tuple(arguments.items()))
+            hash(key)
+        except TypeError:
+            # unhashable arguments, nothing to coalesce on
+            return await func(*args, **kwargs)
+
+        while True:
+            future = _in_flight.get(key)
+            if future is None:
+                break
+            try:
+                value, used_replica = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # we were cancelled ourselves
+                    raise
+                # the leader was cancelled (its client went away) before the query finished, try again
+                continue
+            singleflight_calls.inc(function=name, role="collapsed")
+            if used_replica:
+                # lets read_or_primary retry a replica miss on the primary for this caller too
+                db.info["used_replica"] = True
+            # every caller gets its own copy, so adding it to a session doesn't take it away from the others
+            return _detached(value)
+
+        future = asyncio.get_running_loop().create_future()
+        _in_flight[key] = future
+        singleflight_calls.inc(function=name, role="leader")
+        try:
+            value = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # nobody may be waiting, don't let asyncio log it as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result((_detached(value), bool(db.info.get("used_replica"))))
+            return value
+        finally:
+            if _in_flight.get(key) is future:
+                del _in_flight[key]
+
+    return wrapper
+
+
+def singleflight_stats() -> dict[str, dict[str, int]]:
+    """
+    Calls per decorated function, how many ran their query and how many were collapsed into another call's.
+    """
+    stats: dict[str, dict[str, int]] = {}
+    for labels, count in singleflight_calls.snapshot().items():
+        labels = dict(labels)
+        function = stats.setdefault(labels["function"], {"leader": 0, "collapsed": 0})
+        function[labels["role"]] = int(count)
+    return stats
@@ -1,8 +1,54 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from .users.routes import router as users_router
+from .core.routes import metrics_router, router as internal_router
+from .payments.routes import router as payments_router
+from .projects.routes import router as projects_router
+from .core.config import settings
+from .core.database import engine, replica_engine, replica_monitor, warm_pool
+from .core.instrumentation import RequestMetricsMiddleware
+from .core.ratelimit import RateLimitHeadersMiddleware
+from .core.responses import FastJSONResponse
+from .core.passwords import shutdown_hash_executor
+from .providers.clients import provider_clients
+from .payments.failover import drain_background_tasks
+from .payments.idempotency import cleanup_expired_keys
+from .payments.ledger import ledger_writer
+from .payments.webhooks import webhook_pipeline
+from .projects.index import api_key_index
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup = settings.DB_POOL_WARMUP_CONNECTIONS
+    await warm_pool(settings.DB_POOL_SIZE if warmup is None else warmup)
+    replica_monitor.start()
+    api_key_index.start()
+    provider_clients.start()
+    ledger_writer.start()
+    webhook_pipeline.start()
+    cleanup = asyncio.create_task(cleanup_expired_keys())
+    yield
+    cleanup.cancel()
+    await api_key_index.stop()
+    await webhook_pipeline.stop()
+    # write out buffered ledger records before the engine goes away
+    await ledger_writer.stop()
+    # hedge losers still being voided need the provider clients
+    await drain_background_tasks(settings.CHARGE_MAX_TIMEOUT_MS / 1000)
+    await provider_clients.aclose()
+    shutdown_hash_executor()
+    await replica_monitor.stop()
+    await engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+app.add_middleware(RateLimitHeadersMiddleware)
+# added last so it is the outermost, and times everything the other middlewares do too
+app.add_middleware(RequestMetricsMiddleware)
 
 
 @app.get("/")
@@ -11,3 +57,7 @@ async def read_root():
 
 
 app.include_router(users_router)
+app.include_router(internal_router)
+app.include_router(metrics_router)
+app.include_router(payments_router)
+app.include_router(projects_router, prefix="/projects")
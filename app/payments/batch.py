@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import AsyncIterator
+from app.core.config import settings
+from app.core.deadlines import Deadline
+from . import schema
+from .failover import ChargeFailed, ProviderLimits, charge_with_failover
+from .ledger import ledger_writer
+from .plans import RoutingPlan
+
+logger = logging.getLogger(__name__)
+
+
+async def _charge_one(
+    index: int,
+    plan: RoutingPlan,
+    charge: schema.ChargeRequest,
+    timeout: float,
+    limits: ProviderLimits,
+) -> schema.BatchChargeResult:
+    # every charge gets the full time budget, counted from when it starts, not from when the batch arrived
+    try:
+        result = await charge_with_failover(plan, charge, Deadline(timeout), limits)
+    except ChargeFailed as exc:
+        await ledger_writer.record_charge(
+            plan.project_id, exc.reference, charge, exc.attempts
+        )
+        return schema.BatchChargeResult(
+            index=index,
+            succeeded=False,
+            error={
+                "message": "All payment providers failed",
+                "reference": exc.reference,
+                "deadline_exceeded": exc.deadline_exceeded,
+                "attempts": [attempt.model_dump() for attempt in exc.attempts],
+            },
+        )
+    except Exception:
+        # one broken charge must not stall the whole stream
+        logger.exception("Batch charge %d failed unexpectedly", index)
+        return schema.BatchChargeResult(
+            index=index, succeeded=False, error={"message": "Internal error"}
+        )
+    await ledger_writer.record_charge(
+        plan.project_id, result.reference, charge, result.attempts, result
+    )
+    return schema.BatchChargeResult(index=index, succeeded=True, charge=result)
+
+
+async def run_batch(
+    plan: RoutingPlan, charges: list[schema.ChargeRequest], timeout: float
+) -> AsyncIterator[str]:
+    """
+    Runs the charges of a batch with at most BATCH_MAX_CONCURRENCY in flight (and BATCH_PROVIDER_CONCURRENCY
+    per provider), yielding one ndjson line per charge in the order they finish.
+    if the consumer goes away (client disconnected), every charge still running is cancelled.
+    """
+    limits = ProviderLimits(settings.BATCH_PROVIDER_CONCURRENCY)
+    results: asyncio.Queue[schema.BatchChargeResult] = asyncio.Queue()
+    items = iter(enumerate(charges))
+
+    async def worker() -> None:
+        # plain iterator shared by the workers, which is safe as there is no await between next() calls
+        for index, charge in items:
+            await results.put(await _charge_one(index, plan, charge, timeout, limits))
+
+    workers = [
+        asyncio.create_task(worker())
+        for _ in range(min(settings.BATCH_MAX_CONCURRENCY, len(charges)))
+    ]
+    try:
+        for _ in range(len(charges)):
+            result = await results.get()
+            yield result.model_dump_json() + "\n"
+    finally:
+        for task in workers:
+            task.cancel()
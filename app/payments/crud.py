@@ -0,0 +1,242 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import UUID as SQLUUID, DateTime, String, column, delete, or_
+from sqlalchemy import select, tuple_, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncScalarResult, AsyncSession
+from app.core.config import settings
+from app.core.pagination import PageParams, paginate
+from . import models
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+
+async def claim_idempotency_key(
+    db: AsyncSession,
+    project_id: UUID,
+    key: str,
+    request_hash: str,
+    expires_at: datetime,
+) -> bool:
+    """
+    Inserts an in progress row for the key. returns False if the key already exists, in which case someone else owns it.
+    a single INSERT .. ON CONFLICT, the unique index decides the race.
+
+    a row of the same request still in progress after IDEMPOTENCY_LEASE_SECONDS is taken over: its worker died before
+    completing or releasing it. created_at is reset, so the new owner gets a full lease of its own.
+    """
+    now = datetime.now()
+    statement = insert(models.IdempotencyKey).values(
+        project_id=project_id,
+        key=key,
+        request_hash=request_hash,
+        status=IN_PROGRESS,
+        created_at=now,
+        expires_at=expires_at,
+    )
+    result = await db.execute(
+        statement.on_conflict_do_update(
+            constraint="uq_idempotency_keys_project_key",
+            set_={
+                "created_at": statement.excluded.created_at,
+                "expires_at": statement.excluded.expires_at,
+            },
+            where=(models.IdempotencyKey.status == IN_PROGRESS)
+            & (models.IdempotencyKey.request_hash == statement.excluded.request_hash)
+            & (
+                models.IdempotencyKey.created_at
+                < now - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+            ),
+        ).returning(models.IdempotencyKey.id)
+    )
+    claimed = result.scalar_one_or_none() is not None
+    await db.commit()
+    return claimed
+
+
+async def get_idempotency_key(
+    db: AsyncSession, project_id: UUID, key: str
+) -> models.IdempotencyKey | None:
+    result = await db.execute(
+        select(models.IdempotencyKey).filter_by(project_id=project_id, key=key)
+    )
+    return result.scalars().first()
+
+
+async def complete_idempotency_key(
+    db: AsyncSession,
+    project_id: UUID,
+    key: str,
+    response_status: int,
+    response_body: str,
+) -> None:
+    """
+    Stores the final response of a key, so later requests with it are answered without running the charge again.
+    """
+    await db.execute(
+        update(models.IdempotencyKey)
+        .filter_by(project_id=project_id, key=key)
+        .values(
+            status=COMPLETED,
+            response_status=response_status,
+            response_body=response_body,
+        )
+    )
+    await db.commit()
+
+
+async def release_idempotency_key(db: AsyncSession, project_id: UUID, key: str) -> None:
+    """
+    Deletes the row of a key whose request didn't produce a response worth replaying, so the client can retry it.
+    """
+    await db.execute(
+        delete(models.IdempotencyKey).filter_by(project_id=project_id, key=key)
+    )
+    await db.commit()
+
+
+async def delete_expired_idempotency_keys(db: AsyncSession, limit: int) -> int:
+    """
+    Deletes up to `limit` expired keys, returns how many were deleted.
+    """
+    expired = (
+        select(models.IdempotencyKey.id)
+        .filter(models.IdempotencyKey.expires_at < datetime.now())
+        .limit(limit)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        delete(models.IdempotencyKey).filter(models.IdempotencyKey.id.in_(expired))
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def record_webhook_events(
+    db: AsyncSession, events: list[dict]
+) -> set[tuple[str, str]]:
+    """
+    Inserts received webhook events, skipping ones already stored. returns the (provider_name, event_id) of the new ones.
+    doesn't commit, so recording and applying the events can happen in one transaction.
+    """
+    result = await db.execute(
+        insert(models.WebhookEvent)
+        .values(events)
+        .on_conflict_do_nothing(constraint="uq_webhook_events_provider_event")
+        .returning(models.WebhookEvent.provider_name, models.WebhookEvent.event_id)
+    )
+    return set(result.tuples().all())
+
+
+async def forget_webhook_events(db: AsyncSession, keys: list[tuple[str, str]]) -> None:
+    """
+    Deletes recorded webhook events by (provider_name, event_id), so a redelivery of them is processed again.
+    doesn't commit.
+    """
+    event = models.WebhookEvent
+    await db.execute(
+        delete(event).where(tuple_(event.provider_name, event.event_id).in_(keys))
+    )
+
+
+async def apply_transaction_statuses(
+    db: AsyncSession, updates: list[tuple[UUID, str, str, str, datetime]]
+) -> set[tuple[UUID, str, str]]:
+    """
+    Sets the status of many transactions in one UPDATE .. FROM (VALUES ..). each update is
+    (project_id, provider_name, provider_payment_id, status, occurred_at), and is skipped if the transaction already
+    has a status from a later event. returns (project_id, provider_name, provider_payment_id) of the transactions updated.
+    doesn't commit.
+    """
+    rows = values(
+        column("project_id", SQLUUID(as_uuid=True)),
+        column("provider_name", String),
+        column("provider_payment_id", String),
+        column("status", String),
+        column("occurred_at", DateTime),
+        name="webhook_updates",
+    ).data(updates)
+    transaction = models.Transaction
+    result = await db.execute(
+        update(transaction)
+        .where(
+            transaction.project_id == rows.c.project_id,
+            transaction.provider_name == rows.c.provider_name,
+            transaction.provider_payment_id == rows.c.provider_payment_id,
+            or_(
+                transaction.status_updated_at.is_(None),
+                transaction.status_updated_at <= rows.c.occurred_at,
+            ),
+        )
+        .values(
+            status=rows.c.status,
+            status_updated_at=rows.c.occurred_at,
+            updated_at=datetime.now(),
+        )
+        .returning(
+            transaction.project_id,
+            transaction.provider_name,
+            transaction.provider_payment_id,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return set(result.tuples().all())
+
+
+async def list_transactions(
+    db: AsyncSession, project_id: UUID, page: PageParams
+) -> tuple[list[models.Transaction], Optional[str]]:
+    """
+    One page of the project's transactions, newest first. uses ix_transactions_project_created.
+    """
+    transaction = models.Transaction
+    return await paginate(
+        db,
+        select(transaction).filter_by(project_id=project_id),
+        (transaction.created_at, transaction.id),
+        page,
+        descending=True,
+    )
+
+
+async def list_payment_attempts(
+    db: AsyncSession,
+    project_id: UUID,
+    page: PageParams,
+    transaction_id: Optional[UUID] = None,
+) -> tuple[list[models.PaymentAttempt], Optional[str]]:
+    """
+    One page of the project's provider attempts, newest first, optionally only the ones of a single transaction.
+    """
+    attempt = models.PaymentAttempt
+    query = select(attempt).filter_by(project_id=project_id)
+    if transaction_id is not None:
+        query = query.filter_by(transaction_id=transaction_id)
+    return await paginate(
+        db, query, (attempt.created_at, attempt.id), page, descending=True
+    )
+
+
+async def stream_transactions(
+    db: AsyncSession,
+    project_id: UUID,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+) -> AsyncScalarResult[models.Transaction]:
+    """
+    All of the project's transactions created in [created_from, created_to), oldest first, read through a server side
+    cursor EXPORT_BATCH_SIZE rows at a time. iterate it with partitions(), the session must stay in its transaction
+    until the result is exhausted.
+    """
+    transaction = models.Transaction
+    query = select(transaction).filter_by(project_id=project_id)
+    if created_from is not None:
+        query = query.where(transaction.created_at >= created_from)
+    if created_to is not None:
+        query = query.where(transaction.created_at < created_to)
+    return await db.stream_scalars(
+        query.order_by(transaction.created_at, transaction.id),
+        execution_options={"yield_per": settings.EXPORT_BATCH_SIZE},
+    )
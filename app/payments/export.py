@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import threading
+import weakref
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from uuid import UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, engine, replica_engine, replica_monitor
+from . import crud, models
+
+EXPORT_COLUMNS = (
+    "id",
+    "amount",
+    "currency",
+    "status",
+    "provider_name",
+    "provider_payment_id",
+    "created_at",
+    "updated_at",
+)
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# exports running in this worker, see EXPORT_MAX_CONCURRENT. only ever acquired without blocking
+_slots = threading.BoundedSemaphore(settings.EXPORT_MAX_CONCURRENT)
+
+
+class _Slot:
+    def __init__(self):
+        self._held = True
+
+    def release(self) -> None:
+        # called by the export when it ends, and again when it gets garbage collected
+        if self._held:
+            self._held = False
+            _slots.release()
+
+
+def _naive(value: Optional[datetime]) -> Optional[datetime]:
+    # created_at is stored as naive local time, comparing it to an aware datetime fails in the middle of the response
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def _export_session() -> AsyncSession:
+    # exports are the heaviest reads we have, so they go to the replica whenever it is usable. not through the
+    # autocommit read engines: server side cursors only live inside a transaction
+    bind = replica_engine if replica_monitor.usable else engine
+    return AsyncSessionLocal(bind=bind)
+
+
+def _values(transaction: models.Transaction) -> list:
+    values = []
+    for name in EXPORT_COLUMNS:
+        value = getattr(transaction, name)
+        if isinstance(value, UUID):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        values.append(value)
+    return values
+
+
+def _ndjson(transactions: list[models.Transaction]) -> str:
+    return "".join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, _values(transaction)))) + "\n"
+        for transaction in transactions
+    )
+
+
+def _csv(transactions: list[models.Transaction], header: bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(_values(transaction) for transaction in transactions)
+    return buffer.getvalue()
+
+
+def open_export(
+    project_id: UUID,
+    format: str,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+) -> Optional[AsyncIterator[str]]:
+    """
+    Reserves one of the worker's EXPORT_MAX_CONCURRENT export slots and returns the export, to be sent as the
+    response body. None if every slot is taken. the slot is held until the export ends, or until it is garbage
+    collected if the response never got to start it.
+    """
+    if not _slots.acquire(blocking=False):
+        return None
+    slot = _Slot()
+    export = export_transactions(
+        project_id, format, _naive(created_from), _naive(created_to), slot
+    )
+    weakref.finalize(export, slot.release)
+    return export
+
+
+async def export_transactions(
+    project_id: UUID,
+    format: str,
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+    slot: _Slot,
+) -> AsyncIterator[str]:
+    """
+    Streams the project's transactions as ndjson or csv, one chunk per EXPORT_BATCH_SIZE rows. memory use doesn't
+    depend on how many rows there are: rows come off a server side cursor a batch at a time, and the rows of a batch
+    are dropped once it has been sent (the identity map only holds them weakly).
+
+    the export opens its own session rather than using the request's one, which is released before the response
+    body is sent, and holds its connection until the last row went out.
+    """
+    try:
+        async with _export_session() as db:
+            result = await crud.stream_transactions(
+                db, project_id, created_from, created_to
+            )
+            first = True
+            async for transactions in result.partitions():
+                if format == "csv":
+                    yield _csv(transactions, header=first)
+                else:
+                    yield _ndjson(transactions)
+                first = False
+            if first and format == "csv":
+                # no rows, still a valid csv
+                yield _csv([], header=True)
+    finally:
+        slot.release()
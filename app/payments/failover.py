@@ -0,0 +1,361 @@
+import asyncio
+import logging
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from typing import Optional
+from uuid import uuid4
+from app.core.config import settings
+from app.core.deadlines import Deadline
+from app.providers.adapters import ProviderError, get_provider
+from app.providers.clients import provider_clients
+from . import schema
+from .plans import ProviderEntry, RoutingPlan
+from .routing import HALF_OPEN, Admission, ProviderHealth, provider_router
+
+logger = logging.getLogger(__name__)
+
+# attempts that lost a hedge but were still running, and captures or voids that outlived their deadline. we keep
+# references so they aren't garbage collected
+_background_tasks: set[asyncio.Task] = set()
+
+
+class ChargeFailed(Exception):
+    """
+    Raised when no provider could handle a charge. carries every attempt that was made.
+    """
+
+    def __init__(
+        self,
+        reference: str,
+        attempts: list[schema.ChargeAttempt],
+        deadline_exceeded: bool = False,
+    ):
+        super().__init__("All providers failed")
+        self.reference = reference
+        self.attempts = attempts
+        self.deadline_exceeded = deadline_exceeded
+
+
+class ProviderLimits:
+    """
+    Caps how many calls to each provider can be in flight at once, e.g. across the charges of one batch.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def slot(self, provider_name: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(provider_name)
+        if semaphore is None:
+            semaphore = self._semaphores[provider_name] = asyncio.Semaphore(
+                self.concurrency
+            )
+        return semaphore
+
+
+@dataclass
+class _Outcome:
+    entry: ProviderEntry
+    attempt: schema.ChargeAttempt
+    result: Optional[schema.ProviderCharge] = None
+    retryable: bool = True
+    deadline_exceeded: bool = False
+
+
+def hedge_delay(health: ProviderHealth) -> float:
+    """
+    Seconds to wait on a provider before hedging to the next one.
+    """
+    if health.sample_count < settings.ROUTER_MIN_SAMPLES:
+        delay_ms = settings.CHARGE_HEDGE_DEFAULT_DELAY_MS
+    else:
+        delay_ms = health.latency_percentile(settings.CHARGE_HEDGE_PERCENTILE)
+    return max(delay_ms, settings.CHARGE_HEDGE_MIN_DELAY_MS) / 1000
+
+
+async def _attempt(
+    entry: ProviderEntry,
+    health: ProviderHealth,
+    admission: Admission,
+    charge: schema.ChargeRequest,
+    reference: str,
+    capture: bool,
+    deadline: Deadline,
+    limits: Optional[ProviderLimits],
+) -> _Outcome:
+    start = time.perf_counter()
+    try:
+        provider = get_provider(entry.provider_name)
+        # the attempt only gets what is left of the charge's budget, waiting for a slot included
+        async with asyncio.timeout(deadline.remaining()):
+            async with limits.slot(entry.provider_name) if limits else nullcontext():
+                start = time.perf_counter()
+                result = await provider.charge(
+                    provider_clients.get(entry.provider_name),
+                    entry.credentials,
+                    charge,
+                    reference,
+                    capture=capture,
+                )
+    except TimeoutError:
+        # our budget ran out, which says nothing about the provider's health
+        health.abandon(admission)
+        attempt = schema.ChargeAttempt(
+            provider_name=entry.provider_name,
+            succeeded=False,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            error=f"{entry.provider_name}: deadline exceeded",
+        )
+        return _Outcome(entry, attempt, retryable=False, deadline_exceeded=True)
+    except ProviderError as exc:
+        latency_ms = (time.perf_counter() - start) * 1000
+        # a rejected charge (4xx) still means the provider itself is up
+        health.record(latency_ms, ok=not exc.retryable, admission=admission)
+        attempt = schema.ChargeAttempt(
+            provider_name=entry.provider_name,
+            succeeded=False,
+            latency_ms=latency_ms,
+            error=str(exc),
+        )
+        return _Outcome(entry, attempt, retryable=exc.retryable)
+    except BaseException:
+        health.abandon(admission)
+        raise
+    latency_ms = (time.perf_counter() - start) * 1000
+    health.record(latency_ms, ok=True, admission=admission)
+    attempt = schema.ChargeAttempt(
+        provider_name=entry.provider_name, succeeded=True, latency_ms=latency_ms
+    )
+    return _Outcome(entry, attempt, result=result)
+
+
+async def _within(deadline: Deadline, awaitable) -> bool:
+    """
+    Runs a follow-up call to a provider (a capture or a void) for at most what is left of `deadline`, and tells
+    whether it finished. one still running then is left to finish in the background: cutting off a call the provider
+    may already have received would leave us not knowing what it did.
+    """
+    task = asyncio.ensure_future(awaitable)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    await asyncio.wait({task}, timeout=deadline.remaining())
+    return task.done()
+
+
+async def _captured(outcome: _Outcome) -> _Outcome:
+    """
+    The outcome with its authorization captured. if the capture fails it keeps the authorization, and the error.
+    """
+    entry = outcome.entry
+    try:
+        result = await get_provider(entry.provider_name).capture(
+            provider_clients.get(entry.provider_name),
+            entry.credentials,
+            outcome.result,
+        )
+    except ProviderError as exc:
+        return replace(
+            outcome,
+            retryable=False,
+            attempt=outcome.attempt.model_copy(
+                update={"succeeded": False, "error": f"capture failed: {exc}"}
+            ),
+        )
+    return replace(outcome, result=result)
+
+
+async def _capture(outcome: _Outcome, deadline: Deadline) -> _Outcome:
+    """
+    Captures the authorization of the attempt that won a hedge. if that fails the authorization is voided and the
+    attempt counts as failed. no other provider is tried after that, we can't tell whether the capture went through.
+    a capture still running when the deadline passes is voided once it finishes, refunded if it went through.
+    """
+    task = asyncio.create_task(_captured(outcome))
+    try:
+        finished = await _within(deadline, task)
+    except asyncio.CancelledError:
+        _detach(task)
+        raise
+    if not finished:
+        _detach(task)
+        return replace(
+            outcome,
+            result=None,
+            retryable=False,
+            deadline_exceeded=True,
+            attempt=outcome.attempt.model_copy(
+                update={
+                    "succeeded": False,
+                    "error": f"{outcome.entry.provider_name}: deadline exceeded while capturing",
+                }
+            ),
+        )
+    captured = task.result()
+    if captured.attempt.succeeded:
+        return captured
+    await _within(deadline, _void(captured))
+    return replace(captured, result=None)
+
+
+async def _void(outcome: _Outcome) -> None:
+    entry = outcome.entry
+    try:
+        await get_provider(entry.provider_name).void(
+            provider_clients.get(entry.provider_name),
+            entry.credentials,
+            outcome.result,
+        )
+    except Exception:
+        # the money is held (or taken) at the provider with nothing on our side pointing to it, so every failure
+        # gets logged for reconciliation
+        logger.exception(
+            "Could not void unused %s charge %s",
+            entry.provider_name,
+            outcome.result.provider_payment_id,
+        )
+
+
+async def _settle(task: asyncio.Task) -> None:
+    """
+    Waits for an attempt nobody is waiting on anymore, and voids it if it went through.
+    """
+    try:
+        outcome = await task
+    except Exception:
+        return
+    if outcome.result is not None:
+        await _void(outcome)
+
+
+def _detach(task: asyncio.Task) -> None:
+    background = asyncio.create_task(_settle(task))
+    _background_tasks.add(background)
+    background.add_done_callback(_background_tasks.discard)
+
+
+async def drain_background_tasks(timeout: float) -> None:
+    """
+    Waits for the detached attempts to finish and be voided, so none is cut off when the provider clients close.
+    whatever is still running after `timeout` seconds is cancelled.
+    """
+    if not _background_tasks:
+        return
+    _, pending = await asyncio.wait(set(_background_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(
+            "Cancelled %d detached charge attempts still running at shutdown",
+            len(pending),
+        )
+
+
+async def charge_with_failover(
+    plan: RoutingPlan,
+    charge: schema.ChargeRequest,
+    deadline: Deadline,
+    limits: Optional[ProviderLimits] = None,
+) -> schema.ChargeResponse:
+    """
+    Tries the project's providers one after another until one of them accepts the charge.
+    the plan gives the static order, the provider router adjusts it so providers with a tripped breaker are skipped.
+
+    With hedging on, a provider that is slower than its usual latency gets the next provider started next to it.
+    hedged attempts only authorize the payment: whichever succeeds first is captured, any other authorization is
+    voided, so the customer is charged once.
+
+    Every attempt, and the capture or void that follows it, is bounded by what is left of `deadline`, and no new
+    provider is tried once it has passed.
+    if the charge itself gets cancelled (client disconnected), the attempts still in flight are left to finish in the
+    background, cancelling a call the provider may already have received would leave us not knowing whether the
+    customer was charged. whatever goes through is voided.
+    """
+    hedge = settings.CHARGE_HEDGING_ENABLED if charge.hedge is None else charge.hedge
+    max_in_flight = settings.CHARGE_HEDGE_MAX_IN_FLIGHT if hedge else 1
+    # with a single attempt in flight at a time there is never a second charge to undo, so it captures right away
+    capture = max_in_flight == 1
+    # one reference per charge, sent to every provider as the idempotency key. a retry of a request gets a new one:
+    # providers answer a reused key with what they answered the first time, a 5xx included
+    reference = uuid4().hex
+    project_id = plan.project_id
+    candidates = iter(provider_router.order(project_id, plan.entries))
+    pending: dict[asyncio.Task, ProviderHealth] = {}
+    attempts: list[schema.ChargeAttempt] = []
+    stop = False
+    exhausted = False
+    deadline_exceeded = False
+
+    def launch() -> bool:
+        nonlocal exhausted, deadline_exceeded
+        if deadline.expired:
+            deadline_exceeded = exhausted = True
+            return False
+        for entry in candidates:
+            health = provider_router.health(project_id, entry.provider_name)
+            admission = health.allow_request()
+            if admission is None:
+                # a half open breaker lets one probe through at a time. an open one only shows up here when every
+                # provider is tripped, and then we try anyway rather than failing the charge without a single attempt
+                if health.state == HALF_OPEN:
+                    continue
+                admission = health.bypass()
+            task = asyncio.create_task(
+                _attempt(
+                    entry,
+                    health,
+                    admission,
+                    charge,
+                    reference,
+                    capture,
+                    deadline,
+                    limits,
+                )
+            )
+            pending[task] = health
+            return True
+        exhausted = True
+        return False
+
+    launch()
+    try:
+        while pending:
+            timeout = None
+            if hedge and not (stop or exhausted) and len(pending) < max_in_flight:
+                # hedge based on the latency of the attempt started last
+                timeout = min(
+                    hedge_delay(list(pending.values())[-1]), deadline.remaining()
+                )
+            done, _ = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                launch()
+                continue
+            winner = None
+            for task in done:
+                del pending[task]
+                outcome = task.result()
+                if outcome.result is not None and winner is None and not capture:
+                    outcome = await _capture(outcome, deadline)
+                attempts.append(outcome.attempt)
+                if outcome.result is None:
+                    stop = stop or not outcome.retryable
+                    deadline_exceeded = deadline_exceeded or outcome.deadline_exceeded
+                elif winner is None:
+                    winner = outcome
+                else:
+                    await _within(deadline, _void(outcome))
+            if winner is not None:
+                return schema.ChargeResponse(
+                    reference=reference, **winner.result.model_dump(), attempts=attempts
+                )
+            if not pending and not stop:
+                launch()
+        raise ChargeFailed(reference, attempts, deadline_exceeded=deadline_exceeded)
+    finally:
+        # attempts that lost a hedge, or all of them if the charge was cancelled. left to finish, and voided if they
+        # went through
+        for task in pending:
+            _detach(task)
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Hashable
+from uuid import UUID
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.cache import MISSING, TTLCache
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.deadlines import Deadline
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+# how often we look at the table while another worker is handling the same key
+POLL_INTERVAL_SECONDS = 0.05
+MAX_POLL_INTERVAL_SECONDS = 0.5
+
+
+@dataclass(frozen=True, slots=True)
+class StoredResponse:
+    request_hash: str
+    status_code: int
+    body: str  # json
+    replayed: bool = False
+
+
+def hash_request(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def _is_replayable(status_code: int) -> bool:
+    # server side failures (all providers down, deadline exceeded) are worth retrying, so they are not stored
+    return status_code < 500
+
+
+class IdempotencyStore:
+    """
+    Runs a request at most once per (project, Idempotency-Key).
+
+    the table with its unique index is the source of truth across workers. in front of it, completed responses are
+    kept in memory, and requests for a key that is already running in this worker wait on it instead of polling.
+    """
+
+    def __init__(self):
+        self._completed = TTLCache(
+            maxsize=settings.IDEMPOTENCY_CACHE_MAXSIZE,
+            ttl=settings.IDEMPOTENCY_TTL_SECONDS,
+        )
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    async def run(
+        self,
+        db: AsyncSession,
+        project_id: UUID,
+        key: str,
+        request_hash: str,
+        deadline: Deadline,
+        handler: Callable[[], Awaitable[tuple[int, str]]],
+    ) -> StoredResponse:
+        """
+        Returns the stored response for the key, or runs `handler` (returning status code and json body) to make one.
+        """
+        cache_key = (project_id, key)
+        while True:
+            stored = self._completed.get(cache_key)
+            if stored is not MISSING:
+                return self._replay(stored, request_hash)
+
+            in_flight = self._in_flight.get(cache_key)
+            if in_flight is not None:
+                try:
+                    stored = await asyncio.wait_for(
+                        asyncio.shield(in_flight), deadline.remaining()
+                    )
+                except TimeoutError:
+                    raise self._still_running()
+                if stored is None:
+                    # the original gave up without a replayable response, try again ourselves
+                    continue
+                return self._replay(stored, request_hash)
+
+            expires_at = datetime.now() + timedelta(
+                seconds=settings.IDEMPOTENCY_TTL_SECONDS
+            )
+            if await crud.claim_idempotency_key(
+                db, project_id, key, request_hash, expires_at
+            ):
+                return await self._execute(cache_key, request_hash, handler)
+
+            stored = await self._wait_for_other_worker(
+                db, project_id, key, request_hash, deadline
+            )
+            if stored is not None:
+                self._completed.set(cache_key, stored)
+                return self._replay(stored, request_hash)
+            # the row went away (released or expired) or its worker died, so the key can be claimed again
+
+    async def _execute(self, cache_key, request_hash, handler) -> StoredResponse:
+        project_id, key = cache_key
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        stored = None
+        try:
+            status_code, body = await handler()
+            stored = StoredResponse(request_hash, status_code, body)
+            return stored
+        finally:
+            del self._in_flight[cache_key]
+            replayable = stored is not None and _is_replayable(stored.status_code)
+            if replayable:
+                self._completed.set(cache_key, stored)
+            try:
+                # the request session may be unusable here (we could be getting cancelled), so use our own
+                async with AsyncSessionLocal() as key_db:
+                    if replayable:
+                        await asyncio.shield(
+                            crud.complete_idempotency_key(
+                                key_db, project_id, key, stored.status_code, stored.body
+                            )
+                        )
+                    else:
+                        await asyncio.shield(
+                            crud.release_idempotency_key(key_db, project_id, key)
+                        )
+            except Exception:
+                # the charge is done either way, its response must not turn into this error. the row stays in progress
+                # until its lease runs out, and this worker still replays the response from memory
+                logger.exception(
+                    "Could not store the outcome of Idempotency-Key %s of project %s",
+                    key,
+                    project_id,
+                )
+            finally:
+                # whatever happened to the write, so the requests waiting here never hang
+                future.set_result(stored if replayable else None)
+
+    async def _wait_for_other_worker(
+        self,
+        db: AsyncSession,
+        project_id: UUID,
+        key: str,
+        request_hash: str,
+        deadline: Deadline,
+    ) -> StoredResponse | None:
+        interval = POLL_INTERVAL_SECONDS
+        lease = timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+        while True:
+            record = await crud.get_idempotency_key(db, project_id, key)
+            # end the read transaction, or we would keep seeing the same snapshot
+            await db.rollback()
+            if record is None:
+                return None
+            if record.status == crud.COMPLETED:
+                return StoredResponse(
+                    record.request_hash, record.response_status, record.response_body
+                )
+            if record.created_at < datetime.now() - lease:
+                if record.request_hash != request_hash:
+                    raise self._mismatch()
+                return None
+            if deadline.remaining() <= interval:
+                raise self._still_running()
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+
+    @staticmethod
+    def _replay(stored: StoredResponse, request_hash: str) -> StoredResponse:
+        if stored.request_hash != request_hash:
+            raise IdempotencyStore._mismatch()
+        return StoredResponse(
+            stored.request_hash, stored.status_code, stored.body, replayed=True
+        )
+
+    @staticmethod
+    def _mismatch() -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used with a different request body",
+        )
+
+    @staticmethod
+    def _still_running() -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still in progress",
+        )
+
+
+idempotency_store = IdempotencyStore()
+
+
+async def cleanup_expired_keys() -> None:
+    """
+    Background loop deleting expired keys in small batches, so the table stays small without long running deletes.
+    """
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                while True:
+                    deleted = await crud.delete_expired_idempotency_keys(
+                        db, limit=settings.IDEMPOTENCY_CLEANUP_BATCH_SIZE
+                    )
+                    if deleted < settings.IDEMPOTENCY_CLEANUP_BATCH_SIZE:
+                        break
+        except Exception:
+            logger.exception("Idempotency key cleanup failed")
+        await asyncio.sleep(settings.IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS)
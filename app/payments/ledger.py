@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+from uuid import UUID, uuid4
+import asyncpg
+from sqlalchemy import exc as sa_exc, insert
+from app.core.config import settings
+from app.core.database import engine
+from . import models, schema
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_COLUMNS = (
+    "id",
+    "project_id",
+    "amount",
+    "currency",
+    "status",
+    "provider_name",
+    "provider_payment_id",
+    "created_at",
+    "updated_at",
+)
+ATTEMPT_COLUMNS = (
+    "id",
+    "transaction_id",
+    "project_id",
+    "provider_name",
+    "succeeded",
+    "latency_ms",
+    "error",
+    "created_at",
+)
+
+COLUMNS = {"transactions": TRANSACTION_COLUMNS, "payment_attempts": ATTEMPT_COLUMNS}
+
+# put in the queue by stop(), tells the flush loop to write what it has and exit
+_STOP = object()
+
+
+def _rejected(exc: Exception) -> bool:
+    # the database refused some of the rows (a constraint, a bad value), as opposed to being unreachable
+    return isinstance(
+        exc,
+        (
+            asyncpg.DataError,
+            asyncpg.IntegrityConstraintViolationError,
+            sa_exc.DataError,
+            sa_exc.IntegrityError,
+        ),
+    )
+
+
+def _append_dead_letters(batch: list) -> None:
+    with open(settings.LEDGER_DEAD_LETTER_PATH, "a") as file:
+        for table, row in batch:
+            record = {"table": table.name, **dict(zip(COLUMNS[table.name], row))}
+            file.write(json.dumps(record, default=str) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+class LedgerWriter:
+    """
+    Write-behind buffer for transactions and their provider attempts.
+
+    charges only put their records in memory, a single background task writes them in bulk (COPY, or multi-row
+    INSERTs) whenever LEDGER_FLUSH_SIZE records are waiting or LEDGER_FLUSH_INTERVAL_SECONDS have passed.
+    when the buffer is full, record_charge() waits for room, which slows charges down instead of growing memory without
+    bound. stop() writes whatever is still buffered.
+
+    a batch that keeps failing is written in halves, down to single records if the database rejects some of them.
+    whatever can't be written at all goes to LEDGER_DEAD_LETTER_PATH, nothing is dropped.
+    """
+
+    def __init__(self):
+        # (table, row) items
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=settings.LEDGER_BUFFER_SIZE)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the flush loop after draining everything that was buffered.
+        """
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        # records that came in after the stop marker
+        await self._flush(self._take(self._queue.qsize()))
+        self._queue = None
+
+    async def record_charge(
+        self,
+        project_id: UUID,
+        reference: str,
+        charge: schema.ChargeRequest,
+        attempts: list[schema.ChargeAttempt],
+        result: Optional[schema.ChargeResponse] = None,
+    ) -> None:
+        """
+        Buffers a finished charge (result is None if every provider failed) together with its attempts.
+        """
+        now = datetime.now()
+        transaction_id = UUID(reference)
+        rows = [
+            (
+                models.Transaction.__table__,
+                (
+                    transaction_id,
+                    project_id,
+                    charge.amount,
+                    charge.currency.upper(),
+                    result.status if result else "failed",
+                    result.provider_name if result else None,
+                    result.provider_payment_id if result else None,
+                    now,
+                    now,
+                ),
+            )
+        ]
+        for attempt in attempts:
+            rows.append(
+                (
+                    models.PaymentAttempt.__table__,
+                    (
+                        uuid4(),
+                        transaction_id,
+                        project_id,
+                        attempt.provider_name,
+                        attempt.succeeded,
+                        attempt.latency_ms,
+                        attempt.error,
+                        now,
+                    ),
+                )
+            )
+        if self._queue is None:
+            # not started (scripts, tests), write right away
+            await self._flush(rows)
+            return
+        for row in rows:
+            await self._queue.put(row)
+
+    def _take(self, limit: int) -> list:
+        items = []
+        while len(items) < limit and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                items.append(item)
+        return items
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            flush_at = loop.time() + settings.LEDGER_FLUSH_INTERVAL_SECONDS
+            while len(batch) < settings.LEDGER_FLUSH_SIZE and batch[-1] is not _STOP:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = flush_at - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except TimeoutError:
+                    break
+            if batch[-1] is _STOP:
+                batch.pop()
+                stopping = True
+            await self._flush(batch)
+
+    async def _flush(self, batch: list) -> None:
+        if not batch:
+            return
+        for attempt in range(1, settings.LEDGER_FLUSH_RETRIES + 1):
+            try:
+                await self._write(self._by_table(batch))
+                return
+            except Exception as exc:
+                if attempt == settings.LEDGER_FLUSH_RETRIES:
+                    failure = exc
+                    break
+                await asyncio.sleep(0.1 * 2**attempt)
+        if len(batch) > 1 and _rejected(failure):
+            half = len(batch) // 2
+            await self._write_or_split(batch[:half])
+            await self._write_or_split(batch[half:])
+        else:
+            await self._dead_letter(batch, failure)
+
+    async def _write_or_split(self, batch: list) -> None:
+        """
+        Writes a part of a batch the database rejected, halving it until the records it refuses are on their own.
+        """
+        try:
+            await self._write(self._by_table(batch))
+        except Exception as exc:
+            if len(batch) == 1 or not _rejected(exc):
+                await self._dead_letter(batch, exc)
+                return
+            half = len(batch) // 2
+            await self._write_or_split(batch[:half])
+            await self._write_or_split(batch[half:])
+
+    @staticmethod
+    async def _dead_letter(batch: list, exc: Exception) -> None:
+        try:
+            await asyncio.to_thread(_append_dead_letters, batch)
+        except OSError:
+            logger.exception("Could not write %d ledger records anywhere", len(batch))
+            for table, row in batch:
+                # the log is the last place they can be recovered from
+                logger.error("Lost ledger record %s %r", table.name, row)
+            return
+        logger.error(
+            "Wrote %d ledger records that failed to flush to %s",
+            len(batch),
+            settings.LEDGER_DEAD_LETTER_PATH,
+            exc_info=exc,
+        )
+
+    @staticmethod
+    def _by_table(batch: list) -> dict:
+        # keep transactions before attempts
+        rows_by_table: dict = {
+            models.Transaction.__table__: [],
+            models.PaymentAttempt.__table__: [],
+        }
+        for table, row in batch:
+            rows_by_table[table].append(row)
+        return rows_by_table
+
+    @staticmethod
+    async def _write(rows_by_table: dict) -> None:
+        async with engine.connect() as conn:
+            if settings.LEDGER_USE_COPY:
+                raw = await conn.get_raw_connection()
+                driver_connection = raw.driver_connection  # the asyncpg connection
+                async with driver_connection.transaction():
+                    for table, rows in rows_by_table.items():
+                        if rows:
+                            await driver_connection.copy_records_to_table(
+                                table.name, records=rows, columns=COLUMNS[table.name]
+                            )
+            else:
+                # sqlalchemy turns this into multi-row INSERT .. VALUES statements
+                for table, rows in rows_by_table.items():
+                    if rows:
+                        columns = COLUMNS[table.name]
+                        await conn.execute(
+                            insert(table), [dict(zip(columns, row)) for row in rows]
+                        )
+                await conn.commit()
+
+
+ledger_writer = LedgerWriter()
@@ -0,0 +1,205 @@
+"""
+Partition maintenance of the ledger tables, meant to run from cron (daily is plenty):
+
+    python -m app.payments.maintenance [--months-ahead 3] [--retention-months 24] [--archive-dir ledger-archive]
+
+creates the monthly partitions of transactions and payment_attempts for the coming months, and with a retention set,
+detaches the partitions that fell out of it, archives each one to a gzipped csv and drops it. a whole month goes
+at once, there are no row by row DELETEs and nothing to vacuum afterwards. rows that landed in the default partition
+because their month had none yet are moved into the month's partition when it gets created.
+"""
+
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime
+from typing import Optional
+from app.core.config import settings
+from app.core.database import engine
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("transactions", "payment_attempts")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    # same names as the migration that partitioned the tables gives them
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def _partition_month(table: str, name: str) -> Optional[date]:
+    match = re.fullmatch(rf"{table}_y(\d{{4}})m(\d{{2}})", name)
+    if match is None:
+        return None
+    return date(int(match[1]), int(match[2]), 1)
+
+
+async def _create_partition(conn, table: str, name: str, month: date) -> None:
+    end = add_months(month, 1)
+    # ddl takes no parameters, the bounds are dates we formatted ourselves
+    bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+    default = f"{table}_default"
+    in_month = "created_at >= $1 AND created_at < $2"
+    start_at = datetime(month.year, month.month, 1)
+    end_at = datetime(end.year, end.month, 1)
+    async with conn.transaction():
+        has_default = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", default)
+        if not has_default or not await conn.fetchval(
+            f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_month})",
+            start_at,
+            end_at,
+        ):
+            await conn.execute(f"CREATE TABLE {name} PARTITION OF {table} {bounds}")
+            return
+        # postgres refuses to create a partition whose rows are in the default one. so the table is created on its
+        # own, the rows moved into it and the table attached. the lock keeps new rows for the month out of the
+        # default partition in between
+        await conn.execute(f"LOCK TABLE {default} IN SHARE ROW EXCLUSIVE MODE")
+        await conn.execute(
+            f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        await conn.execute(
+            f"INSERT INTO {name} SELECT * FROM {default} WHERE {in_month}",
+            start_at,
+            end_at,
+        )
+        status = await conn.execute(
+            f"DELETE FROM {default} WHERE {in_month}", start_at, end_at
+        )
+        await conn.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} {bounds}")
+    logger.info("Moved %s rows of %s out of %s", status.split()[-1], name, default)
+
+
+async def create_partitions(conn, months_ahead: int, today: date) -> list[str]:
+    """
+    Creates the partitions from this month to `months_ahead` months from now that don't exist yet, and those of any
+    month with rows in the default partition. a partition that can't be created is logged and skipped, so the run
+    goes on to the retention.
+    """
+    created = []
+    this_month = today.replace(day=1)
+    for table in PARTITIONED_TABLES:
+        months = {add_months(this_month, offset) for offset in range(months_ahead + 1)}
+        if await conn.fetchval(
+            "SELECT to_regclass($1) IS NOT NULL", f"{table}_default"
+        ):
+            rows = await conn.fetch(
+                f"SELECT DISTINCT date_trunc('month', created_at)::date AS month FROM {table}_default"
+            )
+            months.update(row["month"] for row in rows)
+        for month in sorted(months):
+            name = partition_name(table, month)
+            exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name)
+            if exists:
+                continue
+            try:
+                await _create_partition(conn, table, name, month)
+            except Exception:
+                logger.exception(
+                    "Could not create partition %s, its rows stay in %s_default",
+                    name,
+                    table,
+                )
+                continue
+            created.append(name)
+    return created
+
+
+async def _archive(conn, name: str, archive_dir: str) -> int:
+    """
+    Writes a (detached) partition to <archive_dir>/<name>.csv.gz and returns how many rows it had. the file only
+    gets its final name once complete, so a crash halfway never leaves a truncated archive behind.
+    """
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    temporary = f"{path}.tmp"
+    with gzip.open(temporary, "wb") as file:
+
+        async def write(chunk: bytes) -> None:
+            file.write(chunk)
+
+        status = await conn.copy_from_table(
+            name, output=write, format="csv", header=True
+        )
+    os.replace(temporary, path)
+    # "COPY <rows>"
+    return int(status.split()[-1])
+
+
+async def apply_retention(
+    conn, retention_months: int, archive_dir: str, today: date
+) -> list[str]:
+    """
+    Detaches, archives and drops every monthly partition that ended more than `retention_months` months before the
+    current month. partitions detached by an earlier run that failed before dropping them are archived now.
+    """
+    cutoff = add_months(today.replace(day=1), -retention_months)
+    os.makedirs(archive_dir, exist_ok=True)
+    # a short lock timeout, so detaching never queues every ledger write behind it. the next run tries again
+    await conn.execute("SET lock_timeout = '5s'")
+    archived = []
+    for table in PARTITIONED_TABLES:
+        rows = await conn.fetch(
+            "SELECT c.relname, i.inhrelid IS NOT NULL AS attached "
+            "FROM pg_class c LEFT JOIN pg_inherits i ON i.inhrelid = c.oid "
+            "WHERE c.relkind = 'r' AND c.relname LIKE $1 ORDER BY c.relname",
+            f"{table}\\_y%",
+        )
+        for row in rows:
+            name = row["relname"]
+            month = _partition_month(table, name)
+            if month is None or add_months(month, 1) > cutoff:
+                continue
+            if row["attached"]:
+                await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            count = await _archive(conn, name, archive_dir)
+            await conn.execute(f"DROP TABLE {name}")
+            logger.info("Archived and dropped %s (%d rows)", name, count)
+            archived.append(name)
+    return archived
+
+
+async def run(
+    months_ahead: int,
+    retention_months: Optional[int],
+    archive_dir: str,
+    today: Optional[date] = None,
+) -> None:
+    today = today or date.today()
+    async with engine.connect() as sa_conn:
+        raw = await sa_conn.get_raw_connection()
+        # the asyncpg connection, outside of any transaction so every statement commits on its own
+        conn = raw.driver_connection
+        created = await create_partitions(conn, months_ahead, today)
+        logger.info("Created partitions: %s", ", ".join(created) or "none")
+        if retention_months is not None:
+            await apply_retention(conn, retention_months, archive_dir, today)
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--months-ahead", type=int, default=settings.LEDGER_PARTITION_MONTHS_AHEAD
+    )
+    parser.add_argument(
+        "--retention-months",
+        type=int,
+        default=settings.LEDGER_RETENTION_MONTHS,
+        help="months of partitions kept besides the current one, older ones are archived. unset keeps everything",
+    )
+    parser.add_argument("--archive-dir", default=settings.LEDGER_ARCHIVE_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    asyncio.run(run(args.months_ahead, args.retention_months, args.archive_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+from sqlalchemy.orm import mapped_column, Mapped
+from sqlalchemy import (
+    Boolean,
+    Index,
+    Float,
+    String,
+    Text,
+    DateTime,
+    UUID,
+    ForeignKey,
+    Integer,
+    UniqueConstraint,
+)
+from datetime import datetime
+from app.core.database import Base
+from uuid import uuid4
+
+
+# a client supplied Idempotency-Key of a charge, with the response that was given for it once done
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("project_id", "key", name="uq_idempotency_keys_project_key"),
+    )
+
+    id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid4
+    )
+    project_id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True), ForeignKey("projects.id"), nullable=False
+    )
+    key: Mapped[str] = mapped_column(String(255), nullable=False)
+    # sha256 of the request body, so the same key can't be reused for a different charge
+    request_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    # in_progress or completed
+    status: Mapped[str] = mapped_column(String(16), nullable=False)
+    response_status: Mapped[int] = mapped_column(Integer, nullable=True)
+    response_body: Mapped[str] = mapped_column(Text, nullable=True)
+    # when the key was claimed, reset when a claim left behind by a dead worker is taken over
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+
+# one charge, whichever provider(s) it went through. partitioned by month of created_at (see
+# app.payments.maintenance), which is why it is part of the primary key
+class Transaction(Base):
+    __tablename__ = "transactions"
+    # webhooks find their transaction by the provider's payment id, listings page through a project's transactions
+    # by (created_at, id). time range scans use the brin index, a few pages per partition instead of a full btree
+    __table_args__ = (
+        Index(
+            "ix_transactions_provider_payment", "provider_name", "provider_payment_id"
+        ),
+        Index("ix_transactions_project_created", "project_id", "created_at", "id"),
+        Index("ix_transactions_created_brin", "created_at", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    # same value as the charge reference, which is also the idempotency key sent to providers
+    id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    project_id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True), ForeignKey("projects.id"), nullable=False
+    )
+    amount: Mapped[int] = mapped_column(Integer, nullable=False)
+    currency: Mapped[str] = mapped_column(String(3), nullable=False)
+    status: Mapped[str] = mapped_column(String(16), nullable=False)
+    # empty when every provider failed
+    provider_name: Mapped[str] = mapped_column(String(255), nullable=True)
+    provider_payment_id: Mapped[str] = mapped_column(String(255), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, primary_key=True, nullable=False
+    )
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    # provider time of the last webhook applied, older events arriving late are ignored
+    status_updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+
+# a single call to a provider made while handling a transaction, partitioned like transactions
+class PaymentAttempt(Base):
+    __tablename__ = "payment_attempts"
+    __table_args__ = (
+        Index("ix_payment_attempts_project_created", "project_id", "created_at", "id"),
+        Index(
+            "ix_payment_attempts_created_brin", "created_at", postgresql_using="brin"
+        ),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid4
+    )
+    transaction_id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True), nullable=False, index=True
+    )
+    project_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    provider_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    succeeded: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    latency_ms: Mapped[float] = mapped_column(Float, nullable=False)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, primary_key=True, nullable=False
+    )
+
+
+# a provider webhook we received, kept so redeliveries of the same event are only applied once
+class WebhookEvent(Base):
+    __tablename__ = "webhook_events"
+    __table_args__ = (
+        UniqueConstraint(
+            "provider_name", "event_id", name="uq_webhook_events_provider_event"
+        ),
+    )
+
+    id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid4
+    )
+    project_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    provider_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    event_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    provider_payment_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    status: Mapped[str] = mapped_column(String(16), nullable=False)
+    occurred_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    received_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
@@ -0,0 +1,155 @@
+import asyncio
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional
+from uuid import UUID
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.cache import MISSING, TTLCache
+from app.core.config import settings
+from app.core.database import on_primary
+from app.projects import crud as project_crud, models as project_models
+
+
+@dataclass(frozen=True, slots=True)
+class ProviderEntry:
+    config_id: UUID
+    provider_name: str
+    is_primary: bool
+    priority: int
+    credentials: Mapping[str, str]  # already decoded, read only
+
+
+@dataclass(frozen=True, slots=True)
+class RoutingPlan:
+    """
+    Immutable, pre-sorted failover order of a project, with every provider's credentials already decoded.
+    """
+
+    project_id: UUID
+    entries: tuple[ProviderEntry, ...]
+
+
+def compile_plan(
+    project_id: UUID, configs: list[project_models.ProviderConfig]
+) -> RoutingPlan:
+    """
+    Builds the plan of a project: the primary provider first, then the rest by priority.
+    """
+    ordered = sorted(
+        configs, key=lambda config: (not config.is_primary, config.priority)
+    )
+    return RoutingPlan(
+        project_id=project_id,
+        entries=tuple(
+            ProviderEntry(
+                config_id=config.id,
+                provider_name=config.provider_name,
+                is_primary=config.is_primary,
+                priority=config.priority,
+                credentials=MappingProxyType(config.decoded_credentials()),
+            )
+            for config in ordered
+        ),
+    )
+
+
+class _Build:
+    """
+    A plan being built for a project, shared by every request waiting for it.
+    """
+
+    __slots__ = ("lock", "users", "stale")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # requests holding or waiting for the lock. the build is forgotten once the last one is done
+        self.users = 0
+        # set when the project's provider configs change while the plan is built, so it isn't stored
+        self.stale = False
+
+
+class PlanCache:
+    """
+    Per project RoutingPlan cache for the charge hot path, so a warm charge does no query and no decoding.
+    plans are dropped whenever a transaction touching the project's provider configs commits, and rebuilt on next use.
+    """
+
+    def __init__(self):
+        self._plans = TTLCache(
+            maxsize=settings.PLAN_CACHE_MAXSIZE, ttl=settings.PLAN_CACHE_TTL_SECONDS
+        )
+        # only projects with a build in flight are tracked, so this stays as small as the number of concurrent misses
+        self._builds: dict[UUID, _Build] = {}
+
+    async def get(self, db: AsyncSession, project_id: UUID) -> RoutingPlan:
+        plan = self._plans.get(project_id)
+        if plan is not MISSING:
+            return plan
+        build = self._builds.get(project_id)
+        if build is None:
+            build = self._builds[project_id] = _Build()
+        build.users += 1
+        try:
+            async with build.lock:
+                # someone else may have built it while we were waiting
+                plan = self._plans.get(project_id)
+                if plan is not MISSING:
+                    return plan
+                build.stale = False
+                # plans are rebuilt right after provider configs change, a lagging replica would cache the old ones
+                with on_primary(db):
+                    configs = await project_crud.get_provider_configs_for_project(
+                        db=db, project_id=project_id
+                    )
+                plan = compile_plan(project_id, configs)
+                if not build.stale:
+                    self._plans.set(project_id, plan)
+                return plan
+        finally:
+            build.users -= 1
+            if build.users == 0:
+                del self._builds[project_id]
+
+    def cached(self, project_id: UUID) -> Optional[RoutingPlan]:
+        """
+        The project's plan if it is cached, without building it otherwise.
+        """
+        plan = self._plans.get(project_id)
+        return None if plan is MISSING else plan
+
+    def invalidate(self, project_id: UUID) -> None:
+        build = self._builds.get(project_id)
+        if build is not None:
+            build.stale = True
+        self._plans.invalidate(project_id)
+
+    def stats(self) -> dict[str, int]:
+        return self._plans.stats()
+
+
+plan_cache = PlanCache()
+
+
+# invalidate plans on commit of any session that inserted, changed or deleted provider configs,
+# so it doesn't matter which crud function (or which future one) made the change
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_projects(session: Session, flush_context) -> None:
+    changed = session.info.setdefault("changed_plan_projects", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, project_models.ProviderConfig):
+            changed.add(obj.project_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_plans(session: Session) -> None:
+    for project_id in session.info.pop("changed_plan_projects", ()):
+        plan_cache.invalidate(project_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_plans(session: Session) -> None:
+    session.info.pop("changed_plan_projects", None)
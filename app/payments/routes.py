@@ -0,0 +1,279 @@
+import json
+from datetime import datetime
+from typing import Literal, Optional
+from uuid import UUID
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core import dependencies
+from app.core.config import settings
+from app.core.deadlines import ClientDisconnected, Deadline, run_until_disconnected
+from app.core.pagination import PageParams, set_next_cursor
+from app.projects import crud as project_crud, models as project_models
+from app.providers.webhooks import InvalidSignature, get_webhook_handler
+from . import crud, schema
+from .batch import run_batch
+from .export import MEDIA_TYPES, open_export
+from .failover import ChargeFailed, charge_with_failover
+from .idempotency import hash_request, idempotency_store
+from .ledger import ledger_writer
+from .plans import plan_cache
+from .webhooks import webhook_pipeline
+
+router = APIRouter(
+    prefix="/payments",
+    tags=["payments"],
+    route_class=dependencies.ReleaseSessionRoute,
+)
+
+
+def get_charge_timeout(
+    project: project_models.Project = Depends(dependencies.get_project_from_api_key),
+    x_request_timeout_ms: Optional[int] = Header(
+        None, gt=0, description="Total time a charge may take, in milliseconds"
+    ),
+) -> float:
+    """
+    Dependency giving the time budget of a charge in seconds: the client's, else the project's default, else the global one.
+    """
+    timeout_ms = (
+        x_request_timeout_ms
+        or project.charge_timeout_ms
+        or settings.CHARGE_DEFAULT_TIMEOUT_MS
+    )
+    return min(timeout_ms, settings.CHARGE_MAX_TIMEOUT_MS) / 1000
+
+
+async def _run_charge(
+    db: AsyncSession,
+    request: Request,
+    project: project_models.Project,
+    charge: schema.ChargeRequest,
+    deadline: Deadline,
+) -> tuple[int, str]:
+    """
+    Runs a charge and returns the status code and json body of its response.
+    """
+    plan = await plan_cache.get(db, project.id)
+    if not plan.entries:
+        return status.HTTP_400_BAD_REQUEST, json.dumps(
+            {"detail": "No payment providers configured for this project"}
+        )
+    try:
+        result = await run_until_disconnected(
+            request, charge_with_failover(plan, charge, deadline)
+        )
+    except ChargeFailed as exc:
+        await ledger_writer.record_charge(
+            project.id, exc.reference, charge, exc.attempts
+        )
+        detail = {
+            "message": "All payment providers failed",
+            "reference": exc.reference,
+            "attempts": [attempt.model_dump() for attempt in exc.attempts],
+        }
+        status_code = (
+            status.HTTP_504_GATEWAY_TIMEOUT
+            if exc.deadline_exceeded
+            else status.HTTP_502_BAD_GATEWAY
+        )
+        return status_code, json.dumps({"detail": detail})
+    await ledger_writer.record_charge(
+        project.id, result.reference, charge, result.attempts, result
+    )
+    return status.HTTP_200_OK, result.model_dump_json()
+
+
+@router.post("/charge", response_model=schema.ChargeResponse)
+async def create_charge(
+    charge: schema.ChargeRequest,
+    request: Request,
+    db: AsyncSession = Depends(dependencies.get_db),
+    project: project_models.Project = Depends(dependencies.get_project_from_api_key),
+    timeout: float = Depends(get_charge_timeout),
+    idempotency_key: Optional[str] = Header(
+        None,
+        max_length=255,
+        description="Retries with the same key get the original response back instead of charging again",
+    ),
+):
+    """
+    Charge through the project's primary provider, failing over to the backup providers if it fails.
+    """
+    deadline = Deadline(timeout)
+    headers = {}
+    try:
+        if idempotency_key is None:
+            status_code, body = await _run_charge(
+                db, request, project, charge, deadline
+            )
+        else:
+            request_hash = hash_request(charge.model_dump_json().encode())
+            stored = await idempotency_store.run(
+                db,
+                project.id,
+                idempotency_key,
+                request_hash,
+                deadline,
+                lambda: _run_charge(db, request, project, charge, deadline),
+            )
+            status_code, body = stored.status_code, stored.body
+            headers["Idempotent-Replayed"] = "true" if stored.replayed else "false"
+    except ClientDisconnected:
+        # 499 is what nginx logs for this. nobody will read it, but it keeps the access log honest
+        raise HTTPException(status_code=499, detail="Client closed request")
+    return Response(
+        content=body,
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json",
+    )
+
+
+@router.post("/charges/batch")
+async def create_charge_batch(
+    batch: schema.BatchChargeRequest,
+    db: AsyncSession = Depends(dependencies.get_read_db),
+    project: project_models.Project = Depends(dependencies.get_project_from_api_key),
+    timeout: float = Depends(get_charge_timeout),
+):
+    """
+    Run many charges of the same project in one request. auth and the failover plan are resolved once,
+    and each charge's result is streamed back as an ndjson line (see BatchChargeResult) as soon as it finishes.
+    X-Request-Timeout-Ms applies to every charge on its own, not to the whole batch.
+    """
+    if len(batch.charges) > settings.BATCH_MAX_CHARGES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch can have at most {settings.BATCH_MAX_CHARGES} charges",
+        )
+    plan = await plan_cache.get(db, project.id)
+    if not plan.entries:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No payment providers configured for this project",
+        )
+    return StreamingResponse(
+        run_batch(plan, batch.charges, timeout), media_type="application/x-ndjson"
+    )
+
+
+@router.post("/webhooks/{provider_name}/{project_id}", status_code=202)
+async def receive_webhook(
+    provider_name: str,
+    project_id: UUID,
+    request: Request,
+    db: AsyncSession = Depends(dependencies.get_read_db),
+):
+    """
+    Receives a provider's status webhook for one of the project's payments. the provider config must have a
+    `webhook_secret` in its credentials. the event is only verified and queued here, it is applied to the transaction
+    shortly after by the webhook workers.
+    """
+    handler = get_webhook_handler(provider_name)
+    if handler is None:
+        raise HTTPException(status_code=404, detail="Unknown provider")
+    # the plan is cached, so this normally doesn't touch the database
+    plan = plan_cache.cached(project_id)
+    if plan is None:
+        # anyone can post here, so only projects that exist get a plan built and cached: made up ids would push the
+        # plans of real projects out of the cache. the check reads the replica, a webhook for a project created moments
+        # ago gets a 404 and is delivered again later
+        if await project_crud.get_project_by_id(db, project_id) is None:
+            raise HTTPException(status_code=404, detail="Unknown project")
+        plan = await plan_cache.get(db, project_id)
+    secret = next(
+        (
+            entry.credentials.get("webhook_secret")
+            for entry in plan.entries
+            if entry.provider_name == provider_name
+        ),
+        None,
+    )
+    if not secret:
+        raise HTTPException(
+            status_code=404, detail="No webhook secret configured for this provider"
+        )
+    try:
+        event = handler.parse(await request.body(), request.headers, secret)
+    except InvalidSignature as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    if event is not None and not webhook_pipeline.submit(project_id, event):
+        # the provider will deliver it again later
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Webhook queue is full",
+            headers={"Retry-After": "5"},
+        )
+    return Response(status_code=status.HTTP_202_ACCEPTED)
+
+
+@router.get("/transactions", response_model=list[schema.Transaction])
+async def read_transactions(
+    response: Response,
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(dependencies.get_read_db),
+    project: project_models.Project = Depends(dependencies.get_project_from_api_key),
+):
+    """
+    The project's transactions, newest first. pages are chained with the X-Next-Cursor response header.
+    """
+    transactions, next_cursor = await crud.list_transactions(db, project.id, page)
+    set_next_cursor(response, next_cursor)
+    return transactions
+
+
+@router.get("/transactions/export")
+async def export_transaction_history(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    project: project_models.Project = Depends(dependencies.get_project_from_api_key),
+):
+    """
+    Every transaction of the project created in [created_from, created_to), oldest first, streamed as ndjson or csv.
+    """
+    export = open_export(project.id, format, created_from, created_to)
+    if export is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many exports running, try again later",
+            headers={"Retry-After": "30"},
+        )
+    return StreamingResponse(
+        export,
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="transactions.{format}"'
+        },
+    )
+
+
+@router.get("/attempts", response_model=list[schema.PaymentAttempt])
+async def read_payment_attempts(
+    response: Response,
+    transaction_id: Optional[UUID] = Query(None),
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(dependencies.get_read_db),
+    project: project_models.Project = Depends(dependencies.get_project_from_api_key),
+):
+    """
+    The project's provider attempts, newest first, optionally only those of one transaction. paginated like
+    /payments/transactions.
+    """
+    attempts, next_cursor = await crud.list_payment_attempts(
+        db, project.id, page, transaction_id
+    )
+    set_next_cursor(response, next_cursor)
+    return attempts
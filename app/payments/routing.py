@@ -0,0 +1,252 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Callable, Hashable, Optional, Protocol, Sequence
+from app.core.config import settings
+
+
+class _Routable(Protocol):
+    provider_name: str
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _percentile(sorted_values: list[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(
+        len(sorted_values) - 1, int(round(percentile * (len(sorted_values) - 1)))
+    )
+    return sorted_values[index]
+
+
+@dataclass(frozen=True, slots=True)
+class Admission:
+    """
+    A call let through by a breaker: the breaker generation it was admitted in, and whether it holds the half open
+    probe slot. handed back to record() or abandon() once the call is over.
+    """
+
+    generation: int
+    probe: bool = False
+
+
+class ProviderHealth:
+    """
+    Rolling health of one provider for one project: error rate, latency percentiles and a circuit breaker.
+
+    The breaker opens after too many consecutive failures or a high error rate, stays open for `open_seconds`,
+    then goes half open and lets a single probe call through. a successful probe closes it again, a failed one reopens it.
+
+    every state change starts a new generation. results of calls admitted in an earlier one are ignored, so a slow
+    call sent before the breaker opened can't close it, nor old failures trip it again right after it closed.
+    """
+
+    def __init__(
+        self,
+        window_size: int,
+        min_samples: int,
+        error_rate_threshold: float,
+        consecutive_failures: int,
+        open_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_samples = min_samples
+        self.error_rate_threshold = error_rate_threshold
+        self.consecutive_failures_threshold = consecutive_failures
+        self.open_seconds = open_seconds
+        self._clock = clock
+        self._samples: deque[tuple[float, bool]] = deque(maxlen=window_size)
+        self._failures = 0  # in the window
+        self.consecutive_failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._generation = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            return HALF_OPEN
+        return self._state
+
+    def allow_request(self) -> Optional[Admission]:
+        """
+        Admits a call to this provider now, or returns None. in half open state this reserves the single probe slot.
+        """
+        state = self.state
+        if state == CLOSED:
+            return Admission(self._generation)
+        if state == HALF_OPEN and not self._probe_in_flight:
+            self._state = HALF_OPEN
+            self._probe_in_flight = True
+            return Admission(self._generation, probe=True)
+        return None
+
+    def bypass(self) -> Admission:
+        """
+        Admits a call whatever the breaker says, e.g. when every provider of a charge is tripped.
+        """
+        return Admission(self._generation)
+
+    def abandon(self, admission: Admission) -> None:
+        """
+        Ends a call without a result, e.g. because it was cancelled. gives back the probe slot if the call held it.
+        """
+        if admission.probe and admission.generation == self._generation:
+            self._probe_in_flight = False
+
+    def record(
+        self, latency_ms: float, ok: bool, admission: Optional[Admission] = None
+    ) -> None:
+        """
+        Records the outcome of a call. `admission` is what allow_request() gave the call, without one the result
+        counts as if it was admitted now.
+        """
+        if admission is not None and admission.generation != self._generation:
+            return
+        if len(self._samples) == self._samples.maxlen and not self._samples[0][1]:
+            self._failures -= 1
+        self._samples.append((latency_ms, ok))
+        if ok:
+            self.consecutive_failures = 0
+        else:
+            self._failures += 1
+            self.consecutive_failures += 1
+
+        if self._state == HALF_OPEN:
+            if admission is not None and not admission.probe:
+                # only the probe decides
+                return
+            self._probe_in_flight = False
+            if ok:
+                self._close()
+            else:
+                self._open()
+        elif self._state == CLOSED and not ok and self._should_trip():
+            self._open()
+
+    def _should_trip(self) -> bool:
+        if self.consecutive_failures >= self.consecutive_failures_threshold:
+            return True
+        return (
+            len(self._samples) >= self.min_samples
+            and self.error_rate >= self.error_rate_threshold
+        )
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._generation += 1
+
+    def _close(self) -> None:
+        self._state = CLOSED
+        self._generation += 1
+        self.consecutive_failures = 0
+        # start from a clean window, otherwise the failures that tripped the breaker would trip it again right away
+        self._samples.clear()
+        self._failures = 0
+
+    @property
+    def sample_count(self) -> int:
+        return len(self._samples)
+
+    @property
+    def error_rate(self) -> float:
+        return self._failures / len(self._samples) if self._samples else 0.0
+
+    def latency_percentile(self, percentile: float) -> float:
+        return _percentile(sorted(latency for latency, _ in self._samples), percentile)
+
+    def stats(self) -> dict:
+        latencies = sorted(latency for latency, _ in self._samples)
+        return {
+            "state": self.state,
+            "samples": len(self._samples),
+            "error_rate": self.error_rate,
+            "consecutive_failures": self.consecutive_failures,
+            "p50_ms": _percentile(latencies, 0.5),
+            "p95_ms": _percentile(latencies, 0.95),
+        }
+
+
+class ProviderRouter:
+    """
+    Orders a project's providers by their live health instead of the static primary/priority order alone.
+    providers with an open breaker are skipped, slow ones are moved behind the healthy ones.
+    at most `max_tracked` (project, provider) pairs are tracked, the least recently used ones are dropped past that.
+    """
+
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.monotonic,
+        max_tracked: Optional[int] = None,
+    ):
+        self._clock = clock
+        self.max_tracked = (
+            settings.ROUTER_MAX_TRACKED if max_tracked is None else max_tracked
+        )
+        self._health: OrderedDict[tuple[Hashable, str], ProviderHealth] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def health(self, project_id: Hashable, provider_name: str) -> ProviderHealth:
+        key = (project_id, provider_name)
+        with self._lock:
+            health = self._health.get(key)
+            if health is not None:
+                self._health.move_to_end(key)
+                return health
+            health = self._health[key] = ProviderHealth(
+                window_size=settings.ROUTER_WINDOW_SIZE,
+                min_samples=settings.ROUTER_MIN_SAMPLES,
+                error_rate_threshold=settings.ROUTER_ERROR_RATE_THRESHOLD,
+                consecutive_failures=settings.ROUTER_CONSECUTIVE_FAILURES,
+                open_seconds=settings.ROUTER_OPEN_SECONDS,
+                clock=self._clock,
+            )
+            while len(self._health) > self.max_tracked:
+                self._health.popitem(last=False)
+        return health
+
+    def order(
+        self,
+        project_id: Hashable,
+        providers: Sequence[_Routable],
+    ) -> list[_Routable]:
+        """
+        Returns the providers to try, best first. `providers` must already be in static failover order.
+        if every breaker is open, the static order is returned so the charge is still attempted.
+        """
+        ranked = []
+        for index, provider in enumerate(providers):
+            health = self.health(project_id, provider.provider_name)
+            state = health.state
+            if state == OPEN:
+                continue
+            slow = health.latency_percentile(0.95) > settings.ROUTER_SLOW_P95_MS
+            # closed before half open (a probe might still fail), healthy before slow, then the static order
+            ranked.append(((state == HALF_OPEN, slow, index), provider))
+        if not ranked:
+            return list(providers)
+        ranked.sort(key=lambda item: item[0])
+        return [provider for _, provider in ranked]
+
+    def record(
+        self, project_id: Hashable, provider_name: str, latency_ms: float, ok: bool
+    ) -> None:
+        self.health(project_id, provider_name).record(latency_ms, ok)
+
+    def stats(self) -> dict[str, dict[str, dict]]:
+        result: dict[str, dict[str, dict]] = {}
+        with self._lock:
+            tracked = list(self._health.items())
+        for (project_id, provider_name), health in tracked:
+            result.setdefault(str(project_id), {})[provider_name] = health.stats()
+        return result
+
+
+provider_router = ProviderRouter()
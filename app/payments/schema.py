@@ -0,0 +1,86 @@
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+from pydantic import BaseModel, ConfigDict, Field
+
+
+# request body of POST /payments/charge
+class ChargeRequest(BaseModel):
+    amount: int = Field(gt=0)  # in the smallest currency unit, e.g. cents or paise
+    currency: str = Field(min_length=3, max_length=3)
+    payment_method: Optional[str] = (
+        None  # provider side token of the card/upi/etc being charged
+    )
+    description: Optional[str] = None
+    # start a backup provider in parallel when the first one is slow. defaults to CHARGE_HEDGING_ENABLED
+    hedge: Optional[bool] = None
+
+
+# a charge as returned by any provider, after being normalized into our unified shape
+class ProviderCharge(BaseModel):
+    provider_name: str
+    provider_payment_id: str
+    status: str  # succeeded, pending or failed
+    amount: int
+    currency: str
+
+
+# one provider attempt made while handling a charge
+class ChargeAttempt(BaseModel):
+    provider_name: str
+    succeeded: bool
+    latency_ms: float
+    error: Optional[str] = None
+
+
+# request body of POST /payments/charges/batch, every charge is for the same project
+class BatchChargeRequest(BaseModel):
+    charges: list[ChargeRequest] = Field(min_length=1)
+
+
+# unified response of POST /payments/charge, whichever provider ended up handling it
+class ChargeResponse(BaseModel):
+    reference: (
+        str  # our id of the charge, also the idempotency key sent to the providers
+    )
+    provider_name: str
+    provider_payment_id: str
+    status: str
+    amount: int
+    currency: str
+    attempts: list[ChargeAttempt] = []
+
+
+# one line of the ndjson stream of POST /payments/charges/batch, sent as soon as its charge is done
+class BatchChargeResult(BaseModel):
+    index: int  # position of the charge in the request
+    succeeded: bool
+    charge: Optional[ChargeResponse] = None
+    error: Optional[dict] = None
+
+
+# a row of the transaction ledger, as listed by GET /payments/transactions
+class Transaction(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: UUID  # the charge reference
+    amount: int
+    currency: str
+    status: str
+    provider_name: Optional[str] = None
+    provider_payment_id: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+# a single provider call of a transaction, as listed by GET /payments/attempts
+class PaymentAttempt(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: UUID
+    transaction_id: UUID
+    provider_name: str
+    succeeded: bool
+    latency_ms: float
+    error: Optional[str] = None
+    created_at: datetime
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from uuid import UUID
+from app.core.cache import MISSING, TTLCache
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import Counter
+from app.providers.webhooks import WebhookEvent
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+webhook_events = Counter(
+    "webhook_events_total",
+    "Provider webhook events by what happened to them (queued, duplicate, applied, unmatched, dropped)",
+)
+
+# put in the queues by stop(), tells a worker to write what it has and exit
+_STOP = object()
+
+# breaks ties between events of the same payment with the same timestamp, later states win
+STATUS_RANK = {
+    "pending": 0,
+    "failed": 1,
+    "canceled": 1,
+    "succeeded": 2,
+    "refunded": 3,
+    "disputed": 4,
+}
+
+
+@dataclass(frozen=True, slots=True)
+class _Queued:
+    project_id: UUID
+    event: WebhookEvent
+    # 0 for a fresh event, more for one tried again because its transaction wasn't there yet
+    attempt: int = 0
+
+    @property
+    def payment_key(self) -> tuple[UUID, str, str]:
+        return (
+            self.project_id,
+            self.event.provider_name,
+            self.event.provider_payment_id,
+        )
+
+
+class WebhookPipeline:
+    """
+    Applies provider webhooks to transactions in the background, so receiving one is only a signature check and a
+    queue put, and a flood of them (a provider catching up after an outage) can't hold up charges.
+
+    events are spread over WEBHOOK_WORKERS queues by payment, each worker takes batches off its queue, drops events it
+    has already seen (in memory, then the webhook_events table) and applies the latest event of every payment with a
+    single UPDATE. an event only counts as seen once the transaction it was applied in has committed, and events of
+    payments that matched no transaction are not kept in webhook_events, so a redelivery of them is applied again.
+    the workers are also the only webhook code that uses database connections, so they bound how many of the pool
+    webhooks can take. queued events live in memory only, a crash loses what wasn't applied yet.
+    """
+
+    def __init__(self):
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        self._retries: set[asyncio.Task] = set()
+        # (provider_name, event_id) of events already processed, answers most redeliveries without the database
+        self._seen = TTLCache(
+            maxsize=settings.WEBHOOK_DEDUPE_CACHE_MAXSIZE,
+            ttl=settings.WEBHOOK_DEDUPE_CACHE_TTL_SECONDS,
+        )
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        workers = settings.WEBHOOK_WORKERS
+        maxsize = max(settings.WEBHOOK_QUEUE_SIZE // workers, 1)
+        self._queues = [asyncio.Queue(maxsize=maxsize) for _ in range(workers)]
+        self._tasks = [asyncio.create_task(self._run(queue)) for queue in self._queues]
+
+    async def stop(self) -> None:
+        """
+        Stops the workers after they applied everything that was queued. pending retries are dropped.
+        """
+        if not self._tasks:
+            return
+        for task in list(self._retries):
+            task.cancel()
+        for queue in self._queues:
+            await queue.put(_STOP)
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+        self._queues = []
+
+    def submit(self, project_id: UUID, event: WebhookEvent) -> bool:
+        """
+        Queues an event. returns False if it couldn't be queued (pipeline full or not running), so the caller can make
+        the provider deliver it again later.
+        """
+        if not self._tasks:
+            return False
+        seen_key = (event.provider_name, event.event_id)
+        if self._seen.get(seen_key) is not MISSING:
+            webhook_events.inc(outcome="duplicate")
+            return True
+        if not self._put(_Queued(project_id, event)):
+            webhook_events.inc(outcome="dropped")
+            return False
+        webhook_events.inc(outcome="queued")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(queue.qsize() for queue in self._queues),
+            "retries_scheduled": len(self._retries),
+            "events": {
+                dict(labels)["outcome"]: int(count)
+                for labels, count in webhook_events.snapshot().items()
+            },
+        }
+
+    def _put(self, queued: _Queued) -> bool:
+        queue = self._queues[hash(queued.payment_key) % len(self._queues)]
+        try:
+            queue.put_nowait(queued)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _retry_later(self, queued: _Queued) -> None:
+        await asyncio.sleep(settings.WEBHOOK_RETRY_DELAY_SECONDS)
+        if not self._tasks:
+            return
+        if not self._put(_Queued(queued.project_id, queued.event, queued.attempt + 1)):
+            webhook_events.inc(outcome="dropped")
+
+    def _schedule_retry(self, queued: _Queued) -> None:
+        task = asyncio.create_task(self._retry_later(queued))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            batch = [await queue.get()]
+            flush_at = loop.time() + settings.WEBHOOK_FLUSH_INTERVAL_SECONDS
+            while len(batch) < settings.WEBHOOK_BATCH_SIZE and batch[-1] is not _STOP:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                remaining = flush_at - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except TimeoutError:
+                    break
+            if batch[-1] is _STOP:
+                batch.pop()
+                stopping = True
+            if not batch:
+                continue
+            try:
+                await self._apply(batch)
+            except Exception:
+                logger.exception("Could not apply %d webhook events", len(batch))
+                webhook_events.inc(len(batch), outcome="dropped")
+
+    async def _apply(self, batch: list[_Queued]) -> None:
+        # redeliveries within the batch
+        unique = {
+            (queued.event.provider_name, queued.event.event_id): queued
+            for queued in batch
+        }
+        async with AsyncSessionLocal() as db:
+            received_at = datetime.now()
+            # retried events were taken out of the table again when they matched nothing, so they come back as new
+            # unless a redelivery of them got applied in the meantime
+            new = await crud.record_webhook_events(
+                db,
+                [
+                    {
+                        "project_id": queued.project_id,
+                        "provider_name": queued.event.provider_name,
+                        "event_id": queued.event.event_id,
+                        "provider_payment_id": queued.event.provider_payment_id,
+                        "status": queued.event.status,
+                        "occurred_at": queued.event.occurred_at,
+                        "received_at": received_at,
+                    }
+                    for queued in unique.values()
+                ],
+            )
+            webhook_events.inc(len(batch) - len(new), outcome="duplicate")
+            events = [queued for key, queued in unique.items() if key in new]
+            # events of a payment can arrive in any order, only the latest one matters
+            latest: dict[tuple, _Queued] = {}
+            for queued in sorted(
+                events,
+                key=lambda queued: (
+                    queued.event.occurred_at,
+                    STATUS_RANK.get(queued.event.status, 0),
+                ),
+            ):
+                latest[queued.payment_key] = queued
+            applied = set()
+            if latest:
+                applied = await crud.apply_transaction_statuses(
+                    db,
+                    [
+                        (*key, queued.event.status, queued.event.occurred_at)
+                        for key, queued in latest.items()
+                    ],
+                )
+            unmatched = {
+                (queued.event.provider_name, queued.event.event_id)
+                for queued in events
+                if queued.payment_key not in applied
+            }
+            if unmatched:
+                await crud.forget_webhook_events(db, list(unmatched))
+            await db.commit()
+        for key in unique.keys() - unmatched:
+            self._seen.set(key, True)
+        webhook_events.inc(len(applied), outcome="applied")
+        for key, queued in latest.items():
+            if key in applied:
+                continue
+            # either the transaction isn't written yet (the ledger is write-behind) or it has a newer status already
+            if queued.attempt < settings.WEBHOOK_UNMATCHED_RETRIES:
+                self._schedule_retry(queued)
+            else:
+                webhook_events.inc(outcome="unmatched")
+
+
+webhook_pipeline = WebhookPipeline()
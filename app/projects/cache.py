@@ -0,0 +1,39 @@
+import time
+from typing import Hashable
+from uuid import UUID
+from app.core.cache import TTLCache
+from app.core.config import settings
+from .keys import hash_api_key
+
+
+# API key digest -> Project cache used by get_project_from_api_key. raw keys are never kept in memory.
+# entries are grouped by project id,
+# so everything cached for a project can be dropped when the project or its key changes.
+project_cache = TTLCache(
+    maxsize=settings.PROJECT_CACHE_MAXSIZE,
+    ttl=settings.PROJECT_CACHE_TTL_SECONDS,
+    negative_ttl=settings.PROJECT_CACHE_NEGATIVE_TTL_SECONDS,
+)
+
+# digests and project ids invalidated in this worker -> when. the shared API key index ignores their entries until
+# it has been rebuilt after that, see app.projects.index
+index_invalidations: dict[Hashable, float] = {}
+
+
+def invalidate_api_key(api_key: str) -> None:
+    """
+    Drops the cached lookup (positive or negative) for a single API key.
+    """
+    api_key_hash = hash_api_key(api_key)
+    project_cache.invalidate(api_key_hash)
+    if settings.API_KEY_INDEX_PATH:
+        index_invalidations[api_key_hash] = time.time()
+
+
+def invalidate_project(project_id: UUID) -> None:
+    """
+    Drops every cached lookup that resolved to the given project.
+    """
+    project_cache.invalidate_group(project_id)
+    if settings.API_KEY_INDEX_PATH:
+        index_invalidations[project_id] = time.time()
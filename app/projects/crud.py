@@ -1,35 +1,66 @@
+import json
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from . import schema, models  # NOQA
-from secrets import token_urlsafe
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
+from app.core.pagination import PageParams, paginate
+from app.core.singleflight import singleflight
 from uuid import UUID
+from .cache import invalidate_api_key, invalidate_project
+from .keys import generate_api_key, hash_api_key, api_key_prefix
+
+MAX_API_KEY_ATTEMPTS = 3
 
 
 async def create_project(
-    db: AsyncSession, project_data: schema.ProjectCreate
+    db: AsyncSession, project_data: schema.ProjectCreate, user_id: Optional[int] = None
 ) -> models.Project:
     """
     Creates a new project in the database and generate an API Key for it.
+    The returned project carries the plaintext key in `api_key`; it is not stored anywhere, so this is the only time it can be shown.
     """
-    while True:
-        api_key = token_urlsafe(
-            32
-        )  # generates a secure random URL-safe text string, in this case 32 bytes long.
-        # checks if the generated API key already exists in the database. if it doesn't, we break the while loop. if it does, the loop runs again and produces a new key.
-        existing_project = await get_project_by_api_key(db, api_key=api_key)
-        if not existing_project:
-            break
-    new_project = schema.Project(
-        project_name=project_data.project_name,
-        api_key=api_key,
-        project_id=project_data.project_id,
-        created_at=project_data.created_at,
-        updated_at=project_data.updated_at,
-    )
-    db.add(new_project)
+    for _ in range(MAX_API_KEY_ATTEMPTS):
+        api_key = generate_api_key()
+        new_project = models.Project(
+            id=project_data.project_id,
+            name=project_data.project_name,
+            user_id=user_id,
+            api_key_hash=hash_api_key(api_key),
+            api_key_prefix=api_key_prefix(api_key),
+            created_at=project_data.created_at,
+            updated_at=project_data.updated_at,
+        )
+        db.add(new_project)
+        # no SELECT beforehand, the unique index on api_key_hash decides. a collision of 256 bit keys is practically impossible,
+        # but if it ever happens the insert fails and we just try again with a fresh key.
+        try:
+            await db.commit()
+        except IntegrityError as exc:
+            await db.rollback()
+            if "api_key_hash" not in str(exc.orig):
+                raise
+            continue
+        await db.refresh(new_project)
+        new_project.api_key = api_key
+        invalidate_api_key(api_key)  # in case this key was cached as unknown before
+        return new_project
+    raise RuntimeError("Could not generate a unique API key")
+
+
+async def rotate_api_key(db: AsyncSession, project: models.Project) -> models.Project:
+    """
+    Replaces the API key of a project. the old key stops working immediately, including in the cache.
+    """
+    api_key = generate_api_key()
+    project.api_key_hash = hash_api_key(api_key)
+    project.api_key_prefix = api_key_prefix(api_key)
+    db.add(project)
     await db.commit()
-    await db.refresh(new_project)
-    return new_project
+    await db.refresh(project)
+    invalidate_project(project.id)
+    project.api_key = api_key
+    return project
 
 
 async def get_project_by_api_key(
@@ -38,10 +69,39 @@ async def get_project_by_api_key(
     """
     Retrieves a project from the database by its API Key.
     """
-    result = await db.execute(select(models.Project).filter_by(api_key=api_key))
+    return await get_project_by_api_key_hash(db, api_key_hash=hash_api_key(api_key))
+
+
+@singleflight
+async def get_project_by_api_key_hash(
+    db: AsyncSession, api_key_hash: str
+) -> models.Project | None:
+    """
+    Retrieves a project by the digest of its API Key. this is a single point query on the unique index.
+    """
+    result = await db.execute(
+        select(models.Project).filter_by(api_key_hash=api_key_hash)
+    )
     return result.scalars().first()
 
 
+async def get_api_key_index_rows(db: AsyncSession) -> list[tuple]:
+    """
+    (api_key_hash, id, charge_timeout_ms, rate_limit_per_second, rate_limit_burst) of every project, sorted by
+    digest, for the shared API key index.
+    """
+    result = await db.execute(
+        select(
+            models.Project.api_key_hash,
+            models.Project.id,
+            models.Project.charge_timeout_ms,
+            models.Project.rate_limit_per_second,
+            models.Project.rate_limit_burst,
+        ).order_by(models.Project.api_key_hash)
+    )
+    return [tuple(row) for row in result.all()]
+
+
 async def create_provider_config(
     db: AsyncSession, project_id, provider_data: schema.ProviderConfigCreate
 ) -> models.ProviderConfig:
@@ -51,15 +111,19 @@ async def create_provider_config(
     new_provider = models.ProviderConfig(
         project_id=project_id,
         provider_name=provider_data.provider_name,
-        credentials=provider_data.credentials,
+        credentials=json.dumps(provider_data.credentials),
         is_primary=provider_data.is_primary,
+        priority=provider_data.priority,
     )
     db.add(new_provider)
     await db.commit()
     await db.refresh(new_provider)
+    # cached projects would still carry the old provider configs
+    invalidate_project(project_id)
     return new_provider
 
 
+@singleflight
 async def get_provider_configs_for_project(
     db: AsyncSession, project_id: UUID
 ) -> list[models.ProviderConfig]:
@@ -72,11 +136,28 @@ async def get_provider_configs_for_project(
     return list(result.scalars().all())
 
 
+async def list_provider_configs_for_project(
+    db: AsyncSession, project_id: UUID, page: PageParams
+) -> tuple[list[models.ProviderConfig], Optional[str]]:
+    """
+    One page of a project's provider configurations, by priority. charges try the primary one first whatever its
+    priority, see app.payments.plans.
+    """
+    config = models.ProviderConfig
+    return await paginate(
+        db,
+        select(config).filter_by(project_id=project_id),
+        (config.priority, config.id),
+        page,
+    )
+
+
+@singleflight
 async def get_project_by_id(
     db: AsyncSession, project_id: UUID
 ) -> models.Project | None:
     """
     Retrieves a project from the database by its ID.
     """
-    result = await db.execute(select(models.Project).filter_by(project_id=project_id))
+    result = await db.execute(select(models.Project).filter_by(id=project_id))
     return result.scalars().first()
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+from typing import Optional
+from uuid import UUID
+from app.core.config import settings
+from app.core.database import ReadSessionLocal, on_primary
+from . import crud, models
+from .cache import index_invalidations
+
+try:
+    import fcntl
+except ImportError:
+    # no flock on windows, the index is unix only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# file layout: header, then one fixed size record per project sorted by key digest, so lookups are a binary search
+# straight over the mapped file
+MAGIC = b"PAKIDX01"
+# magic, built_at (unix time), record count
+HEADER = struct.Struct("<8sdQ")
+# key digest, project id, status, charge_timeout_ms, rate_limit_burst, rate_limit_per_second.
+# -1 and NaN stand for NULL
+RECORD = struct.Struct("<32s16sB3xiid")
+
+STATUS_ACTIVE = 1
+
+
+def build_index(rows: list[tuple], built_at: float) -> bytes:
+    """
+    Serializes rows of crud.get_api_key_index_rows, which must be sorted by digest.
+    """
+    buffer = bytearray(HEADER.size + RECORD.size * len(rows))
+    HEADER.pack_into(buffer, 0, MAGIC, built_at, len(rows))
+    offset = HEADER.size
+    for api_key_hash, project_id, timeout_ms, per_second, burst in rows:
+        RECORD.pack_into(
+            buffer,
+            offset,
+            bytes.fromhex(api_key_hash),
+            project_id.bytes,
+            STATUS_ACTIVE,
+            -1 if timeout_ms is None else timeout_ms,
+            -1 if burst is None else burst,
+            math.nan if per_second is None else per_second,
+        )
+        offset += RECORD.size
+    return bytes(buffer)
+
+
+class _Mapped:
+    """
+    One generation of the index file, mapped read only. the pages are the OS page cache, shared by every worker.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.stat = os.fstat(file.fileno())
+            self.view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.built_at, self.count = HEADER.unpack_from(self.view, 0)
+        if magic != MAGIC or len(self.view) != HEADER.size + RECORD.size * self.count:
+            raise ValueError(f"{path} is not a valid API key index")
+
+    def find(self, digest: bytes) -> Optional[tuple]:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD.size
+            current = self.view[offset : offset + 32]
+            if current < digest:
+                low = middle + 1
+            elif current > digest:
+                high = middle
+            else:
+                return RECORD.unpack_from(self.view, offset)
+        return None
+
+
+class ApiKeyIndex:
+    """
+    API key digest -> project index shared by all workers of a host, in front of the database for
+    get_project_from_api_key. the per worker project cache still comes first, the index is what a worker that just
+    started (or whose cache entry expired) consults before querying.
+
+    one worker, whichever holds an flock on "<path>.lock", rebuilds the file every API_KEY_INDEX_REFRESH_SECONDS and
+    swaps it in with os.replace(), so readers only ever see complete files. the others notice the new inode and map
+    it, the old mapping goes away with its last reference. memory doesn't grow with the number of workers, they all
+    map the same pages.
+
+    keys missing from the index are looked up in the database as before, it is never used to reject a key. keys
+    rotated in another worker keep working until the next rebuild, the same as with the project cache ttl.
+    """
+
+    def __init__(self):
+        self.path = settings.API_KEY_INDEX_PATH
+        self._mapped: Optional[_Mapped] = None
+        self._lock_file = None
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and fcntl is not None
+
+    @property
+    def leader(self) -> bool:
+        return self._lock_file is not None
+
+    def get(self, api_key_hash: str) -> Optional[models.Project]:
+        """
+        Returns a detached Project with the fields the request path needs (id, timeout and rate limits) for a key in
+        the index, None if the key isn't in it.
+        """
+        mapped = self._mapped
+        if mapped is None:
+            return None
+        record = mapped.find(bytes.fromhex(api_key_hash))
+        if record is None or record[2] != STATUS_ACTIVE:
+            self.misses += 1
+            return None
+        project_id = UUID(bytes=record[1])
+        if index_invalidations and (
+            index_invalidations.get(api_key_hash, 0) >= mapped.built_at
+            or index_invalidations.get(project_id, 0) >= mapped.built_at
+        ):
+            self.misses += 1
+            return None
+        self.hits += 1
+        _, _, _, timeout_ms, burst, per_second = record
+        return models.Project(
+            id=project_id,
+            api_key_hash=api_key_hash,
+            charge_timeout_ms=None if timeout_ms < 0 else timeout_ms,
+            rate_limit_per_second=None if math.isnan(per_second) else per_second,
+            rate_limit_burst=None if burst < 0 else burst,
+        )
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        # map whatever the other workers built, so this one starts warm
+        self._reload()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._lock_file is not None:
+            # closing the file releases the flock, another worker takes over
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self) -> dict:
+        mapped = self._mapped
+        return {
+            "enabled": self.enabled,
+            "leader": self.leader,
+            "entries": mapped.count if mapped is not None else 0,
+            "built_at": mapped.built_at if mapped is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+        }
+
+    async def rebuild(self) -> None:
+        built_at = time.time()
+        async with ReadSessionLocal() as db:
+            # invalidations older than built_at are dropped once this file is loaded, so it must not miss any
+            # change committed before it, which a lagging replica could
+            with on_primary(db):
+                rows = await crud.get_api_key_index_rows(db)
+        await asyncio.to_thread(self._write, build_index(rows, built_at))
+        self.rebuilds += 1
+
+    def _write(self, data: bytes) -> None:
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+        os.replace(temporary, self.path)
+
+    def _try_lead(self) -> bool:
+        lock_file = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _reload(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        current = self._mapped
+        if current is not None and (stat.st_ino, stat.st_mtime_ns) == (
+            current.stat.st_ino,
+            current.stat.st_mtime_ns,
+        ):
+            return
+        try:
+            mapped = _Mapped(self.path)
+        except (OSError, ValueError):
+            logger.exception("Could not load the API key index")
+            return
+        self._mapped = mapped
+        # invalidations older than the new index are reflected in it
+        for key, invalidated_at in list(index_invalidations.items()):
+            if invalidated_at < mapped.built_at:
+                index_invalidations.pop(key, None)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        rebuild_at = loop.time()
+        while True:
+            if self.leader or self._try_lead():
+                if loop.time() >= rebuild_at:
+                    try:
+                        await self.rebuild()
+                    except Exception:
+                        logger.exception("Could not rebuild the API key index")
+                    rebuild_at = loop.time() + settings.API_KEY_INDEX_REFRESH_SECONDS
+            self._reload()
+            await asyncio.sleep(settings.API_KEY_INDEX_CHECK_SECONDS)
+
+
+api_key_index = ApiKeyIndex()
@@ -0,0 +1,27 @@
+import hashlib
+from secrets import token_urlsafe
+
+
+API_KEY_PREFIX_LENGTH = 8
+
+
+def generate_api_key() -> str:
+    """
+    Generates a new random API key. only its digest and prefix are ever stored.
+    """
+    return token_urlsafe(32)  # 32 random bytes, ~43 url-safe chars
+
+
+def hash_api_key(api_key: str) -> str:
+    """
+    Returns the fixed-width (64 hex chars) SHA-256 digest of an API key, which is what we store and index.
+    keys are 256 bits of randomness, so a fast unsalted hash is fine here, unlike passwords.
+    """
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def api_key_prefix(api_key: str) -> str:
+    """
+    Returns the short public prefix of an API key, used to identify a key in dashboards and logs.
+    """
+    return api_key[:API_KEY_PREFIX_LENGTH]
@@ -1,5 +1,6 @@
 from sqlalchemy.orm import relationship, mapped_column, Mapped
-from sqlalchemy import String, Text, DateTime, UUID, ForeignKey, Boolean
+import json
+from sqlalchemy import String, Text, DateTime, UUID, ForeignKey, Boolean, Integer, Float
 from datetime import datetime
 from app.core.database import Base
 from uuid import uuid4
@@ -14,6 +15,20 @@ class Project(Base):
     )
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     description: Mapped[str] = mapped_column(Text, nullable=True)
+    # the user the project belongs to, empty for projects created before projects had owners
+    user_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("users.id"), nullable=True, index=True
+    )
+    # we never store the raw API key, only its sha256 digest (unique index, used for lookups) and a short public prefix
+    api_key_hash: Mapped[str] = mapped_column(
+        String(64), nullable=False, unique=True, index=True
+    )
+    api_key_prefix: Mapped[str] = mapped_column(String(8), nullable=False)
+    # default time budget of a charge for this project, falls back to CHARGE_DEFAULT_TIMEOUT_MS when empty
+    charge_timeout_ms: Mapped[int] = mapped_column(Integer, nullable=True)
+    # request rate limits of this project's API key, RATE_LIMIT_PER_SECOND / RATE_LIMIT_BURST when empty
+    rate_limit_per_second: Mapped[float] = mapped_column(Float, nullable=True)
+    rate_limit_burst: Mapped[int] = mapped_column(Integer, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
     updated_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.now, onupdate=datetime.now
@@ -37,6 +52,8 @@ class ProviderConfig(Base):
     is_primary: Mapped[bool] = mapped_column(
         Boolean, default=False
     )  # indicates if this is the primary provider for the project. when the payment comes to the project, this will decide which provider to use first. other providers can be used as fallback options.
+    # order of the fallback providers, lower number means tried earlier
+    priority: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
 
     # commented out the following fields coz doesn't seem needed for now
     # created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
@@ -45,3 +62,9 @@ class ProviderConfig(Base):
     # )
 
     project = relationship("Project", back_populates="provider_configs")
+
+    def decoded_credentials(self) -> dict:
+        """
+        Returns the provider credentials as a dict, they are stored json encoded.
+        """
+        return json.loads(self.credentials)
@@ -3,10 +3,11 @@ from typing import List
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core import dependencies
+from app.core.pagination import PageParams, set_next_cursor
 from app.users import models as user_models
-from . import crud, schema
+from . import crud, models, schema
 
-router = APIRouter()
+router = APIRouter(route_class=dependencies.ReleaseSessionRoute)
 
 
 @router.post("/", response_model=schema.Project)
@@ -18,7 +19,9 @@ async def create_project(
     """
     Create a new project for the current authenticated user.
     """
-    return await crud.create_project(db=db, project=project, user_id=current_user.id)
+    return schema.project_serializer.response(
+        await crud.create_project(db=db, project_data=project, user_id=current_user.id)
+    )
 
 
 @router.post("/{project_id}/providers/", response_model=schema.ProviderConfig)
@@ -33,23 +36,54 @@ async def create_provider_config_for_project(
     """
     # Note: In a real application, you would add a check here to ensure
     # the current_user actually owns the project with project_id.
-    return await crud.create_provider_config(
-        db=db, config=config, project_id=project_id
+    return schema.provider_config_serializer.response(
+        await crud.create_provider_config(
+            db=db, provider_data=config, project_id=project_id
+        )
     )
 
 
 @router.get("/{project_id}/providers/", response_model=List[schema.ProviderConfig])
 async def read_provider_configs_for_project(
     project_id: uuid.UUID,
-    db: AsyncSession = Depends(dependencies.get_db),
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(dependencies.get_read_db),
     current_user: user_models.User = Depends(dependencies.get_current_active_user),
 ):
     """
-    Retrieve all provider configurations for one of the user's projects.
+    Retrieve the provider configurations of one of the user's projects, by priority. charges try the primary one first,
+    then the others in this order.
+    Paginated, the X-Next-Cursor response header is the cursor of the next page.
     """
     project = await crud.get_project_by_id(db=db, project_id=project_id)
     if not project or project.user_id != current_user.id:
         raise HTTPException(
             status_code=403, detail="Not authorized to access this project"
         )
-    return await crud.get_provider_configs_for_project(db=db, project_id=project_id)
+    configs, next_cursor = await crud.list_provider_configs_for_project(
+        db=db, project_id=project_id, page=page
+    )
+    response = schema.provider_configs_serializer.response(configs)
+    set_next_cursor(response, next_cursor)
+    return response
+
+
+@router.post("/{project_id}/api-key/rotate", response_model=schema.Project)
+async def rotate_project_api_key(
+    project_id: uuid.UUID,
+    db: AsyncSession = Depends(dependencies.get_db),
+    current_user: user_models.User = Depends(dependencies.get_current_active_user),
+):
+    """
+    Replace the API key of one of the user's projects. the old key stops working right away, the new one is only
+    ever shown in this response.
+    """
+    # loaded by this session rather than through the coalesced get_project_by_id, as it gets modified
+    project = await db.get(models.Project, project_id)
+    if not project or project.user_id != current_user.id:
+        raise HTTPException(
+            status_code=403, detail="Not authorized to access this project"
+        )
+    return schema.project_serializer.response(
+        await crud.rotate_api_key(db=db, project=project)
+    )
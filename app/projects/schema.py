@@ -1,6 +1,8 @@
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import AliasChoices, BaseModel, Field
+from typing import Optional
 from uuid import UUID
+from app.core.responses import Serializer
 
 
 # Provider config schemas
@@ -40,8 +42,19 @@ class ProjectCreate(ProjectBase):
 
 
 class Project(ProjectBase):
-    api_key: str
+    # called name and id on the model
+    project_name: str = Field(validation_alias=AliasChoices("project_name", "name"))
+    project_id: UUID = Field(validation_alias=AliasChoices("project_id", "id"))
+    api_key_prefix: str
+    # plaintext key, only set in the response that creates or rotates it
+    api_key: Optional[str] = None
     provider_config: list[ProviderConfig] = []
 
     class Config:
         from_attributes = True
+
+
+# prebuilt serializers of the response schemas, see app.core.responses.Serializer
+project_serializer = Serializer(Project)
+provider_config_serializer = Serializer(ProviderConfig)
+provider_configs_serializer = Serializer(list[ProviderConfig])
@@ -0,0 +1,246 @@
+import asyncio
+import time
+import httpx
+from app.core.metrics import Counter, Histogram
+from app.payments import schema
+from .normalizers import normalize
+
+provider_request_seconds = Histogram(
+    "provider_request_seconds",
+    "Latency of http calls to payment providers, per provider and operation",
+)
+provider_requests_total = Counter(
+    "provider_requests_total",
+    "Http calls to payment providers by outcome (ok, rejected, failed, error, cancelled)",
+)
+
+
+class ProviderError(Exception):
+    """
+    Raised when a provider call fails. `retryable` tells the failover logic whether trying the next provider makes sense
+    (outages, timeouts, rate limits) or not (the charge itself was rejected, e.g. invalid request).
+    """
+
+    def __init__(
+        self,
+        provider_name: str,
+        message: str,
+        status_code: int | None = None,
+        retryable: bool = True,
+    ):
+        super().__init__(f"{provider_name}: {message}")
+        self.provider_name = provider_name
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+def _raise_for_response(provider_name: str, response: httpx.Response) -> None:
+    if response.status_code < 400:
+        return
+    retryable = response.status_code >= 500 or response.status_code in (408, 429)
+    raise ProviderError(
+        provider_name,
+        f"HTTP {response.status_code}",
+        status_code=response.status_code,
+        retryable=retryable,
+    )
+
+
+def _outcome(status_code: int) -> str:
+    if status_code < 400:
+        return "ok"
+    # 4xx: the provider is fine but refused the call, 5xx: the provider itself failed
+    return "rejected" if status_code < 500 else "failed"
+
+
+async def _send(
+    provider_name: str,
+    operation: str,
+    client: httpx.AsyncClient,
+    request: httpx.Request,
+    auth: httpx.Auth | tuple[str, str] | None = None,
+) -> httpx.Response:
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response = await client.send(request, auth=auth)
+        outcome = _outcome(response.status_code)
+    except httpx.HTTPError as exc:
+        # timeouts and connection errors, the next provider might well work
+        raise ProviderError(provider_name, f"{type(exc).__name__}: {exc}") from exc
+    except asyncio.CancelledError:
+        # the charge's deadline ran out, or it lost a hedge
+        outcome = "cancelled"
+        raise
+    finally:
+        provider_request_seconds.observe(
+            time.perf_counter() - start, provider=provider_name, operation=operation
+        )
+        provider_requests_total.inc(
+            provider=provider_name, operation=operation, outcome=outcome
+        )
+    _raise_for_response(provider_name, response)
+    return response
+
+
+def _normalize(provider_name: str, response: httpx.Response) -> schema.ProviderCharge:
+    try:
+        provider_charge = normalize(provider_name, response.content)
+    except ValueError as exc:
+        # the provider answered with a success status, so the charge may well exist there. trying another
+        # provider could charge the customer twice
+        raise ProviderError(provider_name, str(exc), retryable=False) from exc
+    if provider_charge.status == "failed":
+        # a 200 carrying a declined (or canceled) charge is a rejection like a 4xx, not a success
+        raise ProviderError(
+            provider_name,
+            f"charge {provider_charge.provider_payment_id} declined",
+            status_code=response.status_code,
+            retryable=False,
+        )
+    return provider_charge
+
+
+class Provider:
+    """
+    Base class of a payment provider integration. subclasses turn a ChargeRequest into the provider's api call.
+    """
+
+    name: str
+
+    async def charge(
+        self,
+        client: httpx.AsyncClient,
+        credentials: dict,
+        charge: schema.ChargeRequest,
+        reference: str,
+        capture: bool = True,
+    ) -> schema.ProviderCharge:
+        """
+        Creates the charge. `reference` is unique per charge and is sent as the provider's idempotency key,
+        so repeating a call for the same charge can never create a second payment.
+        with `capture` off the payment is only authorized, and `capture()` has to be called for the money to move.
+        """
+        raise NotImplementedError
+
+    async def capture(
+        self,
+        client: httpx.AsyncClient,
+        credentials: dict,
+        provider_charge: schema.ProviderCharge,
+    ) -> schema.ProviderCharge:
+        """
+        Captures a charge created with `capture` off, and returns it as it stands afterwards.
+        """
+        raise NotImplementedError
+
+    async def void(
+        self,
+        client: httpx.AsyncClient,
+        credentials: dict,
+        provider_charge: schema.ProviderCharge,
+    ) -> None:
+        """
+        Cancels (or refunds, if it was already captured) a charge we ended up not using, e.g. the losing side of a hedge.
+        cancelling an authorization releases the hold on the customer's funds.
+        """
+        raise NotImplementedError
+
+
+class StripeProvider(Provider):
+    name = "stripe"
+
+    async def charge(self, client, credentials, charge, reference, capture=True):
+        data = {
+            "amount": charge.amount,
+            "currency": charge.currency.lower(),
+            "confirm": "true",
+        }
+        if not capture:
+            # authorize only, the intent waits in requires_capture
+            data["capture_method"] = "manual"
+        if charge.payment_method:
+            data["payment_method"] = charge.payment_method
+        if charge.description:
+            data["description"] = charge.description
+        request = client.build_request(
+            "POST",
+            "/v1/payment_intents",
+            data=data,
+            headers={
+                "Authorization": f"Bearer {credentials['secret_key']}",
+                "Idempotency-Key": reference,
+            },
+        )
+        response = await _send(self.name, "charge", client, request)
+        return _normalize(self.name, response)
+
+    async def capture(self, client, credentials, provider_charge):
+        request = client.build_request(
+            "POST",
+            f"/v1/payment_intents/{provider_charge.provider_payment_id}/capture",
+            headers={"Authorization": f"Bearer {credentials['secret_key']}"},
+        )
+        response = await _send(self.name, "capture", client, request)
+        return _normalize(self.name, response)
+
+    async def void(self, client, credentials, provider_charge):
+        headers = {"Authorization": f"Bearer {credentials['secret_key']}"}
+        if provider_charge.status == "succeeded":
+            request = client.build_request(
+                "POST",
+                "/v1/refunds",
+                data={"payment_intent": provider_charge.provider_payment_id},
+                headers=headers,
+            )
+        else:
+            request = client.build_request(
+                "POST",
+                f"/v1/payment_intents/{provider_charge.provider_payment_id}/cancel",
+                headers=headers,
+            )
+        await _send(self.name, "void", client, request)
+
+
+class RazorpayProvider(Provider):
+    name = "razorpay"
+
+    async def charge(self, client, credentials, charge, reference, capture=True):
+        # razorpay dedupes orders on the receipt. an order moves no money until the customer pays it, so there is
+        # nothing to authorize separately
+        payload = {
+            "amount": charge.amount,
+            "currency": charge.currency.upper(),
+            "receipt": reference,
+        }
+        if charge.description:
+            payload["notes"] = {"description": charge.description}
+        request = client.build_request(
+            "POST",
+            "/v1/orders",
+            json=payload,
+        )
+        auth = (credentials["key_id"], credentials["key_secret"])
+        response = await _send(self.name, "charge", client, request, auth=auth)
+        return _normalize(self.name, response)
+
+    async def capture(self, client, credentials, provider_charge):
+        return provider_charge
+
+    async def void(self, client, credentials, provider_charge):
+        # an order doesn't move any money by itself, unpaid orders simply expire on razorpay's side
+        return None
+
+
+PROVIDERS: dict[str, Provider] = {
+    provider.name: provider for provider in (StripeProvider(), RazorpayProvider())
+}
+
+
+def get_provider(provider_name: str) -> Provider:
+    try:
+        return PROVIDERS[provider_name]
+    except KeyError:
+        raise ProviderError(
+            provider_name, "unsupported provider", retryable=True
+        ) from None
@@ -0,0 +1,74 @@
+import importlib.util
+import logging
+from typing import Optional
+import httpx
+from app.core.config import settings, ProviderHTTPSettings
+from .adapters import ProviderError
+
+logger = logging.getLogger(__name__)
+
+
+def _build_client(
+    config: ProviderHTTPSettings, transport: Optional[httpx.AsyncBaseTransport]
+) -> httpx.AsyncClient:
+    http2 = config.http2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning(
+            "http2 requested but the `h2` package is missing, using http/1.1"
+        )
+        http2 = False
+    return httpx.AsyncClient(
+        base_url=config.base_url,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(
+            connect=config.connect_timeout,
+            read=config.read_timeout,
+            write=config.write_timeout,
+            pool=config.pool_timeout,
+        ),
+        transport=transport,
+    )
+
+
+class ProviderClients:
+    """
+    Holds one long lived httpx.AsyncClient per payment provider, so connections (and their TLS sessions)
+    to a provider are kept alive and reused across requests instead of being set up per charge.
+    """
+
+    def __init__(self):
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    def start(
+        self,
+        providers: Optional[dict[str, ProviderHTTPSettings]] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        """
+        Creates the clients. `transport` replaces the network for every client, e.g. a httpx.MockTransport in tests.
+        """
+        providers = settings.PROVIDER_HTTP if providers is None else providers
+        for name, config in providers.items():
+            self._clients[name] = _build_client(config, transport)
+
+    def get(self, provider_name: str) -> httpx.AsyncClient:
+        """
+        Raises a (retryable) ProviderError for providers without a client, so failover moves on to the next one.
+        """
+        try:
+            return self._clients[provider_name]
+        except KeyError:
+            raise ProviderError(provider_name, "no http client configured") from None
+
+    async def aclose(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+provider_clients = ProviderClients()
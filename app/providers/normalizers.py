@@ -0,0 +1,83 @@
+from typing import Annotated, Callable
+from pydantic import (
+    AfterValidator,
+    BeforeValidator,
+    ConfigDict,
+    Field,
+    TypeAdapter,
+    ValidationError,
+)
+from app.payments import schema
+
+# turns the raw body of a provider's charge response into our unified ProviderCharge
+Normalizer = Callable[[bytes], schema.ProviderCharge]
+
+STRIPE_STATUSES = {
+    "succeeded": "succeeded",
+    "processing": "pending",
+    "requires_capture": "pending",
+    "requires_action": "pending",
+    "requires_confirmation": "pending",
+}
+RAZORPAY_STATUSES = {
+    "captured": "succeeded",
+    "paid": "succeeded",
+    "authorized": "pending",
+    "created": "pending",
+    "attempted": "pending",
+}
+
+
+def _status(mapping: dict[str, str]):
+    return BeforeValidator(lambda value: mapping.get(value, "failed"))
+
+
+# the provider shapes below are ProviderCharge subclasses whose fields read straight from the provider's json keys.
+# pydantic-core parses the raw bytes into them in one pass, without building a dict first or a second model after
+
+
+class _StripeCharge(schema.ProviderCharge):
+    model_config = ConfigDict(extra="ignore")
+
+    provider_name: str = "stripe"
+    provider_payment_id: str = Field(validation_alias="id")
+    status: Annotated[str, _status(STRIPE_STATUSES)]
+    currency: Annotated[str, AfterValidator(str.upper)]
+
+
+class _RazorpayCharge(schema.ProviderCharge):
+    model_config = ConfigDict(extra="ignore")
+
+    provider_name: str = "razorpay"
+    provider_payment_id: str = Field(validation_alias="id")
+    status: Annotated[str, _status(RAZORPAY_STATUSES)]
+    currency: Annotated[str, AfterValidator(str.upper)]
+
+
+NORMALIZERS: dict[str, Normalizer] = {
+    "stripe": TypeAdapter(_StripeCharge).validate_json,
+    "razorpay": TypeAdapter(_RazorpayCharge).validate_json,
+}
+
+
+def register_normalizer(provider_name: str, normalizer: Normalizer) -> None:
+    """
+    Registers the normalizer of a provider. anything taking the raw body and returning a ProviderCharge works,
+    a prebuilt TypeAdapter's validate_json or a hand written parser.
+    """
+    NORMALIZERS[provider_name] = normalizer
+
+
+def normalize(provider_name: str, body: bytes) -> schema.ProviderCharge:
+    """
+    Parses a provider's raw charge response into the unified ProviderCharge.
+    Raises ValueError if the body isn't a valid charge response of that provider.
+    """
+    try:
+        return NORMALIZERS[provider_name](body)
+    except KeyError:
+        raise ValueError(f"No normalizer registered for {provider_name!r}") from None
+    except ValidationError as exc:
+        raise ValueError(
+            f"Invalid {provider_name} response: {exc.error_count()} errors"
+        ) from exc
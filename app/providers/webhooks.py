@@ -0,0 +1,166 @@
+import hashlib
+import hmac
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Mapping, Optional
+
+
+class InvalidSignature(Exception):
+    """
+    Raised when a webhook's signature doesn't match its body (or is missing, or too old).
+    """
+
+
+@dataclass(frozen=True, slots=True)
+class WebhookEvent:
+    """
+    A provider webhook reduced to what we do with it: the new status of one of the provider's payments.
+    """
+
+    provider_name: str
+    # the provider's id of the event, providers deliver the same event more than once
+    event_id: str
+    # matches Transaction.provider_payment_id
+    provider_payment_id: str
+    status: str
+    # when the provider says it happened, events are applied in this order
+    occurred_at: datetime
+
+
+class WebhookHandler:
+    """
+    Base class of a provider's webhook format. subclasses check the signature and pick the status change out of the body.
+    """
+
+    name: str
+
+    def parse(
+        self, body: bytes, headers: Mapping[str, str], secret: str
+    ) -> Optional[WebhookEvent]:
+        """
+        Verifies and parses a webhook. returns None for event types we don't act on.
+        Raises InvalidSignature if it isn't authentic, ValueError if the body can't be understood.
+        """
+        raise NotImplementedError
+
+
+def _load(body: bytes) -> dict:
+    try:
+        payload = json.loads(body)
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"Invalid webhook body: {exc}") from exc
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid webhook body: not an object")
+    return payload
+
+
+def _signature_matches(secret: str, message: bytes, signature: str) -> bool:
+    expected = hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class StripeWebhook(WebhookHandler):
+    name = "stripe"
+    # signed timestamps older (or newer) than this are rejected, so a captured webhook can't be replayed later
+    tolerance_seconds = 300
+
+    # event type -> (our status, key of the payment intent id in the event's object)
+    EVENTS = {
+        "payment_intent.succeeded": ("succeeded", "id"),
+        "payment_intent.processing": ("pending", "id"),
+        "payment_intent.payment_failed": ("failed", "id"),
+        "payment_intent.canceled": ("canceled", "id"),
+        "charge.refunded": ("refunded", "payment_intent"),
+        "charge.dispute.created": ("disputed", "payment_intent"),
+    }
+
+    def parse(self, body, headers, secret):
+        # Stripe-Signature: t=<unix time>,v1=<hex hmac of "<t>.<body>">[,v1=...]
+        timestamp = None
+        signatures = []
+        for part in headers.get("stripe-signature", "").split(","):
+            key, _, value = part.strip().partition("=")
+            if key == "t":
+                timestamp = value
+            elif key == "v1":
+                signatures.append(value)
+        if timestamp is None or not timestamp.isdigit() or not signatures:
+            raise InvalidSignature("Missing or malformed Stripe-Signature header")
+        if abs(time.time() - int(timestamp)) > self.tolerance_seconds:
+            raise InvalidSignature("Webhook timestamp outside the tolerance")
+        message = timestamp.encode() + b"." + body
+        if not any(_signature_matches(secret, message, sig) for sig in signatures):
+            raise InvalidSignature("Signature mismatch")
+
+        payload = _load(body)
+        mapping = self.EVENTS.get(payload.get("type"))
+        if mapping is None:
+            return None
+        status, id_key = mapping
+        try:
+            return WebhookEvent(
+                provider_name=self.name,
+                event_id=payload["id"],
+                provider_payment_id=payload["data"]["object"][id_key],
+                status=status,
+                occurred_at=datetime.fromtimestamp(payload["created"]),
+            )
+        except (KeyError, TypeError) as exc:
+            raise ValueError(f"Invalid stripe event: missing {exc}") from exc
+
+
+class RazorpayWebhook(WebhookHandler):
+    name = "razorpay"
+
+    # event type -> our status. charges are razorpay orders, so every event is tied back to its order id
+    EVENTS = {
+        "order.paid": "succeeded",
+        "payment.captured": "succeeded",
+        "payment.failed": "failed",
+        "refund.processed": "refunded",
+        "payment.dispute.created": "disputed",
+    }
+
+    def parse(self, body, headers, secret):
+        # X-Razorpay-Signature: hex hmac of the body
+        signature = headers.get("x-razorpay-signature")
+        if not signature:
+            raise InvalidSignature("Missing X-Razorpay-Signature header")
+        if not _signature_matches(secret, body, signature):
+            raise InvalidSignature("Signature mismatch")
+
+        payload = _load(body)
+        status = self.EVENTS.get(payload.get("event"))
+        if status is None:
+            return None
+        try:
+            entities = payload["payload"]
+            if "order" in entities:
+                order_id = entities["order"]["entity"]["id"]
+            else:
+                order_id = entities["payment"]["entity"]["order_id"]
+            occurred_at = datetime.fromtimestamp(payload["created_at"])
+        except (KeyError, TypeError) as exc:
+            raise ValueError(f"Invalid razorpay event: missing {exc}") from exc
+        # razorpay sends the event id as a header only. fall back to the body, redeliveries are byte for byte the same
+        event_id = (
+            headers.get("x-razorpay-event-id") or hashlib.sha256(body).hexdigest()
+        )
+        return WebhookEvent(
+            provider_name=self.name,
+            event_id=event_id,
+            provider_payment_id=order_id,
+            status=status,
+            occurred_at=occurred_at,
+        )
+
+
+WEBHOOK_HANDLERS: dict[str, WebhookHandler] = {
+    handler.name: handler for handler in (StripeWebhook(), RazorpayWebhook())
+}
+
+
+def get_webhook_handler(provider_name: str) -> Optional[WebhookHandler]:
+    return WEBHOOK_HANDLERS.get(provider_name)
@@ -0,0 +1,10 @@
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+
+# username -> User cache for authenticated reads. every worker has its own and nothing invalidates it, so a user
+# deactivated in the database keeps passing get_current_active_user for up to USER_CACHE_TTL_SECONDS
+user_cache = TTLCache(
+    maxsize=settings.USER_CACHE_MAXSIZE,
+    ttl=settings.USER_CACHE_TTL_SECONDS,
+)
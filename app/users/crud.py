@@ -1,9 +1,13 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from . import models, schema
-from app.core.security import get_password_hash
+from app.core.passwords import get_password_hash_async
+from app.core.cache import MISSING
+from app.core.singleflight import singleflight
+from .cache import user_cache
 
 
+@singleflight
 async def get_user_by_username(db: AsyncSession, username: str):
     result = await db.execute(
         select(models.User).filter(models.User.username == username)
@@ -11,8 +15,21 @@ async def get_user_by_username(db: AsyncSession, username: str):
     return result.scalars().first()
 
 
+async def get_user_by_username_cached(db: AsyncSession, username: str):
+    """
+    Same as get_user_by_username, but served from the user cache when possible.
+    only meant for authenticated reads, login always goes to the database.
+    """
+    user = user_cache.get(username)
+    if user is MISSING:
+        user = await get_user_by_username(db, username=username)
+        if user is not None:
+            user_cache.set(username, user)
+    return user
+
+
 async def create_user(db: AsyncSession, user: schema.UserCreate):
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     db_user = models.User(username=user.username, hashed_password=hashed_password)
     db.add(db_user)
     await db.commit()
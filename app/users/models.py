@@ -1,6 +1,6 @@
 from app.core.database import Base
 from sqlalchemy import Integer, String, Boolean
-from sqlalchemy.orm import relationship, Mapped, mapped_column
+from sqlalchemy.orm import Mapped, mapped_column
 
 
 class User(Base):
@@ -14,5 +14,3 @@ class User(Base):
     is_active: Mapped[bool] = mapped_column(
         Boolean, default=True
     )  # indicates if the user is active
-
-    records = relationship("Records", back_populates="owner")
@@ -4,11 +4,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from . import crud, schema  # NOQA
 from app.core import security
-from app.core.dependencies import get_db
+from app.core.dependencies import ReleaseSessionRoute, get_db, get_read_db
 from ..core.config import settings  # NOQA
 
 
-router = APIRouter()
+router = APIRouter(route_class=ReleaseSessionRoute)
 
 
 @router.post("/users/", response_model=schema.User, status_code=status.HTTP_201_CREATED)
@@ -22,7 +22,10 @@ async def create_user(user: schema.UserCreate, db: AsyncSession = Depends(get_db
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered",
         )
-    return await crud.create_user(db=db, user=user)
+    return schema.user_serializer.response(
+        await crud.create_user(db=db, user=user),
+        status_code=status.HTTP_201_CREATED,
+    )
 
 
 # @router.post("/token", response_model=schema.Token)
@@ -50,21 +53,21 @@ async def create_user(user: schema.UserCreate, db: AsyncSession = Depends(get_db
 @router.get("/users/me/", response_model=schema.User)
 async def read_users_me(
     current_user: schema.User = Depends(security.get_current_active_user),
-) -> schema.User:
+):
     """
     Fetch the current logged in user asynchronously.
     """
-    return current_user
+    return schema.user_serializer.response(current_user)
 
 
-router = APIRouter()
+router = APIRouter(route_class=ReleaseSessionRoute)
 
 
 @router.post("/login/token")
 async def login_for_access_token(
     response: Response,  # 1. Inject the Response object
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     # ... (user authentication logic remains the same)
     user = await security.authenticate_user(
@@ -98,7 +101,7 @@ async def login_for_access_token(
 async def refresh_token(
     response: Response,
     refresh_token: str = Cookie(None),  # Extract refresh_token from cookies
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """
     Use the refresh token to get a new access token.
@@ -1,6 +1,7 @@
 from pydantic import BaseModel
 from typing import Optional
 from uuid import UUID
+from app.core.responses import Serializer
 
 
 # schema for the JWT token response when a user logs in
@@ -34,3 +35,7 @@ class User(UserBase):
     class Config:
         from_attributes = True
         # we use from_attributes only in the case when we need to create pydantic models using database objects directly, instead of dicts
+
+
+# prebuilt serializers of the response schemas, see app.core.responses.Serializer
+user_serializer = Serializer(User)
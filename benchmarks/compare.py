@@ -0,0 +1,50 @@
+"""
+Compares two benchmark result files written by benchmarks.harness, e.g. from before and after a change:
+
+    python -m benchmarks.compare base.json new.json
+"""
+
+import argparse
+import json
+
+METRICS = (
+    ("throughput_rps", lambda result: result["throughput_rps"]),
+    ("p50_ms", lambda result: result["latency_ms"]["p50"]),
+    ("p95_ms", lambda result: result["latency_ms"]["p95"]),
+    ("p99_ms", lambda result: result["latency_ms"]["p99"]),
+    ("errors", lambda result: result["errors"]),
+)
+
+
+def _change(base: float, new: float) -> str:
+    if not base:
+        return "n/a"
+    return f"{(new - base) / base * 100:+.1f}%"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("new")
+    args = parser.parse_args()
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+
+    print(f"base {base['meta']['commit']}  new {new['meta']['commit']}")
+    if base["meta"]["config"] != new["meta"]["config"]:
+        print("warning: the runs used different settings, see meta.config")
+    print(f"{'scenario':<18} {'metric':<15} {'base':>12} {'new':>12} {'change':>9}")
+    for name in sorted(base["scenarios"].keys() & new["scenarios"].keys()):
+        for metric, read in METRICS:
+            old_value = read(base["scenarios"][name])
+            new_value = read(new["scenarios"][name])
+            print(
+                f"{name:<18} {metric:<15} {old_value:>12.2f} {new_value:>12.2f}"
+                f" {_change(old_value, new_value):>9}"
+            )
+
+
+if __name__ == "__main__":
+    main()
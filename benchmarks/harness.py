@@ -0,0 +1,319 @@
+"""
+End to end load and latency benchmark of the API, with the app running in process against a real postgres and the
+payment providers simulated. see benchmarks/README.md. run from the repo root:
+
+    python -m benchmarks.harness --duration 10 --concurrency 50 --out results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from uuid import uuid4
+import httpx
+from .mock_providers import MockProviders, ProviderBehaviour
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+SCENARIOS = ("auth", "login", "provider_configs", "charge")
+PASSWORD = "benchmark-password"
+
+# an operation returns the http status it got
+Operation = Callable[[], Awaitable[int]]
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """
+    Nearest rank percentile, q in 0..100.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(q / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies_ms: list[float], statuses: Counter, elapsed: float) -> dict:
+    latencies_ms = sorted(latencies_ms)
+    count = len(latencies_ms)
+    return {
+        "requests": count,
+        "errors": sum(n for code, n in statuses.items() if code >= 400),
+        "status_codes": {str(code): n for code, n in sorted(statuses.items())},
+        "duration_seconds": round(elapsed, 3),
+        "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies_ms) / count, 3) if count else 0.0,
+            "p50": round(percentile(latencies_ms, 50), 3),
+            "p95": round(percentile(latencies_ms, 95), 3),
+            "p99": round(percentile(latencies_ms, 99), 3),
+            "max": round(latencies_ms[-1], 3) if count else 0.0,
+        },
+    }
+
+
+async def run_scenario(
+    operation: Operation, concurrency: int, duration: float, warmup: float
+) -> dict:
+    """
+    Runs `operation` in a closed loop from `concurrency` workers. only requests started after the warmup are counted.
+    """
+    loop = asyncio.get_running_loop()
+    measure_from = loop.time() + warmup
+    end = measure_from + duration
+    latencies_ms: list[float] = []
+    statuses: Counter = Counter()
+
+    async def worker() -> None:
+        while loop.time() < end:
+            started = loop.time()
+            start = time.perf_counter()
+            try:
+                status_code = await operation()
+            except Exception:
+                # counted apart from http errors, e.g. a crashed dependency
+                status_code = 599
+            if started >= measure_from:
+                latencies_ms.append((time.perf_counter() - start) * 1000)
+                statuses[status_code] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies_ms, statuses, loop.time() - measure_from)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _seed() -> dict:
+    """
+    Creates a user, and a project with stripe as primary and razorpay as fallback provider.
+    """
+    from app.core.database import AsyncSessionLocal
+    from app.core.passwords import get_password_hash_async
+    from app.projects import crud as project_crud, schema as project_schema
+    from app.users import models as user_models
+
+    tag = uuid4().hex[:12]
+    now = datetime.now()
+    async with AsyncSessionLocal() as db:
+        user = user_models.User(
+            username=f"bench-{tag}",
+            email=f"bench-{tag}@example.com",
+            hashed_password=await get_password_hash_async(PASSWORD),
+        )
+        db.add(user)
+        await db.commit()
+        project = await project_crud.create_project(
+            db,
+            project_schema.ProjectCreate(
+                project_name=f"bench-{tag}",
+                project_id=uuid4(),
+                created_at=now,
+                updated_at=now,
+            ),
+            user_id=user.id,
+        )
+        for priority, (provider_name, credentials) in enumerate(
+            (
+                ("stripe", {"secret_key": "sk_test_benchmark"}),
+                ("razorpay", {"key_id": "rzp_test", "key_secret": "benchmark"}),
+            )
+        ):
+            await project_crud.create_provider_config(
+                db,
+                project.id,
+                project_schema.ProviderConfigCreate(
+                    provider_name=provider_name,
+                    is_primary=priority == 0,
+                    priority=priority,
+                    credentials=credentials,
+                ),
+            )
+    return {
+        "username": user.username,
+        "project_id": project.id,
+        "api_key": project.api_key,
+    }
+
+
+def _operations(client: httpx.AsyncClient, seed: dict) -> dict[str, Operation]:
+    from app.core.security import create_access_token
+
+    api_headers = {"api-key": seed["api_key"]}
+    # the dashboard routes read the JWT from the access_token cookie, which login would set
+    access_token = create_access_token({"sub": seed["username"]}, timedelta(hours=1))
+    dashboard_headers = {"Cookie": f"access_token={access_token}"}
+
+    async def auth() -> int:
+        return (await client.get("/bench/auth", headers=api_headers)).status_code
+
+    async def login() -> int:
+        response = await client.post(
+            "/login/token",
+            data={"username": seed["username"], "password": PASSWORD},
+        )
+        return response.status_code
+
+    async def provider_configs() -> int:
+        response = await client.get(
+            f"/projects/{seed['project_id']}/providers/", headers=dashboard_headers
+        )
+        return response.status_code
+
+    async def charge() -> int:
+        response = await client.post(
+            "/payments/charge",
+            headers=api_headers,
+            json={"amount": 1000, "currency": "USD", "description": "benchmark"},
+        )
+        return response.status_code
+
+    return {
+        "auth": auth,
+        "login": login,
+        "provider_configs": provider_configs,
+        "charge": charge,
+    }
+
+
+def _mount_probe(app) -> None:
+    from fastapi import APIRouter, Depends
+    from app.core import dependencies
+
+    router = APIRouter()
+
+    # the api key dependency on its own, every other api key route does more work after it
+    @router.get("/bench/auth")
+    async def bench_auth(
+        project=Depends(dependencies.get_project_from_api_key),
+    ):
+        return {"project_id": str(project.id)}
+
+    app.include_router(router)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from app.main import app
+    from app.core.config import settings
+    from app.providers.clients import provider_clients
+
+    settings.RATE_LIMIT_ENABLED = args.rate_limit
+    default = ProviderBehaviour(
+        latency_ms=args.provider_latency_ms,
+        jitter_ms=args.provider_jitter_ms,
+        error_rate=args.provider_error_rate,
+    )
+    mocks = MockProviders(
+        behaviours={
+            "stripe": ProviderBehaviour.parse(args.stripe, default),
+            "razorpay": ProviderBehaviour.parse(args.razorpay, default),
+        },
+        seed=args.seed,
+    )
+    _mount_probe(app)
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        # the app's startup opened real provider clients, swap them for the simulated providers
+        await provider_clients.aclose()
+        provider_clients.start(transport=mocks.transport())
+        seed = await _seed()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark"
+        ) as client:
+            operations = _operations(client, seed)
+            for name in args.scenarios:
+                calls_before = dict(mocks.calls)
+                result = await run_scenario(
+                    operations[name], args.concurrency, args.duration, args.warmup
+                )
+                result["provider_calls"] = {
+                    provider: count - calls_before.get(provider, 0)
+                    for provider, count in mocks.calls.items()
+                    if count - calls_before.get(provider, 0)
+                }
+                results[name] = result
+                print(
+                    f"{name:<18} {result['throughput_rps']:>10.1f} rps"
+                    f"  p50 {result['latency_ms']['p50']:>8.2f} ms"
+                    f"  p95 {result['latency_ms']['p95']:>8.2f} ms"
+                    f"  p99 {result['latency_ms']['p99']:>8.2f} ms"
+                    f"  errors {result['errors']}",
+                    file=sys.stderr,
+                )
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "concurrency": args.concurrency,
+                "duration_seconds": args.duration,
+                "warmup_seconds": args.warmup,
+                "rate_limit": args.rate_limit,
+                "seed": args.seed,
+                "providers": {
+                    name: vars(behaviour)
+                    for name, behaviour in mocks.behaviours.items()
+                },
+            },
+        },
+        "scenarios": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: value.split(","),
+        default=list(SCENARIOS),
+        help=f"comma separated, any of {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds")
+    parser.add_argument("--provider-latency-ms", type=float, default=50.0)
+    parser.add_argument("--provider-jitter-ms", type=float, default=10.0)
+    parser.add_argument("--provider-error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--stripe",
+        default="",
+        help='overrides for stripe only, e.g. "latency_ms=200,error_rate=0.3"',
+    )
+    parser.add_argument("--razorpay", default="", help="overrides for razorpay only")
+    parser.add_argument(
+        "--rate-limit",
+        action="store_true",
+        help="keep the per api key rate limiter on (it would throttle the single benchmark key)",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default="benchmark-results.json")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run(args))
+    with open(args.out, "w") as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+        file.write("\n")
+    print(f"results written to {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
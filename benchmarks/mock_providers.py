@@ -0,0 +1,115 @@
+"""
+Simulated payment providers for the benchmarks, served through a httpx.MockTransport so no request leaves the process.
+each provider answers after a configurable latency and fails a configurable share of calls with a 503.
+"""
+
+import asyncio
+import json
+import random
+from dataclasses import dataclass, field
+from urllib.parse import parse_qs
+from uuid import uuid4
+import httpx
+
+
+@dataclass
+class ProviderBehaviour:
+    latency_ms: float = 50.0
+    # latency is drawn uniformly from latency_ms +- jitter_ms
+    jitter_ms: float = 10.0
+    # share of calls answered with a 503
+    error_rate: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str, default: "ProviderBehaviour") -> "ProviderBehaviour":
+        """
+        Parses "latency_ms=80,error_rate=0.2" on top of the defaults.
+        """
+        values = {
+            "latency_ms": default.latency_ms,
+            "jitter_ms": default.jitter_ms,
+            "error_rate": default.error_rate,
+        }
+        for part in filter(None, spec.split(",")):
+            key, _, value = part.partition("=")
+            if key not in values:
+                raise ValueError(f"Unknown provider setting {key!r}")
+            values[key] = float(value)
+        return cls(**values)
+
+
+@dataclass
+class MockProviders:
+    """
+    The stripe and razorpay endpoints the adapters call, keyed by the host of the provider's base url.
+    """
+
+    behaviours: dict[str, ProviderBehaviour]
+    seed: int | None = None
+    calls: dict[str, int] = field(default_factory=dict)
+    errors: dict[str, int] = field(default_factory=dict)
+
+    HOSTS = {"api.stripe.com": "stripe", "api.razorpay.com": "razorpay"}
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+        # intents authorized with manual capture, until they are captured or cancelled
+        self._authorized: dict[str, dict] = {}
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self._handle)
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        provider_name = self.HOSTS.get(request.url.host)
+        if provider_name is None:
+            return httpx.Response(404)
+        behaviour = self.behaviours.get(provider_name, ProviderBehaviour())
+        self.calls[provider_name] = self.calls.get(provider_name, 0) + 1
+        latency_ms = behaviour.latency_ms + self._random.uniform(
+            -behaviour.jitter_ms, behaviour.jitter_ms
+        )
+        await asyncio.sleep(max(latency_ms, 0) / 1000)
+        if self._random.random() < behaviour.error_rate:
+            self.errors[provider_name] = self.errors.get(provider_name, 0) + 1
+            return httpx.Response(503, json={"error": "simulated outage"})
+        if provider_name == "stripe":
+            return self._stripe(request)
+        return self._razorpay(request)
+
+    def _stripe(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/v1/refunds":
+            return httpx.Response(200, json={"id": f"re_{uuid4().hex[:24]}"})
+        if path != "/v1/payment_intents":
+            # capture of a hedge winner, or cancellation of a hedge loser's authorization
+            intent_id, action = path.split("/")[-2:]
+            intent = self._authorized.pop(intent_id)
+            intent["status"] = "succeeded" if action == "capture" else "canceled"
+            return httpx.Response(200, json=intent)
+        form = parse_qs(request.content.decode())
+        manual = form.get("capture_method") == ["manual"]
+        intent = {
+            "id": f"pi_{uuid4().hex[:24]}",
+            "object": "payment_intent",
+            "amount": int(form["amount"][0]),
+            "currency": form["currency"][0],
+            "status": "requires_capture" if manual else "succeeded",
+        }
+        if manual:
+            self._authorized[intent["id"]] = intent
+        return httpx.Response(200, json=intent)
+
+    @staticmethod
+    def _razorpay(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        return httpx.Response(
+            200,
+            json={
+                "id": f"order_{uuid4().hex[:14]}",
+                "entity": "order",
+                "amount": payload["amount"],
+                "currency": payload["currency"],
+                "receipt": payload["receipt"],
+                "status": "created",
+            },
+        )
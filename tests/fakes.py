@@ -0,0 +1,120 @@
+"""
+Simulated payment providers and plans for the tests.
+"""
+
+import asyncio
+import json
+from types import MappingProxyType
+from urllib.parse import parse_qs
+from uuid import uuid4
+import httpx
+from app.payments.plans import ProviderEntry, RoutingPlan
+
+CREDENTIALS = {
+    "stripe": {"secret_key": "sk_test"},
+    "razorpay": {"key_id": "rzp_test", "key_secret": "secret"},
+}
+
+
+def stripe_intent(request: httpx.Request, status: str = None) -> httpx.Response:
+    form = parse_qs(request.content.decode())
+    if status is None:
+        manual = form.get("capture_method") == ["manual"]
+        status = "requires_capture" if manual else "succeeded"
+    return httpx.Response(
+        200,
+        json={
+            "id": f"pi_{uuid4().hex[:24]}",
+            "object": "payment_intent",
+            "amount": int(form["amount"][0]),
+            "currency": form["currency"][0],
+            "status": status,
+        },
+    )
+
+
+def razorpay_order(request: httpx.Request) -> httpx.Response:
+    payload = json.loads(request.content)
+    return httpx.Response(
+        200,
+        json={
+            "id": f"order_{uuid4().hex[:14]}",
+            "amount": payload["amount"],
+            "currency": payload["currency"],
+            "status": "created",
+        },
+    )
+
+
+class FakeProviders:
+    """
+    Stripe and razorpay behind a httpx.MockTransport. `handlers` overrides how a provider answers (a function of
+    the request, sync or async), otherwise every call succeeds. every request is kept in `requests`. stripe intents
+    are kept by id, so they can be captured and cancelled.
+    """
+
+    HOSTS = {"stripe.test": "stripe", "razorpay.test": "razorpay"}
+
+    def __init__(self):
+        self.handlers = {}
+        self.requests: list[tuple[str, httpx.Request]] = []
+        self.intents: dict[str, dict] = {}
+
+    def calls(self, provider_name: str, path: str = "") -> list[httpx.Request]:
+        return [
+            request
+            for name, request in self.requests
+            if name == provider_name and request.url.path.endswith(path)
+        ]
+
+    def stripe(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/v1/payment_intents":
+            response = stripe_intent(request)
+            intent = response.json()
+            self.intents[intent["id"]] = intent
+            return response
+        if request.url.path == "/v1/refunds":
+            [intent_id] = parse_qs(request.content.decode())["payment_intent"]
+            self.intents[intent_id]["refunded"] = True
+            return httpx.Response(200, json={"id": f"re_{uuid4().hex[:24]}"})
+        intent_id, action = request.url.path.split("/")[-2:]
+        intent = self.intents[intent_id]
+        if action == "capture" and intent["status"] == "requires_capture":
+            intent["status"] = "succeeded"
+        elif action == "cancel" and intent["status"] != "succeeded":
+            intent["status"] = "canceled"
+        else:
+            return httpx.Response(400)
+        return httpx.Response(200, json=intent)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        provider_name = self.HOSTS[request.url.host]
+        self.requests.append((provider_name, request))
+        handler = self.handlers.get(provider_name)
+        if handler is None:
+            if provider_name == "stripe":
+                return self.stripe(request)
+            return razorpay_order(request)
+        response = handler(request)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+
+def make_plan(*provider_names: str) -> RoutingPlan:
+    """
+    A plan of a fresh project (so no breaker state carries over between tests), trying the providers in order.
+    """
+    return RoutingPlan(
+        project_id=uuid4(),
+        entries=tuple(
+            ProviderEntry(
+                config_id=uuid4(),
+                provider_name=name,
+                is_primary=index == 0,
+                priority=index,
+                credentials=MappingProxyType(CREDENTIALS.get(name, {})),
+            )
+            for index, name in enumerate(provider_names)
+        ),
+    )
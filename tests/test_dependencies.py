@@ -0,0 +1,68 @@
+from uuid import uuid4
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+from app.core import dependencies
+from app.projects import models as project_models
+
+pytestmark = pytest.mark.anyio
+
+
+def make_request() -> Request:
+    return Request({"type": "http", "headers": [], "client": ("203.0.113.7", 50000)})
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """
+    The projects the dependency finds in the "database", by api key. counts the lookups that reach it.
+    """
+    projects = {}
+    lookups = []
+
+    async def read_or_primary(db, read):
+        return await read()
+
+    async def get_project_by_api_key_hash(db, api_key_hash):
+        lookups.append(api_key_hash)
+        return projects.get(api_key_hash)
+
+    async def release_session(db):
+        return None
+
+    monkeypatch.setattr(dependencies, "read_or_primary", read_or_primary)
+    monkeypatch.setattr(dependencies, "release_session", release_session)
+    monkeypatch.setattr(
+        dependencies.project_crud,
+        "get_project_by_api_key_hash",
+        get_project_by_api_key_hash,
+    )
+    monkeypatch.setattr(dependencies.api_key_index, "get", lambda api_key_hash: None)
+    return projects, lookups
+
+
+async def test_unknown_key_is_answered_from_the_cache_the_second_time(database):
+    _, lookups = database
+    api_key = uuid4().hex
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as rejected:
+            await dependencies.get_project_from_api_key(make_request(), api_key, None)
+        assert rejected.value.status_code == 403
+
+    assert len(lookups) == 1
+
+
+async def test_known_key_is_looked_up_once(database):
+    projects, lookups = database
+    api_key = uuid4().hex
+    project = project_models.Project(id=uuid4())
+    projects[dependencies.hash_api_key(api_key)] = project
+
+    for _ in range(2):
+        found = await dependencies.get_project_from_api_key(
+            make_request(), api_key, None
+        )
+        assert found is project
+
+    assert len(lookups) == 1
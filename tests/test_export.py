@@ -0,0 +1,28 @@
+import gc
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from app.core.config import settings
+from app.payments.export import _naive, open_export
+
+
+def test_exports_over_the_limit_are_refused_until_one_ends():
+    exports = [
+        open_export(uuid4(), "csv") for _ in range(settings.EXPORT_MAX_CONCURRENT)
+    ]
+
+    assert all(export is not None for export in exports)
+    assert open_export(uuid4(), "csv") is None
+    # a response that never started its body still gives the slot back
+    exports.pop()
+    gc.collect()
+    assert open_export(uuid4(), "csv") is not None
+
+
+def test_aware_bounds_become_naive_local_time():
+    aware = datetime(2026, 10, 18, 12, 0, tzinfo=timezone(timedelta(hours=5)))
+
+    naive = _naive(aware)
+
+    assert naive.tzinfo is None
+    assert naive == aware.astimezone().replace(tzinfo=None)
+    assert _naive(None) is None
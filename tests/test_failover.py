@@ -0,0 +1,253 @@
+import asyncio
+import httpx
+import pytest
+from app.core.config import ProviderHTTPSettings, settings
+from app.core.deadlines import Deadline
+from app.payments import schema
+from app.payments.failover import (
+    ChargeFailed,
+    charge_with_failover,
+    drain_background_tasks,
+)
+from app.providers.clients import provider_clients
+from fakes import make_plan, razorpay_order, stripe_intent
+
+pytestmark = pytest.mark.anyio
+
+CHARGE = schema.ChargeRequest(amount=1000, currency="USD", hedge=False)
+HEDGED = schema.ChargeRequest(amount=1000, currency="USD", hedge=True)
+
+
+@pytest.fixture
+def hedge_fast(monkeypatch):
+    # hedge after 50ms instead of the 2s used before a provider has any latency history
+    monkeypatch.setattr(settings, "CHARGE_HEDGE_DEFAULT_DELAY_MS", 50.0)
+
+
+def slow(handler):
+    async def respond(request):
+        await asyncio.sleep(0.3)
+        return handler(request)
+
+    return respond
+
+
+async def test_primary_handles_the_charge(providers):
+    result = await charge_with_failover(
+        make_plan("stripe", "razorpay"), CHARGE, Deadline(5)
+    )
+
+    assert result.provider_name == "stripe"
+    assert result.status == "succeeded"
+    assert [attempt.provider_name for attempt in result.attempts] == ["stripe"]
+    assert providers.calls("razorpay") == []
+
+
+async def test_fails_over_in_plan_order_on_5xx(providers):
+    providers.handlers["stripe"] = lambda request: httpx.Response(503)
+
+    result = await charge_with_failover(
+        make_plan("stripe", "razorpay"), CHARGE, Deadline(5)
+    )
+
+    assert result.provider_name == "razorpay"
+    assert [(a.provider_name, a.succeeded) for a in result.attempts] == [
+        ("stripe", False),
+        ("razorpay", True),
+    ]
+    assert "HTTP 503" in result.attempts[0].error
+
+
+async def test_same_reference_is_sent_to_every_provider(providers):
+    providers.handlers["stripe"] = lambda request: httpx.Response(503)
+
+    result = await charge_with_failover(
+        make_plan("stripe", "razorpay"), CHARGE, Deadline(5)
+    )
+
+    [stripe_call] = providers.calls("stripe")
+    [razorpay_call] = providers.calls("razorpay")
+    assert stripe_call.headers["Idempotency-Key"] == result.reference
+    assert razorpay_call.read() and result.reference in razorpay_call.content.decode()
+
+
+async def test_fails_over_on_connection_errors(providers):
+    def refuse(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    providers.handlers["stripe"] = refuse
+
+    result = await charge_with_failover(
+        make_plan("stripe", "razorpay"), CHARGE, Deadline(5)
+    )
+
+    assert result.provider_name == "razorpay"
+    assert "ConnectError" in result.attempts[0].error
+
+
+@pytest.mark.parametrize("status_code", [400, 402, 404])
+async def test_4xx_is_not_retried_on_the_next_provider(providers, status_code):
+    providers.handlers["stripe"] = lambda request: httpx.Response(status_code)
+
+    with pytest.raises(ChargeFailed) as failed:
+        await charge_with_failover(make_plan("stripe", "razorpay"), CHARGE, Deadline(5))
+
+    assert [a.provider_name for a in failed.value.attempts] == ["stripe"]
+    assert not failed.value.deadline_exceeded
+    assert providers.calls("razorpay") == []
+
+
+@pytest.mark.parametrize("status_code", [408, 429])
+async def test_throttling_and_request_timeouts_fail_over(providers, status_code):
+    providers.handlers["stripe"] = lambda request: httpx.Response(status_code)
+
+    result = await charge_with_failover(
+        make_plan("stripe", "razorpay"), CHARGE, Deadline(5)
+    )
+
+    assert result.provider_name == "razorpay"
+
+
+async def test_declined_charge_with_a_200_is_a_failure(providers):
+    providers.handlers["stripe"] = lambda request: stripe_intent(
+        request, status="requires_payment_method"
+    )
+
+    with pytest.raises(ChargeFailed) as failed:
+        await charge_with_failover(make_plan("stripe", "razorpay"), CHARGE, Deadline(5))
+
+    [attempt] = failed.value.attempts
+    assert not attempt.succeeded
+    assert "declined" in attempt.error
+    assert providers.calls("razorpay") == []
+
+
+async def test_provider_without_a_client_is_skipped(providers):
+    # only razorpay gets a client
+    await provider_clients.aclose()
+    provider_clients.start(
+        providers={"razorpay": ProviderHTTPSettings(base_url="https://razorpay.test")},
+        transport=httpx.MockTransport(providers.handle),
+    )
+
+    result = await charge_with_failover(
+        make_plan("stripe", "razorpay"), CHARGE, Deadline(5)
+    )
+
+    assert result.provider_name == "razorpay"
+    assert "no http client configured" in result.attempts[0].error
+
+
+async def test_every_provider_failing_raises_with_all_attempts(providers):
+    providers.handlers["stripe"] = lambda request: httpx.Response(500)
+    providers.handlers["razorpay"] = lambda request: httpx.Response(502)
+
+    with pytest.raises(ChargeFailed) as failed:
+        await charge_with_failover(make_plan("stripe", "razorpay"), CHARGE, Deadline(5))
+
+    assert [a.provider_name for a in failed.value.attempts] == ["stripe", "razorpay"]
+    assert not failed.value.deadline_exceeded
+
+
+async def test_slow_provider_runs_into_the_deadline(providers):
+    async def hang(request):
+        await asyncio.sleep(10)
+
+    providers.handlers["stripe"] = hang
+
+    with pytest.raises(ChargeFailed) as failed:
+        await charge_with_failover(
+            make_plan("stripe", "razorpay"), CHARGE, Deadline(0.05)
+        )
+
+    assert failed.value.deadline_exceeded
+    # no budget left for the fallback
+    assert providers.calls("razorpay") == []
+
+
+async def test_hedge_loser_authorization_is_voided(providers, hedge_fast):
+    providers.handlers["stripe"] = slow(providers.stripe)
+
+    result = await charge_with_failover(
+        make_plan("stripe", "razorpay"), HEDGED, Deadline(5)
+    )
+    await drain_background_tasks(5)
+
+    assert result.provider_name == "razorpay"
+    [authorize] = providers.calls("stripe", "/payment_intents")
+    assert b"capture_method=manual" in authorize.content
+    assert providers.calls("stripe", "/capture") == []
+    [intent] = providers.intents.values()
+    assert intent["status"] == "canceled"
+
+
+async def test_only_the_hedge_winner_is_captured(providers, hedge_fast):
+    providers.handlers["razorpay"] = slow(razorpay_order)
+
+    result = await charge_with_failover(
+        make_plan("razorpay", "stripe"), HEDGED, Deadline(5)
+    )
+    await drain_background_tasks(5)
+
+    assert result.provider_name == "stripe"
+    assert result.status == "succeeded"
+    assert len(providers.calls("stripe", "/capture")) == 1
+    assert [a.provider_name for a in result.attempts] == ["stripe"]
+
+
+async def test_failed_capture_voids_the_authorization(providers, hedge_fast):
+    def capture_fails(request):
+        if request.url.path.endswith("/capture"):
+            return httpx.Response(500)
+        return providers.stripe(request)
+
+    providers.handlers["stripe"] = capture_fails
+
+    with pytest.raises(ChargeFailed) as failed:
+        await charge_with_failover(make_plan("stripe"), HEDGED, Deadline(5))
+
+    [attempt] = failed.value.attempts
+    assert not attempt.succeeded
+    assert "capture failed" in attempt.error
+    [intent] = providers.intents.values()
+    assert intent["status"] == "canceled"
+
+
+async def test_capture_past_the_deadline_is_voided_once_it_finishes(
+    providers, hedge_fast
+):
+    async def slow_capture(request):
+        if request.url.path.endswith("/capture"):
+            await asyncio.sleep(0.3)
+        return providers.stripe(request)
+
+    providers.handlers["stripe"] = slow_capture
+
+    with pytest.raises(ChargeFailed) as failed:
+        await charge_with_failover(make_plan("stripe"), HEDGED, Deadline(0.1))
+    await drain_background_tasks(5)
+
+    assert failed.value.deadline_exceeded
+    [attempt] = failed.value.attempts
+    assert "deadline exceeded while capturing" in attempt.error
+    # the capture went through after we gave up on it, so the charge is refunded
+    [intent] = providers.intents.values()
+    assert intent["status"] == "succeeded"
+    assert intent["refunded"]
+
+
+async def test_cancelled_charge_voids_what_goes_through(providers):
+    providers.handlers["stripe"] = slow(providers.stripe)
+    task = asyncio.create_task(
+        charge_with_failover(make_plan("stripe", "razorpay"), CHARGE, Deadline(5))
+    )
+    await asyncio.sleep(0.05)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await drain_background_tasks(5)
+
+    [intent] = providers.intents.values()
+    assert intent["status"] == "succeeded"
+    assert intent["refunded"]
@@ -0,0 +1,211 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from uuid import uuid4
+import pytest
+from fastapi import HTTPException
+from app.core.config import settings
+from app.core.deadlines import Deadline
+from app.payments import idempotency
+from app.payments.idempotency import IdempotencyStore
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def rollback(self):
+        pass
+
+
+@pytest.fixture
+def table(monkeypatch):
+    """
+    Stands in for the idempotency_keys table, with the same rules as the queries in crud.
+    """
+    rows = {}
+
+    async def claim_idempotency_key(db, project_id, key, request_hash, expires_at):
+        now = datetime.now()
+        row = rows.get((project_id, key))
+        if row is not None:
+            lease = timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+            taken_over = (
+                row.status == idempotency.crud.IN_PROGRESS
+                and row.request_hash == request_hash
+                and row.created_at < now - lease
+            )
+            if not taken_over:
+                return False
+        rows[(project_id, key)] = SimpleNamespace(
+            request_hash=request_hash,
+            status=idempotency.crud.IN_PROGRESS,
+            response_status=None,
+            response_body=None,
+            created_at=now,
+        )
+        return True
+
+    async def get_idempotency_key(db, project_id, key):
+        return rows.get((project_id, key))
+
+    async def complete_idempotency_key(
+        db, project_id, key, response_status, response_body
+    ):
+        rows[(project_id, key)].__dict__.update(
+            status=idempotency.crud.COMPLETED,
+            response_status=response_status,
+            response_body=response_body,
+        )
+
+    async def release_idempotency_key(db, project_id, key):
+        rows.pop((project_id, key), None)
+
+    for func in (
+        claim_idempotency_key,
+        get_idempotency_key,
+        complete_idempotency_key,
+        release_idempotency_key,
+    ):
+        monkeypatch.setattr(idempotency.crud, func.__name__, func)
+    monkeypatch.setattr(idempotency, "AsyncSessionLocal", FakeSession)
+    return rows
+
+
+class Handler:
+    """
+    Counts its calls and answers with `status_code`, after `release` is set if there is one.
+    """
+
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self) -> tuple[int, str]:
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        return self.status_code, json.dumps({"call": self.calls})
+
+
+def run(store, handler, project_id, request_hash="hash", timeout=5):
+    return store.run(
+        FakeSession(), project_id, "key", request_hash, Deadline(timeout), handler
+    )
+
+
+async def test_retry_gets_the_stored_response(table):
+    store, handler, project_id = IdempotencyStore(), Handler(), uuid4()
+
+    first = await run(store, handler, project_id)
+    second = await run(store, handler, project_id)
+    # another worker, which only has the table
+    third = await run(IdempotencyStore(), handler, project_id)
+
+    assert handler.calls == 1
+    assert not first.replayed
+    assert second.replayed and third.replayed
+    assert first.body == second.body == third.body
+
+
+async def test_different_body_with_the_same_key_is_rejected(table):
+    store, handler, project_id = IdempotencyStore(), Handler(), uuid4()
+    await run(store, handler, project_id)
+
+    with pytest.raises(HTTPException) as rejected:
+        await run(store, handler, project_id, request_hash="other")
+
+    assert rejected.value.status_code == 422
+    assert handler.calls == 1
+
+
+async def test_concurrent_request_waits_for_the_one_in_flight(table):
+    store, handler, project_id = IdempotencyStore(), Handler(), uuid4()
+    handler.release = asyncio.Event()
+
+    first = asyncio.create_task(run(store, handler, project_id))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(run(store, handler, project_id))
+    await asyncio.sleep(0.01)
+    handler.release.set()
+    first, second = await asyncio.gather(first, second)
+
+    assert handler.calls == 1
+    assert second.replayed
+    assert second.body == first.body
+
+
+async def test_key_still_running_elsewhere_answers_409(table):
+    project_id = uuid4()
+    handler = Handler()
+    handler.release = asyncio.Event()
+    running = asyncio.create_task(run(IdempotencyStore(), handler, project_id))
+    await asyncio.sleep(0)
+
+    with pytest.raises(HTTPException) as conflict:
+        await run(IdempotencyStore(), handler, project_id, timeout=0.1)
+
+    assert conflict.value.status_code == 409
+    handler.release.set()
+    await running
+
+
+async def test_key_left_by_a_dead_worker_is_taken_over(table):
+    project_id = uuid4()
+    table[(project_id, "key")] = SimpleNamespace(
+        request_hash="hash",
+        status=idempotency.crud.IN_PROGRESS,
+        response_status=None,
+        response_body=None,
+        created_at=datetime.now()
+        - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS + 1),
+    )
+    handler = Handler()
+
+    response = await run(IdempotencyStore(), handler, project_id)
+
+    assert handler.calls == 1
+    assert not response.replayed
+    assert table[(project_id, "key")].status == idempotency.crud.COMPLETED
+
+
+async def test_key_is_released_after_a_5xx(table):
+    store, handler, project_id = IdempotencyStore(), Handler(502), uuid4()
+
+    first = await run(store, handler, project_id)
+    assert (project_id, "key") not in table
+    handler.status_code = 200
+    second = await run(store, handler, project_id)
+
+    assert first.status_code == 502
+    assert second.status_code == 200 and not second.replayed
+    assert handler.calls == 2
+
+
+async def test_failing_completion_write_keeps_the_response(table, monkeypatch):
+    async def complete_idempotency_key(*args):
+        raise ConnectionError("database went away")
+
+    monkeypatch.setattr(
+        idempotency.crud, "complete_idempotency_key", complete_idempotency_key
+    )
+    store, handler, project_id = IdempotencyStore(), Handler(), uuid4()
+    handler.release = asyncio.Event()
+
+    first = asyncio.create_task(run(store, handler, project_id))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(run(store, handler, project_id))
+    await asyncio.sleep(0.01)
+    handler.release.set()
+    first, second = await asyncio.gather(first, second)
+
+    assert first.status_code == second.status_code == 200
+    assert second.replayed
+    assert handler.calls == 1
@@ -0,0 +1,48 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from app.core.config import settings
+from app.core.routes import metrics_router, router
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router)
+    app.include_router(metrics_router)
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    )
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(settings, "INTERNAL_API_TOKEN", "s3cret")
+    return "s3cret"
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/internal/stats/providers"])
+async def test_hidden_without_a_configured_token(client, monkeypatch, path):
+    monkeypatch.setattr(settings, "INTERNAL_API_TOKEN", None)
+
+    response = await client.get(path, headers={"Authorization": "Bearer "})
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("authorization", [None, "Bearer wrong", "Basic s3cret"])
+async def test_wrong_token_is_refused(client, token, authorization):
+    headers = {"Authorization": authorization} if authorization else {}
+
+    response = await client.get("/internal/stats/providers", headers=headers)
+
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/internal/stats/providers"])
+async def test_served_with_the_token(client, token, path):
+    response = await client.get(path, headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200
@@ -0,0 +1,80 @@
+import json
+import asyncpg
+import pytest
+from app.core.config import settings
+from app.payments import schema
+from app.payments.ledger import LedgerWriter
+
+pytestmark = pytest.mark.anyio
+
+REFERENCE = "0" * 32
+
+
+@pytest.fixture
+def ledger(monkeypatch, tmp_path):
+    """
+    A LedgerWriter whose database refuses every write containing an attempt with error "bad", and keeps the rest.
+    """
+    monkeypatch.setattr(
+        settings, "LEDGER_DEAD_LETTER_PATH", str(tmp_path / "dead.ndjson")
+    )
+    # no point waiting between retries here
+    monkeypatch.setattr(settings, "LEDGER_FLUSH_RETRIES", 1)
+    writer = LedgerWriter()
+    writer.written = []
+
+    async def write(rows_by_table):
+        rows = [row for rows in rows_by_table.values() for row in rows]
+        if any("bad" in row for row in rows):
+            raise asyncpg.DataError("invalid input")
+        writer.written.extend(rows)
+
+    monkeypatch.setattr(writer, "_write", write)
+    return writer
+
+
+def dead_letters() -> list[dict]:
+    with open(settings.LEDGER_DEAD_LETTER_PATH) as file:
+        return [json.loads(line) for line in file]
+
+
+def attempts(*errors: str) -> list[schema.ChargeAttempt]:
+    return [
+        schema.ChargeAttempt(
+            provider_name="stripe", succeeded=False, latency_ms=1.0, error=error
+        )
+        for error in errors
+    ]
+
+
+async def test_rejected_records_are_split_out_of_the_batch(ledger):
+    charge = schema.ChargeRequest(amount=1000, currency="usd")
+
+    await ledger.record_charge(
+        "project", REFERENCE, charge, attempts("ok", "bad", "ok", "ok")
+    )
+
+    # the transaction and three of the attempts
+    assert len(ledger.written) == 4
+    [record] = dead_letters()
+    assert record["table"] == "payment_attempts"
+    assert record["error"] == "bad"
+
+
+async def test_batch_goes_to_the_dead_letter_file_when_the_database_is_down(
+    ledger, monkeypatch
+):
+    async def unreachable(rows_by_table):
+        raise OSError("connection refused")
+
+    monkeypatch.setattr(ledger, "_write", unreachable)
+    charge = schema.ChargeRequest(amount=1000, currency="usd")
+
+    await ledger.record_charge("project", REFERENCE, charge, attempts("ok"))
+
+    records = dead_letters()
+    assert [record["table"] for record in records] == [
+        "transactions",
+        "payment_attempts",
+    ]
+    assert records[0]["amount"] == 1000
@@ -0,0 +1,22 @@
+import pytest
+from app.core import passwords
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_pending_count_follows_the_jobs():
+    assert await passwords.verify_password_async(
+        "secret", await passwords.get_password_hash_async("secret")
+    )
+
+    assert passwords._hash_pending == 0
+
+
+async def test_rejected_submit_is_not_counted():
+    passwords.get_hash_executor().shutdown()
+
+    with pytest.raises(RuntimeError):
+        await passwords.get_password_hash_async("secret")
+
+    assert passwords._hash_pending == 0
+    passwords.shutdown_hash_executor()
@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+import pytest
+from app.payments import plans
+from app.payments.plans import PlanCache
+
+pytestmark = pytest.mark.anyio
+
+
+def make_config(provider_name: str, is_primary: bool, priority: int):
+    return SimpleNamespace(
+        id=uuid4(),
+        provider_name=provider_name,
+        is_primary=is_primary,
+        priority=priority,
+        decoded_credentials=lambda: {"secret_key": "sk_test"},
+    )
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """
+    Replaces the provider config query. every read is recorded, and waits for `release` when one is set.
+    """
+    state = SimpleNamespace(
+        count=0,
+        release=None,
+        configs=[make_config("razorpay", False, 2), make_config("stripe", True, 5)],
+    )
+
+    async def get_provider_configs_for_project(db, project_id):
+        state.count += 1
+        if state.release is not None:
+            await state.release.wait()
+        return state.configs
+
+    monkeypatch.setattr(
+        plans.project_crud,
+        "get_provider_configs_for_project",
+        get_provider_configs_for_project,
+    )
+    return state
+
+
+def session():
+    return SimpleNamespace(info={})
+
+
+async def test_plan_puts_the_primary_first_and_is_cached(reads):
+    cache = PlanCache()
+    project_id = uuid4()
+
+    plan = await cache.get(session(), project_id)
+
+    assert [entry.provider_name for entry in plan.entries] == ["stripe", "razorpay"]
+    assert await cache.get(session(), project_id) is plan
+    assert reads.count == 1
+
+
+async def test_concurrent_misses_build_once(reads):
+    cache = PlanCache()
+    project_id = uuid4()
+    reads.release = asyncio.Event()
+
+    tasks = [asyncio.create_task(cache.get(session(), project_id)) for _ in range(5)]
+    await asyncio.sleep(0)
+    reads.release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert reads.count == 1
+    assert all(plan is results[0] for plan in results)
+    assert cache._builds == {}
+
+
+async def test_plan_read_before_an_invalidation_is_not_stored(reads):
+    cache = PlanCache()
+    project_id = uuid4()
+    reads.release = asyncio.Event()
+
+    task = asyncio.create_task(cache.get(session(), project_id))
+    await asyncio.sleep(0)
+    cache.invalidate(project_id)
+    reads.release.set()
+    await task
+    reads.release = None
+
+    await cache.get(session(), project_id)
+    assert reads.count == 2
+
+
+async def test_invalidating_unknown_projects_keeps_nothing(reads):
+    cache = PlanCache()
+
+    for _ in range(100):
+        cache.invalidate(uuid4())
+
+    assert cache._builds == {}
+    assert cache.stats()["size"] == 0
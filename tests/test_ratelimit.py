@@ -0,0 +1,51 @@
+from app.core.ratelimit import NEVER_REFILLS_SECONDS, RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_limiter(clock: Clock = None) -> RateLimiter:
+    return RateLimiter(rate=1, burst=2, shards=4, clock=clock or Clock())
+
+
+def test_unknown_keys_share_the_fallback_bucket():
+    limiter = make_limiter()
+
+    results = [
+        limiter.hit(f"made-up-{index}", fallback=("unknown", "203.0.113.7"))
+        for index in range(3)
+    ]
+
+    assert [result.allowed for result in results] == [True, True, False]
+    assert limiter.hit("made-up-4", fallback=("unknown", "198.51.100.1")).allowed
+
+
+def test_configured_key_gets_its_own_bucket():
+    limiter = make_limiter()
+    fallback = ("unknown", "203.0.113.7")
+    for _ in range(2):
+        limiter.hit("other", fallback=fallback)
+
+    limiter.configure("key", None, None)
+
+    assert limiter.hit("key", fallback=fallback).allowed
+    assert not limiter.hit("made-up", fallback=fallback).allowed
+
+
+def test_project_limits_of_zero_are_not_the_default():
+    clock = Clock()
+    limiter = make_limiter(clock)
+    limiter.configure("key", 0, 1)
+
+    first = limiter.hit("key", fallback="unknown")
+    clock.now += 60
+    second = limiter.hit("key", fallback="unknown")
+
+    assert first.allowed
+    assert not second.allowed
+    assert second.retry_after == NEVER_REFILLS_SECONDS
@@ -0,0 +1,181 @@
+import httpx
+import pytest
+from app.core.config import settings
+from app.core.deadlines import Deadline
+from app.payments import schema
+from app.payments.failover import charge_with_failover
+from app.payments.routing import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    ProviderHealth,
+    ProviderRouter,
+)
+from fakes import make_plan
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_health(clock: Clock, consecutive_failures: int = 3) -> ProviderHealth:
+    return ProviderHealth(
+        window_size=10,
+        min_samples=5,
+        error_rate_threshold=0.5,
+        consecutive_failures=consecutive_failures,
+        open_seconds=30,
+        clock=clock,
+    )
+
+
+def trip(health: ProviderHealth) -> None:
+    for _ in range(health.consecutive_failures_threshold):
+        health.record(100, ok=False, admission=health.allow_request())
+
+
+def test_consecutive_failures_open_the_breaker():
+    health = make_health(Clock())
+
+    trip(health)
+
+    assert health.state == OPEN
+    assert health.allow_request() is None
+
+
+def test_half_open_lets_a_single_probe_through_and_closes_on_success():
+    clock = Clock()
+    health = make_health(clock)
+    trip(health)
+    clock.now += 30
+
+    probe = health.allow_request()
+
+    assert health.state == HALF_OPEN
+    assert probe is not None and probe.probe
+    assert health.allow_request() is None
+    health.record(100, ok=True, admission=probe)
+    assert health.state == CLOSED
+
+
+def test_failed_probe_reopens_the_breaker():
+    clock = Clock()
+    health = make_health(clock)
+    trip(health)
+    clock.now += 30
+
+    health.record(100, ok=False, admission=health.allow_request())
+
+    assert health.state == OPEN
+
+
+def test_abandoning_another_call_keeps_the_probe_slot():
+    clock = Clock()
+    health = make_health(clock)
+    trip(health)
+    clock.now += 30
+    probe = health.allow_request()
+    # a call forced through while every provider was tripped, cancelled before it got a result
+    forced = health.bypass()
+
+    health.abandon(forced)
+
+    assert health.allow_request() is None
+    health.abandon(probe)
+    assert health.allow_request() is not None
+
+
+def test_only_the_probe_decides_in_half_open():
+    clock = Clock()
+    health = make_health(clock)
+    trip(health)
+    clock.now += 30
+    health.allow_request()
+
+    health.record(100, ok=True, admission=health.bypass())
+
+    assert health.state == HALF_OPEN
+
+
+def test_results_from_before_the_breaker_opened_are_ignored():
+    clock = Clock()
+    health = make_health(clock)
+    # a slow call, sent while the breaker was still closed
+    slow = health.allow_request()
+    trip(health)
+    clock.now += 30
+    probe = health.allow_request()
+
+    health.record(5000, ok=True, admission=slow)
+
+    assert health.state == HALF_OPEN
+    health.record(100, ok=False, admission=probe)
+    assert health.state == OPEN
+
+
+def test_failures_from_before_the_breaker_closed_do_not_count():
+    clock = Clock()
+    health = make_health(clock, consecutive_failures=2)
+    stale = [health.allow_request() for _ in range(2)]
+    trip(health)
+    clock.now += 30
+    health.record(100, ok=True, admission=health.allow_request())
+
+    for admission in stale:
+        health.record(100, ok=False, admission=admission)
+
+    assert health.state == CLOSED
+    assert health.consecutive_failures == 0
+
+
+def test_router_skips_open_providers_and_keeps_the_static_order():
+    router = ProviderRouter(clock=Clock())
+    plan = make_plan("stripe", "razorpay", "adyen")
+    trip(router.health(plan.project_id, "stripe"))
+
+    ordered = router.order(plan.project_id, plan.entries)
+
+    assert [entry.provider_name for entry in ordered] == ["razorpay", "adyen"]
+
+
+def test_router_tries_everything_when_every_breaker_is_open():
+    router = ProviderRouter(clock=Clock())
+    plan = make_plan("stripe", "razorpay")
+    for entry in plan.entries:
+        trip(router.health(plan.project_id, entry.provider_name))
+
+    ordered = router.order(plan.project_id, plan.entries)
+
+    assert [entry.provider_name for entry in ordered] == ["stripe", "razorpay"]
+
+
+def test_router_forgets_the_least_recently_used_providers():
+    router = ProviderRouter(clock=Clock(), max_tracked=2)
+    first = router.health("a", "stripe")
+    router.health("b", "stripe")
+    # used again, so "b" is the oldest now
+    router.health("a", "stripe")
+
+    router.health("c", "stripe")
+
+    assert set(router.stats()) == {"a", "c"}
+    assert router.health("a", "stripe") is first
+
+
+@pytest.mark.anyio
+async def test_tripped_primary_is_skipped_by_later_charges(providers, monkeypatch):
+    monkeypatch.setattr(settings, "ROUTER_CONSECUTIVE_FAILURES", 2)
+    providers.handlers["stripe"] = lambda request: httpx.Response(503)
+    plan = make_plan("stripe", "razorpay")
+    charge = schema.ChargeRequest(amount=1000, currency="USD", hedge=False)
+
+    for _ in range(2):
+        await charge_with_failover(plan, charge, Deadline(5))
+    result = await charge_with_failover(plan, charge, Deadline(5))
+
+    assert len(providers.calls("stripe")) == 2
+    assert [attempt.provider_name for attempt in result.attempts] == ["razorpay"]
@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+import pytest
+from sqlalchemy import inspect
+from app.core.singleflight import singleflight
+from app.projects.models import ProviderConfig
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def reads():
+    """
+    A coalesced read recording its queries, each of which waits for `release`.
+    """
+    state = SimpleNamespace(queries=[], release=asyncio.Event())
+
+    @singleflight
+    async def get_configs(db, project_id):
+        state.queries.append(project_id)
+        await state.release.wait()
+        return [
+            ProviderConfig(
+                id=uuid4(),
+                project_id=project_id,
+                provider_name="stripe",
+                credentials="{}",
+                is_primary=True,
+                priority=1,
+            )
+        ]
+
+    state.get_configs = get_configs
+    return state
+
+
+def session(**info):
+    return SimpleNamespace(new=(), dirty=(), deleted=(), info=info, bind="replica")
+
+
+async def run_together(reads, calls):
+    tasks = [
+        asyncio.create_task(reads.get_configs(db, project_id))
+        for db, project_id in calls
+    ]
+    await asyncio.sleep(0)
+    reads.release.set()
+    return await asyncio.gather(*tasks)
+
+
+async def test_concurrent_calls_share_one_query(reads):
+    project_id = uuid4()
+
+    leader, *others = await run_together(
+        reads, [(session(), project_id) for _ in range(3)]
+    )
+
+    assert reads.queries == [project_id]
+    [config] = leader
+    copies = [configs[0] for configs in others]
+    assert all(copy is not config for copy in copies)
+    assert copies[0] is not copies[1]
+    for copy in copies:
+        assert inspect(copy).detached
+        assert (copy.id, copy.provider_name) == (config.id, config.provider_name)
+
+
+async def test_calls_for_different_arguments_do_not_share(reads):
+    await run_together(reads, [(session(), uuid4()), (session(), uuid4())])
+
+    assert len(reads.queries) == 2
+
+
+@pytest.mark.parametrize("info", [{"primary": True}, {"wrote": True}])
+async def test_primary_sessions_run_their_own_query(reads, info):
+    project_id = uuid4()
+
+    await run_together(reads, [(session(), project_id), (session(**info), project_id)])
+
+    assert len(reads.queries) == 2
+
+
+async def test_sessions_with_pending_changes_run_their_own_query(reads):
+    project_id = uuid4()
+    pending = session()
+    pending.new = (object(),)
+
+    await run_together(reads, [(session(), project_id), (pending, project_id)])
+
+    assert len(reads.queries) == 2
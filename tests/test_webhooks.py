@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from uuid import uuid4
+import httpx
+import pytest
+from fastapi import FastAPI
+from app.core.config import settings
+from app.payments import routes, webhooks
+from app.payments.plans import ProviderEntry, RoutingPlan
+from app.payments.webhooks import WebhookPipeline
+from app.providers.webhooks import WebhookEvent
+
+pytestmark = pytest.mark.anyio
+
+SECRET = "whsec_test"
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """
+    Stands in for the webhook_events and transactions tables, with the same rules as the queries in crud.
+    """
+    state = SimpleNamespace(
+        events=set(), transactions={}, applied=[], block=None, received=0
+    )
+
+    async def record_webhook_events(db, events):
+        state.received += 1
+        if state.block is not None:
+            await state.block.wait()
+        new = {(event["provider_name"], event["event_id"]) for event in events}
+        new -= state.events
+        state.events |= new
+        return new
+
+    async def apply_transaction_statuses(db, updates):
+        applied = set()
+        for project_id, provider_name, payment_id, status, occurred_at in updates:
+            key = (project_id, provider_name, payment_id)
+            transaction = state.transactions.get(key)
+            if transaction is None:
+                continue
+            if transaction["status_updated_at"] is not None and (
+                transaction["status_updated_at"] > occurred_at
+            ):
+                continue
+            transaction.update(status=status, status_updated_at=occurred_at)
+            state.applied.append((payment_id, status))
+            applied.add(key)
+        return applied
+
+    async def forget_webhook_events(db, keys):
+        state.events -= set(keys)
+
+    monkeypatch.setattr(webhooks, "AsyncSessionLocal", FakeSession)
+    monkeypatch.setattr(webhooks.crud, "record_webhook_events", record_webhook_events)
+    monkeypatch.setattr(
+        webhooks.crud, "apply_transaction_statuses", apply_transaction_statuses
+    )
+    monkeypatch.setattr(webhooks.crud, "forget_webhook_events", forget_webhook_events)
+    monkeypatch.setattr(settings, "WEBHOOK_WORKERS", 1)
+    monkeypatch.setattr(settings, "WEBHOOK_FLUSH_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "WEBHOOK_UNMATCHED_RETRIES", 0)
+    return state
+
+
+def event(event_id: str, status: str, occurred_at: int, payment_id="pi_1"):
+    return WebhookEvent(
+        provider_name="stripe",
+        event_id=event_id,
+        provider_payment_id=payment_id,
+        status=status,
+        occurred_at=datetime.fromtimestamp(occurred_at),
+    )
+
+
+def add_transaction(store, project_id, payment_id="pi_1"):
+    transaction = {"status": "pending", "status_updated_at": None}
+    store.transactions[(project_id, "stripe", payment_id)] = transaction
+    return transaction
+
+
+async def test_redeliveries_are_applied_once(store):
+    project_id = uuid4()
+    add_transaction(store, project_id)
+    pipeline = WebhookPipeline()
+    pipeline.start()
+
+    assert pipeline.submit(project_id, event("evt_1", "succeeded", 100))
+    assert pipeline.submit(project_id, event("evt_1", "succeeded", 100))
+    await pipeline.stop()
+    pipeline.start()
+    received = store.received
+    # answered from memory once the first delivery was applied
+    assert pipeline.submit(project_id, event("evt_1", "succeeded", 100))
+    await pipeline.stop()
+
+    assert store.applied == [("pi_1", "succeeded")]
+    assert store.received == received
+
+
+async def test_latest_event_wins_whatever_the_arrival_order(store):
+    project_id = uuid4()
+    transaction = add_transaction(store, project_id)
+    pipeline = WebhookPipeline()
+    pipeline.start()
+
+    # in one batch
+    pipeline.submit(project_id, event("evt_3", "refunded", 300))
+    pipeline.submit(project_id, event("evt_2", "succeeded", 200))
+    await pipeline.stop()
+    # and after the later one was applied
+    pipeline.start()
+    pipeline.submit(project_id, event("evt_1", "pending", 100))
+    await pipeline.stop()
+
+    assert store.applied == [("pi_1", "refunded")]
+    assert transaction["status"] == "refunded"
+
+
+async def test_unmatched_event_is_applied_when_redelivered(store):
+    project_id = uuid4()
+    pipeline = WebhookPipeline()
+    pipeline.start()
+
+    pipeline.submit(project_id, event("evt_1", "succeeded", 100))
+    await pipeline.stop()
+    add_transaction(store, project_id)
+    pipeline.start()
+    pipeline.submit(project_id, event("evt_1", "succeeded", 100))
+    await pipeline.stop()
+
+    assert store.applied == [("pi_1", "succeeded")]
+
+
+def signed(payload: dict) -> tuple[bytes, dict]:
+    body = json.dumps(payload).encode()
+    timestamp = str(int(time.time()))
+    signature = hmac.new(
+        SECRET.encode(), timestamp.encode() + b"." + body, hashlib.sha256
+    ).hexdigest()
+    return body, {"Stripe-Signature": f"t={timestamp},v1={signature}"}
+
+
+def stripe_event(event_id: str) -> dict:
+    return {
+        "id": event_id,
+        "type": "payment_intent.succeeded",
+        "created": int(time.time()),
+        "data": {"object": {"id": f"pi_{event_id}"}},
+    }
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(routes.router)
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    )
+
+
+@pytest.fixture
+def plan(monkeypatch):
+    project_id = uuid4()
+    plan = RoutingPlan(
+        project_id=project_id,
+        entries=(
+            ProviderEntry(
+                config_id=uuid4(),
+                provider_name="stripe",
+                is_primary=True,
+                priority=1,
+                credentials={"secret_key": "sk_test", "webhook_secret": SECRET},
+            ),
+        ),
+    )
+    monkeypatch.setattr(
+        routes.plan_cache,
+        "cached",
+        lambda requested: plan if requested == project_id else None,
+    )
+    return plan
+
+
+async def test_full_queue_answers_503(store, client, plan, monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_QUEUE_SIZE", 1)
+    monkeypatch.setattr(routes, "webhook_pipeline", WebhookPipeline())
+    routes.webhook_pipeline.start()
+    # the worker holds the first event, the second fills the queue
+    store.block = asyncio.Event()
+    url = f"/payments/webhooks/stripe/{plan.project_id}"
+
+    statuses = []
+    for index in range(3):
+        body, headers = signed(stripe_event(f"evt_{index}"))
+        statuses.append(
+            (await client.post(url, content=body, headers=headers)).status_code
+        )
+        await asyncio.sleep(0.02)
+    store.block.set()
+    await routes.webhook_pipeline.stop()
+
+    assert statuses == [202, 202, 503]
+
+
+async def test_unknown_project_is_not_cached(client, plan, monkeypatch):
+    async def get_project_by_id(db, project_id):
+        return None
+
+    async def build_plan(db, project_id):
+        raise AssertionError("no plan is built for an unknown project")
+
+    monkeypatch.setattr(routes.project_crud, "get_project_by_id", get_project_by_id)
+    monkeypatch.setattr(routes.plan_cache, "get", build_plan)
+    body, headers = signed(stripe_event("evt_1"))
+
+    response = await client.post(
+        f"/payments/webhooks/stripe/{uuid4()}", content=body, headers=headers
+    )
+
+    assert response.status_code == 404